@@ -1,4 +1,3 @@
-import csv
 from tkinter import messagebox
 import threading
 from p123api import Client, ClientException
@@ -15,10 +14,13 @@ from gui.console_logger_handler import ConsoleLoggerHandler
 import yaml
 import tkinter.filedialog as filedialog
 import os
-from utils.config import Config
+import shutil
+from utils.config import Config, get_app_user_folder
 import p123.operation as operation
-import platform
-from pathlib import Path
+import p123.cache as cache
+import p123.checkpoint as checkpoint
+import p123.export as export
+from gui.text_output import TextOutput
 from gui.scrolled_text_horizontal import ScrolledTextHorizontal
 import datetime
 import re
@@ -34,15 +36,16 @@ class Gui(GuiBase):
         self._main = None
 
         config_file = 'config.ini'
-        if platform.system() == 'Darwin':
-            app_user_folder = '{}/Library/Preferences/DataMiner'.format(Path.home())
-            Path(app_user_folder).mkdir(parents=True, exist_ok=True)
-            config_file = app_user_folder + '/' + config_file
-        elif platform.system() == 'Windows' or platform.system() == 'Linux':
-            app_user_folder = '{}/DataMiner'.format(Path.home())
-            Path(app_user_folder).mkdir(parents=True, exist_ok=True)
+        app_user_folder = get_app_user_folder()
+        if app_user_folder is not None:
             config_file = app_user_folder + '/' + config_file
         self._config = Config(self._logger, config_file)
+        self._cache = cache.init_from_config(config=self._config, app_user_folder=app_user_folder, logger=self._logger)
+        self._output_options = export.init_from_config(config=self._config, logger=self._logger)
+        self._checkpoint_folder = 'checkpoints'
+        if app_user_folder is not None:
+            self._checkpoint_folder = app_user_folder + '/' + self._checkpoint_folder
+        checkpoint.remove_expired(folder=self._checkpoint_folder)
 
         self._operation = None
 
@@ -461,7 +464,8 @@ class Gui(GuiBase):
 
     def _save_output(self, init: bool = True, from_btn: bool = True):
         """
-        Dumps content of the output (as csv) into user selected file.
+        Dumps content of the output into user selected file, format set by the file extension (csv, tsv,
+        compressed or not, parquet).
         Calls itself in a separate thread to avoid blocking and blocks operations that might
         cause a lock.
         """
@@ -475,15 +479,26 @@ class Gui(GuiBase):
             rows = self._operation.get_result() if self._operation is not None else None
             if rows:
                 if from_btn:
-                    file = filedialog.asksaveasfilename(defaultextension='.csv', filetypes=[('csv', '*.csv')])
+                    file = filedialog.asksaveasfilename(
+                        defaultextension='.csv',
+                        filetypes=[(file_format, '*.' + file_format) for file_format in export.FORMATS]
+                    )
                 else:
-                    file = self._auto_save_folder + '/' + str(self._operation.get_name()).lower() + '_' +\
-                           datetime.datetime.now().strftime('%Y%m%d_%H%M%S') + '.csv'
+                    file = self._auto_save_folder + '/' + export.get_file_name(
+                        self._operation.get_name(), self._output_options['format'])
                 if file:
-                    with open(file, 'w', newline='') as stream:
-                        csv_writer = csv.writer(stream)
-                        csv_writer.writerows(rows)
-                        self._logger.info('Output saved to ' + file)
+                    files = [file]
+                    if self._operation.is_output_streamed():
+                        # streamed into the auto save file, the rows are not in memory anymore
+                        if export.get_format(file) != export.get_format(self._operation.get_output_file()):
+                            raise OSError('Output was streamed into ' + self._operation.get_output_file()
+                                          + ', it can only be saved in the same format')
+                        shutil.copyfile(self._operation.get_output_file(), file)
+                    else:
+                        files = export.write_result(
+                            rows, file, self._operation.get_sections(),
+                            self._operation.get_output_options(self._output_options))
+                    self._logger.info('Output saved to ' + ', '.join(files))
             else:
                 self._logger.error('Output is empty')
         except OSError as e:
@@ -749,8 +764,14 @@ class Gui(GuiBase):
                     self._operation = operation.Operation.init(
                         api_client=self._api_client,
                         data=data,
-                        output=self._main['output'],
-                        logger=self._logger
+                        output=TextOutput(self._main['output']),
+                        logger=self._logger,
+                        cache=self._cache,
+                        checkpoint=self._init_checkpoint(data),
+                        output_file=self._auto_save_folder + '/' + export.get_file_name(
+                            data['Main']['Operation'], self._output_options['format']
+                        ) if self._auto_save.get() else None,
+                        output_options=self._output_options
                     )
             if self._operation is not None and not self._operation.is_finished():
                 self._operation.run()
@@ -766,6 +787,23 @@ class Gui(GuiBase):
             self._main['btn_execute_stop'].pack(side=tk.LEFT, padx=(5, 0), after=self._main['btn_execute'])
             self._logger.info('Paused')
 
+    def _init_checkpoint(self, data: dict):
+        """
+        Creates the checkpoint of the operation, offers to resume an interrupted run of the same input if any
+        """
+        try:
+            op_checkpoint = checkpoint.Checkpoint(folder=self._checkpoint_folder, data=data, logger=self._logger)
+        except OSError as e:
+            self._logger.warning(f'Checkpoints disabled ({e})')
+            return
+        completed_cnt = op_checkpoint.load()
+        if completed_cnt and not messagebox.askyesno(
+                title='Resume',
+                message=f'An interrupted run of this input was found ({completed_cnt} iterations completed).\n\n'
+                        'Resume it instead of starting over?'):
+            op_checkpoint.discard()
+        return op_checkpoint
+
     def _execute_stop(self, from_btn: bool = True):
         self.toggle_state(self._main['menu_input_open_cmd'], True)
         self.toggle_state(self._main['menu_input_close_cmd'], True)
@@ -781,7 +819,7 @@ class Gui(GuiBase):
             if self._operation is not None:
                 self._operation.stop()
             self._logger.info('Stopped')
-        elif self._auto_save.get():
+        elif self._auto_save.get() and (self._operation is None or self._operation.get_output_file() is None):
             self._save_output(True, False)
 
     def _clear_console(self):
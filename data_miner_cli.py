@@ -0,0 +1,113 @@
+"""
+Headless runner: validates and runs input files without the GUI, saving each result as csv (or any other format, see
+--format) into the output folder. Compressed outputs (.gz, .zst) use the levels of the [OUTPUT] section of config.ini.
+SQLite outputs (.sqlite) keep a table per operation that runs of the same input upsert their rows into.
+Inputs can be yaml input files, folders (all yaml files in them) or job manifests:
+    Jobs:
+      - inputs/ranks.yaml
+      - File: inputs/data
+        Priority: 10
+      - File: inputs/rank_perf.yaml
+        Output: rank_perf_core.csv
+Jobs with a higher priority are started first (default 0); several jobs can run at the same time in separate
+processes (--processes) while sharing a cap on the number of API requests in flight (--max-requests). Jobs relying on
+the server side API items (inline universes/ranking systems) never run at the same time. When running several jobs
+a summary of their outcome and duration is saved as summary.csv in the output folder.
+
+API credentials are read from the command line, the P123_API_ID/P123_API_KEY environment variables or the [API]
+section of config.ini, in this order.
+
+Exit codes:
+    0 - all operations done
+    1 - invalid input, internal error or an operation stopped on error ("On Error: Stop")
+    2 - all operations done but some iterations failed ("On Error: Continue")
+"""
+import argparse
+import logging
+import os
+import sys
+from pathlib import Path
+import cons
+from utils.config import Config, get_app_user_folder
+import p123.jobs as jobs
+import p123.export as export
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=f'{cons.NAME} v{cons.VERSION} command line runner')
+    parser.add_argument('inputs', nargs='+', help='input (yaml) files, folders or job manifests')
+    parser.add_argument('-o', '--output', default='.', help='output folder (default: current folder)')
+    parser.add_argument(
+        '-f', '--format', choices=export.FORMATS,
+        help='output format (default: "format" of the [OUTPUT] section of config.ini or csv), parquet requires '
+             'pyarrow and zst zstandard')
+    parser.add_argument('-p', '--processes', type=int, default=1, help='max number of jobs running at the same time')
+    parser.add_argument('--max-requests', type=int, help='max number of API requests in flight across all jobs')
+    parser.add_argument('--api-id', help='API id')
+    parser.add_argument('--api-key', help='API key')
+    parser.add_argument('--resume', action='store_true', help='resume interrupted runs of the same input')
+    parser.add_argument('--no-cache', action='store_true', help='do not use the response cache')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only log warnings and errors')
+    args = parser.parse_args(args)
+
+    logger = logging.getLogger('p123')
+    logger.setLevel(logging.WARNING if args.quiet else logging.INFO)
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s: %(levelname)s: %(name)s: %(message)s'))
+    logger.addHandler(handler)
+
+    config_file = 'config.ini'
+    app_user_folder = get_app_user_folder()
+    if app_user_folder is not None:
+        config_file = app_user_folder + '/' + config_file
+    config = Config(logger, config_file)
+
+    api_id = args.api_id or os.environ.get('P123_API_ID') or config.get('API', 'id', fallback=None)
+    api_key = args.api_key or os.environ.get('P123_API_KEY') or config.get('API', 'key', fallback=None)
+    if not api_id or not api_key:
+        logger.error('API id and key are required')
+        return jobs.EXIT_ERROR
+    if args.processes < 1 or (args.max_requests is not None and args.max_requests < 1):
+        logger.error('Number of processes and requests must be positive')
+        return jobs.EXIT_ERROR
+
+    try:
+        Path(args.output).mkdir(parents=True, exist_ok=True)
+    except OSError as e:
+        logger.error(e)
+        return jobs.EXIT_ERROR
+
+    file_format = args.format or export.init_from_config(config=config, logger=logger)['format']
+    job_list = jobs.load_jobs(inputs=args.inputs, logger=logger, file_format=file_format)
+    if not job_list:
+        if job_list is not None:
+            logger.error('No input files found')
+        return jobs.EXIT_ERROR
+
+    checkpoint_folder = 'checkpoints'
+    if app_user_folder is not None:
+        checkpoint_folder = app_user_folder + '/' + checkpoint_folder
+    reports = jobs.run_jobs(jobs=job_list, processes=args.processes, max_requests=args.max_requests, settings={
+        'api_id': api_id,
+        'api_key': api_key,
+        'output_folder': args.output,
+        'config_file': config_file,
+        'use_cache': not args.no_cache,
+        'app_user_folder': app_user_folder,
+        'checkpoint_folder': checkpoint_folder,
+        'resume': args.resume,
+        'log_level': logger.level
+    })
+    if len(reports) > 1:
+        jobs.write_summary(reports=reports, file=os.path.join(args.output, 'summary.csv'), logger=logger)
+
+    exit_codes = set(report['exit_code'] for report in reports)
+    if jobs.EXIT_ERROR in exit_codes:
+        return jobs.EXIT_ERROR
+    if jobs.EXIT_FAILED_ITERATIONS in exit_codes:
+        return jobs.EXIT_FAILED_ITERATIONS
+    return jobs.EXIT_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
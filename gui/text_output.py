@@ -0,0 +1,12 @@
+import tkinter as tk
+
+
+class TextOutput:
+    """Operation output previewed in a read-only Text widget"""
+    def __init__(self, text: tk.Text):
+        self._text = text
+
+    def write(self, text: str):
+        self._text.configure(state='normal')
+        self._text.insert(tk.END, text)
+        self._text.configure(state='disabled')
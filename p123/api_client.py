@@ -0,0 +1,196 @@
+import logging
+import hashlib
+import datetime
+import json
+import threading
+from p123api import Client, ClientException
+from p123.cache import ResponseCache
+from p123.dates import SnappedDates
+
+
+API_ITEMS = ('ApiUniverse', 'ApiRankingSystem')
+
+
+class ApiClient:
+    """
+    Wraps the API client for the duration of an operation: responses of the data requests are served from/stored
+    into the response cache, and the definitions uploaded into the server side API items are tracked so that
+    requests referring to them get a cache key matching the actual definition and uploads of a definition that is
+    already loaded are skipped.
+    Requests running in parallel share the session of the client, authentication is serialized: the client is
+    authenticated before the first request, and once more before retrying a request failing on an expired token.
+    Anything else is delegated to the wrapped client.
+    """
+    def __init__(self, *, client: Client, cache: ResponseCache = None, request_semaphore=None,
+                 logger: logging.Logger):
+        """
+        :param client:
+        :param cache:
+        :param request_semaphore: limits the number of requests in flight, may be shared with other operations
+        :param logger:
+        """
+        self._client = client
+        self._cache = cache
+        self._request_semaphore = request_semaphore
+        self._logger = logger
+        self._api_items = {}
+        self._lock = threading.Lock()
+        self._auth_lock = threading.Lock()
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._api_item_uploads = 0
+        self._api_item_uploads_skipped = 0
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    @staticmethod
+    def _get_definition_hash(params: dict):
+        return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _auth(self, token):
+        """
+        Authenticates the client unless another request did it since token was read
+        """
+        with self._auth_lock:
+            if self._client.get_token() == token:
+                self._client.auth()
+
+    def _auth_request(self, fn, params: dict):
+        token = self._client.get_token()
+        if token is None:
+            self._auth(token)
+            token = self._client.get_token()
+        try:
+            return fn(params)
+        except (ClientException, KeyError) as e:
+            # the client re-authenticates on its own after a 401, removing the authorization header of the shared
+            # session: a request failing at the same time finds it gone (KeyError)
+            resp = e.get_resp() if isinstance(e, ClientException) else None
+            if isinstance(e, ClientException) and (resp is None or resp.status_code not in (401, 403)):
+                raise
+        self._auth(token)
+        return fn(params)
+
+    def _request(self, fn, params: dict):
+        if self._request_semaphore is None:
+            return self._auth_request(fn, params)
+        with self._request_semaphore:
+            return self._auth_request(fn, params)
+
+    def _update_api_item(self, name: str, params: dict, update):
+        definition = self._get_definition_hash(params)
+        if self._api_items.get(name) == definition:
+            self._api_item_uploads_skipped += 1
+            return
+        # the item's content is unknown until the update succeeds
+        self._api_items.pop(name, None)
+        ret = self._request(update, params)
+        self._api_items[name] = definition
+        self._api_item_uploads += 1
+        return ret
+
+    def universe_update(self, params: dict):
+        return self._update_api_item('ApiUniverse', params, self._client.universe_update)
+
+    def rank_update(self, params: dict):
+        return self._update_api_item('ApiRankingSystem', params, self._client.rank_update)
+
+    def _resolve_api_items(self, value):
+        """
+        Replaces references to API items with the hash of their definition
+        :return: resolved value or None if it refers to an API item with an unknown definition
+        """
+        if isinstance(value, dict):
+            resolved = {}
+            for key, item in value.items():
+                resolved[key] = self._resolve_api_items(item)
+                if resolved[key] is None and item is not None:
+                    return
+            return resolved
+        if isinstance(value, list):
+            resolved = [self._resolve_api_items(item) for item in value]
+            return None if any(res is None and item is not None for res, item in zip(resolved, value)) else resolved
+        if value in API_ITEMS:
+            definition = self._api_items.get(value)
+            return f'{value}:{definition}' if definition is not None else None
+        return value
+
+    def _cached_request(self, endpoint: str, params: dict):
+        key = None
+        if self._cache is not None:
+            resolved_params = self._resolve_api_items(params)
+            if resolved_params is not None:
+                key = ResponseCache.get_key(f'{self._client.get_api_id()}/{endpoint}', resolved_params)
+                value = self._cache.get(key)
+                if value is not None:
+                    with self._lock:
+                        self._cache_hits += 1
+                    return value
+
+        value = self._request(getattr(self._client, endpoint), params)
+        if key is not None:
+            with self._lock:
+                self._cache_misses += 1
+            self._cache.set(key, params, value)
+        return value
+
+    def screen_run(self, params: dict):
+        return self._request(self._client.screen_run, params)
+
+    def screen_rolling_backtest(self, params: dict):
+        return self._cached_request('screen_rolling_backtest', params)
+
+    def screen_backtest(self, params: dict):
+        return self._cached_request('screen_backtest', params)
+
+    def data(self, params: dict):
+        return self._cached_request('data', params)
+
+    def data_universe(self, params: dict):
+        return self._cached_request('data_universe', params)
+
+    def rank_ranks(self, params: dict):
+        return self._cached_request('rank_ranks', params)
+
+    def _get_snapped_dates_key(self, endpoint: str, context: dict):
+        return ResponseCache.get_key(f'{self._client.get_api_id()}/{endpoint}/snapped_dates', context)
+
+    def get_snapped_dates(self, endpoint: str, context: dict):
+        """
+        :param endpoint:
+        :param context: request params the dates the server has data for depend on (vendor, ...)
+        :return: SnappedDates of the endpoint known from previous runs (none if the cache is not used)
+        """
+        if self._cache is None:
+            return SnappedDates()
+        return SnappedDates(self._cache.get(self._get_snapped_dates_key(endpoint, context)))
+
+    def save_snapped_dates(self, endpoint: str, context: dict, snapped_dates: SnappedDates):
+        """
+        Merges the snapped dates into the ones stored in the cache
+        """
+        if self._cache is None:
+            return
+        key = self._get_snapped_dates_key(endpoint, context)
+        merged = SnappedDates(self._cache.get(key))
+        for snapped, as_of in snapped_dates.get_ranges():
+            merged.add(datetime.date.fromisoformat(as_of), datetime.date.fromisoformat(snapped))
+        # the stored ranges are all final already
+        ranges = merged.get_ranges(final=False)
+        if ranges:
+            # final ranges do not change, unlike responses for recent dates they must not expire
+            self._cache.set(key, {'asOfDt': ranges[0][1]}, ranges)
+
+    def get_cache_stats(self):
+        """
+        :return: (hits, misses) or None if the cache is not used
+        """
+        if self._cache is not None:
+            return self._cache_hits, self._cache_misses
+
+    def get_api_item_stats(self):
+        """
+        :return: (uploads, skipped uploads) of API item definitions
+        """
+        return self._api_item_uploads, self._api_item_uploads_skipped
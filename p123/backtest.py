@@ -0,0 +1,397 @@
+"""
+Local backtest analytics.
+Rank performance engine: instead of one screen backtest per bucket, the ranks of the universe are pulled once per
+rebalance date along with the forward return of each stock (rank_ranks "Additional Data"), then the buckets are
+formed and their returns and metrics computed locally. The bucket count has no effect on the number of requests.
+Screen backtest chart stats: return and risk stats of sub-periods and rolling windows of the chart of a screen
+backtest, without running a new backtest for each of them.
+"""
+import array
+import bisect
+import datetime
+import functools
+import itertools
+import math
+import operator
+import utils.misc as misc
+import p123.data.cons as data_cons
+import p123.util as util
+
+# metrics only the local engine has, after data_cons.RANK_PERF_METRICS
+RANK_PERF_LOCAL_METRICS = ('Avg turnover %',)
+
+
+def get_rebalance_days(rebal_freq):
+    """
+    :param rebal_freq: "rebalFreq" param value (see data_cons.SCREEN_BACKTEST_FREQ), None for the weekly default
+    :return: days between rebalance dates
+    """
+    for item in data_cons.FREQ:
+        if item['value'] == rebal_freq:
+            return item['days']
+    return data_cons.FREQ[1]['days']
+
+
+def get_rebalance_dates(start_dt: str, end_dt, days: int):
+    """
+    :param start_dt: first rebalance date (YYYY-MM-DD)
+    :param end_dt: last possible rebalance date (YYYY-MM-DD), today if None
+    :param days: days between rebalance dates
+    :return: rebalance dates (YYYY-MM-DD)
+    """
+    date = datetime.date.fromisoformat(start_dt)
+    end_date = datetime.date.today() if end_dt is None else min(datetime.date.fromisoformat(end_dt),
+                                                                 datetime.date.today())
+    dates = []
+    while date <= end_date:
+        dates.append(str(date))
+        date += datetime.timedelta(days=days)
+    return dates
+
+
+def get_return_formula(days: int):
+    """
+    :return: formula of the % return of a stock until the next rebalance date (5 trading days a week)
+    """
+    return f'Future%Chg({max(1, round(days * 5 / 7))})'
+
+
+def get_bench_returns(json, dates: list):
+    """
+    Benchmark return of each rebalance period from a data response of the benchmark and the return formula
+    :param json: data response, None if it failed
+    :param dates: dates of the rank responses (None for failed ones)
+    :return: list of returns (None where unknown)
+    """
+    if json is None or not json.get('items'):
+        return [None] * len(dates)
+    series = next(iter(json['items'].values()))['series'][0]
+    data_dates = json['dates']
+    returns = []
+    for date in dates:
+        # last data date on or before the rank date
+        idx = bisect.bisect_right(data_dates, date) - 1 if date is not None else -1
+        returns.append(series[idx] if idx >= 0 else None)
+    return returns
+
+
+def _get_bucket_idxs(ranks, buckets: int):
+    """
+    :return: bucket of each rank, same bounds as the "Rank >= start and Rank < end" rules of the server engine
+    """
+    bounds = [round(100 / buckets * idx, 2) for idx in range(1, buckets)]
+    return array.array('b', map(functools.partial(bisect.bisect_right, bounds), ranks))
+
+
+class _Series:
+    """
+    Period by period values of a bucket (or of the universe)
+    """
+    def __init__(self):
+        self.returns = array.array('d')
+        self.bench = []
+        self.positions = array.array('d')
+        self.turnover = array.array('d')
+        self.stock_max = None
+        self.stock_min = None
+        self._prev_uids = None
+
+    def add_period(self, uids: list, returns: list, bench, slippage):
+        """
+        :param uids: stocks held for the period, none to stay in cash (flat period)
+        :param returns: their forward returns (%), already signed for short buckets
+        :param bench: benchmark return of the period, None if unknown
+        :param slippage: % cost of each trade
+        """
+        cnt = len(uids)
+        if not cnt:
+            # the period still counts so that compounded returns and period counts line up across buckets
+            self._prev_uids = None
+            self.returns.append(0.0)
+            self.bench.append(bench)
+            self.positions.append(0)
+            return
+        uid_set = set(uids)
+        if self._prev_uids is None:
+            bought, sold = 1.0, 0.0
+        else:
+            kept = len(uid_set & self._prev_uids)
+            bought = (cnt - kept) / cnt
+            sold = (len(self._prev_uids) - kept) / len(self._prev_uids)
+            self.turnover.append(bought * 100)
+        self._prev_uids = uid_set
+        self.returns.append(math.fsum(returns) / cnt - (bought + sold) * slippage)
+        self.bench.append(bench)
+        self.positions.append(cnt)
+        stock_max = max(returns)
+        stock_min = min(returns)
+        self.stock_max = stock_max if self.stock_max is None else max(self.stock_max, stock_max)
+        self.stock_min = stock_min if self.stock_min is None else min(self.stock_min, stock_min)
+
+
+def _get_max_drawdown(equity):
+    """
+    :param equity: equity curve, falling to 0 (or below) from a positive peak counts as a -100% drawdown
+    :return: max drawdown (%) of the curve
+    """
+    return min(val / peak if peak > 0 else 0.0 for val, peak in zip(equity, itertools.accumulate(equity, max))) \
+        * 100 - 100
+
+
+def _get_return_stats(returns, periods_per_year):
+    """
+    :return: annualized return, total return, sharpe, sortino, annualized standard deviation, max drawdown
+    """
+    cnt = len(returns)
+    equity = list(itertools.accumulate(returns, lambda val, ret: val * (1 + ret / 100), initial=1.0))
+    total = (equity[-1] - 1) * 100
+    annualized = (equity[-1] ** (periods_per_year / cnt) - 1) * 100 if equity[-1] > 0 else -100.0
+    max_drawdown = _get_max_drawdown(equity)
+    mean = math.fsum(returns) / cnt
+    std_dev = math.sqrt(math.fsum((ret - mean) ** 2 for ret in returns) / (cnt - 1)) if cnt > 1 else None
+    downside_dev = math.sqrt(math.fsum(min(ret, 0.0) ** 2 for ret in returns) / cnt)
+    scale = math.sqrt(periods_per_year)
+    return (
+        annualized, total,
+        mean / std_dev * scale if std_dev else None,
+        mean / downside_dev * scale if downside_dev else None,
+        std_dev * scale if std_dev is not None else None,
+        max_drawdown
+    )
+
+
+def _get_beta_alpha(returns, bench, periods_per_year):
+    """
+    :return: beta and annualized alpha of the returns against the benchmark returns (None if the benchmark is flat)
+    """
+    mean = math.fsum(returns) / len(returns)
+    bench_mean = math.fsum(bench) / len(bench)
+    bench_var = math.fsum((val - bench_mean) ** 2 for val in bench)
+    if not bench_var:
+        return None, None
+    beta = math.fsum((ret - mean) * (val - bench_mean) for ret, val in zip(returns, bench)) / bench_var
+    return beta, (mean - beta * bench_mean) * periods_per_year
+
+
+def _get_metrics(series: _Series, periods_per_year):
+    """
+    :return: values of data_cons.RANK_PERF_METRICS and RANK_PERF_LOCAL_METRICS for a bucket or the universe
+    """
+    returns = series.returns
+    if not returns:
+        return None
+    annualized, total, sharpe, sortino, std_dev, max_drawdown = _get_return_stats(returns, periods_per_year)
+    pairs = [(ret, bench) for ret, bench in zip(returns, series.bench) if bench is not None]
+    excess = alpha = beta = up_excess = down_excess = outperform = None
+    if pairs:
+        port, bench = zip(*pairs)
+        excess = annualized - _get_return_stats(bench, periods_per_year)[0]
+        outperform = sum(ret > bench_ret for ret, bench_ret in pairs) / len(pairs) * 100
+        up = [ret - bench_ret for ret, bench_ret in pairs if bench_ret > 0]
+        down = [ret - bench_ret for ret, bench_ret in pairs if bench_ret < 0]
+        up_excess = math.fsum(up) / len(up) if up else None
+        down_excess = math.fsum(down) / len(down) if down else None
+        beta, alpha = _get_beta_alpha(port, bench, periods_per_year)
+    values = [annualized, excess, total, outperform, max(returns), min(returns), series.stock_max, series.stock_min,
+              up_excess, down_excess, sharpe, sortino, std_dev, max_drawdown, beta, alpha,
+              math.fsum(series.positions) / len(series.positions),
+              math.fsum(series.turnover) / len(series.turnover) if series.turnover else None]
+    return values
+
+
+def _get_bench_metrics(bench: list, periods_per_year):
+    """
+    :return: values of data_cons.RANK_PERF_METRICS and RANK_PERF_LOCAL_METRICS for the benchmark
+    """
+    returns = [ret for ret in bench if ret is not None]
+    if not returns:
+        return None
+    annualized, total, sharpe, sortino, std_dev, max_drawdown = _get_return_stats(returns, periods_per_year)
+    values = [annualized, None, total, None, max(returns), min(returns)] + [None] * 4 \
+        + [sharpe, sortino, std_dev, max_drawdown] + [None] * 4
+    return values
+
+
+def process_rank_perf(*, rank_jsons: list, bench_json, buckets: int, short: bool = False, min_price=None,
+                      slippage=None, days: int, precision, bucket_metrics: bool = False):
+    """
+    Rank performance metrics of an iteration from the ranks of each rebalance date
+    :param rank_jsons: rank_ranks responses in date order (None for failed ones), with the return formula as first
+        additional data and "close(0)" as second one when there is a minimum price
+    :param bench_json: data response of the benchmark and the return formula, None when there is no benchmark (the
+        universe stands in for it in the excess return metrics) or it failed
+    :param buckets:
+    :param short: short buckets, returns are negated
+    :param min_price: stocks below it are left out
+    :param slippage: % cost of each trade, charged on the bought and sold part of each bucket
+    :param days: days between rebalance dates
+    :param precision:
+    :param bucket_metrics: add data_cons.RANK_PERF_BUCKET_METRICS, given in the universe column
+    :return: same rows as util.process_rank_perf_results, with RANK_PERF_LOCAL_METRICS after RANK_PERF_METRICS
+    """
+    if precision is None:
+        precision = 2
+    slippage = slippage or 0.0
+    sign = -1.0 if short else 1.0
+    series = [_Series() for _ in range(buckets + 1)]
+    has_bench = bench_json is not None
+    bench_returns = get_bench_returns(bench_json, [json['dt'] if json is not None else None for json in rank_jsons])
+
+    for json, bench in zip(rank_jsons, bench_returns):
+        if json is None:
+            continue
+        additional_data = json.get('additionalData') or []
+        # stocks without a rank or a forward return (or below the minimum price) are left out of the period
+        stocks = [(uid, rank, data[0] * sign)
+                  for uid, rank, data in zip(json['p123Uids'], json['ranks'], additional_data)
+                  if rank is not None and data[0] is not None
+                  and (min_price is None or (data[1] is not None and data[1] >= min_price))]
+        uids, ranks, returns = zip(*stocks) if stocks else ((), (), ())
+        universe_ret = math.fsum(returns) / len(returns) if returns else 0.0
+        if not has_bench:
+            bench = universe_ret
+        bucket_uids = [[] for _ in range(buckets)]
+        bucket_returns = [[] for _ in range(buckets)]
+        for uid, bucket_idx, ret in zip(uids, _get_bucket_idxs(ranks, buckets), returns):
+            bucket_uids[bucket_idx].append(uid)
+            bucket_returns[bucket_idx].append(ret)
+        for bucket_idx in range(buckets):
+            series[bucket_idx].add_period(bucket_uids[bucket_idx], bucket_returns[bucket_idx], bench, slippage)
+        series[-1].add_period(uids, returns, bench, slippage)
+
+    periods_per_year = 365.25 / days
+    columns = [_get_metrics(item, periods_per_year) for item in series]
+    columns.append(_get_bench_metrics(series[-1].bench, periods_per_year) if has_bench else None)
+    metrics = data_cons.RANK_PERF_METRICS + RANK_PERF_LOCAL_METRICS
+    rows = [[metric] + [misc.round_or_none(column[idx], precision) if column is not None else None
+                        for column in columns] for idx, metric in enumerate(metrics)]
+    if bucket_metrics:
+        rows += util.get_rank_perf_bucket_rows(
+            [column[0] if column is not None else None for column in columns[:-2]], precision)
+    return rows
+
+
+CHART_STATS_COLUMNS = [
+    'Periods', 'Tot Return', 'Ann Return', 'Bench Ann Return', 'Max Dd', 'Sharpe', 'Sortino', 'StdDev', 'Beta',
+    'Alpha'
+]
+CHART_ROLLING_STATS = ['Ann Return', 'Max Dd', 'Sharpe', 'Sortino', 'Beta', 'Alpha']
+
+
+class Chart:
+    """
+    Chart of a screen backtest: the screen and benchmark returns are cumulative % returns since the first date, they
+    are turned into the returns of each chart period (from the previous date)
+    """
+    def __init__(self, chart: dict):
+        self.dates = chart['dates']
+        self.returns = self._get_period_returns(chart['screenReturns'])
+        self.bench = self._get_period_returns(chart['benchReturns'])
+        self.equity = array.array('d', (1 + val / 100 for val in chart['screenReturns']))
+        # chart periods a year, from the average period length
+        self.periods_per_year = None
+        if len(self.dates) > 1:
+            days = (datetime.date.fromisoformat(self.dates[-1]) - datetime.date.fromisoformat(self.dates[0])).days
+            if days > 0:
+                self.periods_per_year = 365.25 * (len(self.dates) - 1) / days
+
+    @staticmethod
+    def _get_period_returns(values):
+        equity = [1 + val / 100 for val in values]
+        return array.array('d', ((val / prev - 1) * 100 if prev else 0.0 for prev, val in zip(equity, equity[1:])))
+
+    def get_stats(self, start_idx, end_idx):
+        """
+        :param start_idx: index of the first date of the period
+        :param end_idx: index of the last date of the period
+        :return: values of CHART_STATS_COLUMNS, None if the period does not have at least one chart period
+        """
+        if self.periods_per_year is None or end_idx <= start_idx:
+            return None
+        returns = self.returns[start_idx:end_idx]
+        bench = self.bench[start_idx:end_idx]
+        annualized, total, sharpe, sortino, std_dev, max_drawdown = _get_return_stats(returns, self.periods_per_year)
+        beta, alpha = _get_beta_alpha(returns, bench, self.periods_per_year)
+        return [len(returns), total, annualized, _get_return_stats(bench, self.periods_per_year)[0], max_drawdown,
+                sharpe, sortino, std_dev, beta, alpha]
+
+    def get_rolling_stats(self, window: int):
+        """
+        Stats of the last "window" chart periods at each date. Return, risk and benchmark stats come from running
+        sums of the returns, the max drawdown is recomputed over the equity of each window (O(window) per date).
+        :return: list of values of CHART_ROLLING_STATS for each date (None until the window is full)
+        """
+        cnt = len(self.dates)
+        if self.periods_per_year is None or window < 2 or window >= cnt:
+            return [None] * cnt
+        ppy = self.periods_per_year
+        scale = math.sqrt(ppy)
+        sums = list(itertools.accumulate(self.returns, initial=0.0))
+        squares = list(itertools.accumulate(map(operator.mul, self.returns, self.returns), initial=0.0))
+        downside = list(itertools.accumulate((min(ret, 0.0) ** 2 for ret in self.returns), initial=0.0))
+        bench_sums = list(itertools.accumulate(self.bench, initial=0.0))
+        bench_squares = list(itertools.accumulate(map(operator.mul, self.bench, self.bench), initial=0.0))
+        products = list(itertools.accumulate(map(operator.mul, self.returns, self.bench), initial=0.0))
+        stats = [None] * window
+        for end in range(window, cnt):
+            start = end - window
+            total = sums[end] - sums[start]
+            mean = total / window
+            variance = max(0.0, (squares[end] - squares[start] - total * mean) / (window - 1))
+            downside_dev = math.sqrt(max(0.0, downside[end] - downside[start]) / window)
+            bench_total = bench_sums[end] - bench_sums[start]
+            bench_var = bench_squares[end] - bench_squares[start] - bench_total * bench_total / window
+            beta = alpha = None
+            if bench_var > 0:
+                beta = (products[end] - products[start] - total * bench_total / window) / bench_var
+                alpha = (mean - beta * bench_total / window) * ppy
+            growth = self.equity[end] / self.equity[start] if self.equity[start] else 0.0
+            stats.append([
+                (growth ** (ppy / window) - 1) * 100 if growth > 0 else -100.0,
+                _get_max_drawdown(self.equity[start:end + 1]),
+                mean / math.sqrt(variance) * scale if variance else None,
+                mean / downside_dev * scale if downside_dev else None,
+                beta, alpha
+            ])
+        return stats
+
+    def get_idx_range(self, start_date, end_date):
+        """
+        :param start_date: first date of the period (YYYY-MM-DD), None for the first chart date
+        :param end_date: last date of the period (YYYY-MM-DD), None for the last chart date
+        :return: indexes of the first and last chart dates of the period
+        """
+        start_idx = 0 if start_date is None else bisect.bisect_left(self.dates, start_date)
+        end_idx = len(self.dates) - 1 if end_date is None else bisect.bisect_right(self.dates, end_date) - 1
+        return start_idx, end_idx
+
+
+def process_screen_backtest_chart(chart: dict, sub_periods: list, windows: list, precision):
+    """
+    Stats of sub-periods and rolling windows of the chart of a screen backtest
+    :param chart: "chart" of a screen_backtest response
+    :param sub_periods: list of (name, start date, end date), dates as YYYY-MM-DD or None for the chart bounds
+    :param windows: number of chart periods of each rolling window
+    :param precision:
+    :return: sub-period rows (name, start, end, then CHART_STATS_COLUMNS values), rolling rows (date then
+        CHART_ROLLING_STATS values for each window)
+    """
+    if precision is None:
+        precision = 2
+    chart = Chart(chart)
+    sub_period_rows = []
+    for name, start_date, end_date in sub_periods:
+        start_idx, end_idx = chart.get_idx_range(start_date, end_date)
+        stats = chart.get_stats(start_idx, end_idx)
+        row = [name, chart.dates[start_idx] if start_idx < len(chart.dates) else start_date,
+               chart.dates[end_idx] if end_idx >= 0 else end_date]
+        row += [misc.round_or_none(val, precision) for val in stats] if stats is not None \
+            else [None] * len(CHART_STATS_COLUMNS)
+        sub_period_rows.append(row)
+
+    rolling_rows = [[date] for date in chart.dates]
+    for window in windows:
+        for row, stats in zip(rolling_rows, chart.get_rolling_stats(window)):
+            row += [misc.round_or_none(val, precision) for val in stats] if stats is not None \
+                else [None] * len(CHART_ROLLING_STATS)
+    return sub_period_rows, rolling_rows
@@ -0,0 +1,159 @@
+import logging
+import os
+import gzip
+import json
+import time
+import hashlib
+import datetime
+import threading
+import configparser
+from pathlib import Path
+
+
+class ResponseCache:
+    """
+    Persistent, content addressed cache of API responses. Every entry is a gzipped json file named after the hash of
+    its key; the least recently used entries are evicted once the cache grows over its size limit. Responses for
+    dates close to today can still change, so they expire after a configurable time.
+    """
+    def __init__(self, *, folder: str, max_size: int, recent_days: int, recent_ttl: int, logger: logging.Logger):
+        """
+        :param folder: cache folder (created if missing)
+        :param max_size: max cache size in bytes
+        :param recent_days: requests ending at most this many days ago are considered recent
+        :param recent_ttl: seconds after which recent entries expire, 0 disables caching recent requests
+        :param logger:
+        """
+        self._folder = folder
+        self._max_size = max_size
+        self._recent_days = recent_days
+        self._recent_ttl = recent_ttl
+        self._logger = logger
+        self._lock = threading.Lock()
+        Path(self._folder).mkdir(parents=True, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in os.scandir(self._folder) if entry.name.endswith('.gz'))
+
+    @staticmethod
+    def get_key(endpoint: str, params: dict):
+        return hashlib.sha256(
+            (endpoint + ':' + json.dumps(params, sort_keys=True, separators=(',', ':'), default=str)).encode()
+        ).hexdigest()
+
+    def _get_file(self, key: str):
+        return os.path.join(self._folder, key + '.gz')
+
+    def _is_recent(self, params: dict):
+        date = params.get('endDt') or params.get('asOfDt')
+        if not date:
+            # open ended requests run up to today
+            return True
+        try:
+            date = datetime.date.fromisoformat(str(date)[:10])
+        except ValueError:
+            return True
+        return (datetime.date.today() - date).days <= self._recent_days
+
+    def get(self, key: str):
+        """
+        :return: the cached response or None
+        """
+        file = self._get_file(key)
+        try:
+            with gzip.open(file, 'rt', encoding='utf-8') as stream:
+                entry = json.load(stream)
+            if entry['expires'] is not None and entry['expires'] < time.time():
+                self._remove(file)
+                return
+            # keep track of usage for the LRU eviction
+            os.utime(file)
+            return entry['value']
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError, EOFError) as e:
+            self._logger.warning(f'Cache entry {key} is corrupted ({e}), discarding it')
+            self._remove(file)
+
+    def set(self, key: str, params: dict, value):
+        expires = None
+        if self._is_recent(params):
+            if not self._recent_ttl:
+                return
+            expires = time.time() + self._recent_ttl
+
+        file = self._get_file(key)
+        tmp_file = f'{file}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with gzip.open(tmp_file, 'wt', encoding='utf-8', compresslevel=1) as stream:
+                json.dump({'expires': expires, 'value': value}, stream, separators=(',', ':'))
+            size = os.path.getsize(tmp_file)
+            if os.path.exists(file):
+                size -= os.path.getsize(file)
+            os.replace(tmp_file, file)
+        except OSError as e:
+            self._logger.warning(f'Unable to write cache entry ({e})')
+            self._remove(tmp_file)
+            return
+
+        with self._lock:
+            self._size += size
+            if self._size > self._max_size:
+                self._evict()
+
+    def _remove(self, file: str):
+        try:
+            size = os.path.getsize(file)
+            os.remove(file)
+            with self._lock:
+                self._size -= size
+        except OSError:
+            pass
+
+    def _evict(self):
+        """
+        Removes least recently used entries until the cache is down to 90% of its size limit
+        """
+        entries = []
+        self._size = 0
+        for entry in os.scandir(self._folder):
+            if entry.name.endswith('.gz'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                self._size += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if self._size <= self._max_size * 0.9:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                pass
+
+
+def init_from_config(*, config: configparser.ConfigParser, app_user_folder, logger: logging.Logger):
+    """
+    Creates the response cache from the [CACHE] section of the config:
+        enabled - yes/no (default yes)
+        folder - cache folder (default "cache" in the app user folder)
+        max_size_mb - default 2048
+        recent_days - requests ending at most this many days ago are recent (default 7)
+        recent_ttl_hours - hours after which cached recent requests expire, 0 disables caching them (default 12)
+    :return: ResponseCache or None if disabled
+    """
+    try:
+        if not config.getboolean('CACHE', 'enabled', fallback=True):
+            return
+        folder = config.get('CACHE', 'folder', fallback=None)
+        if not folder:
+            if app_user_folder is None:
+                return
+            folder = os.path.join(app_user_folder, 'cache')
+        return ResponseCache(
+            folder=folder,
+            max_size=config.getint('CACHE', 'max_size_mb', fallback=2048) * 1024 * 1024,
+            recent_days=config.getint('CACHE', 'recent_days', fallback=7),
+            recent_ttl=int(config.getfloat('CACHE', 'recent_ttl_hours', fallback=12) * 3600),
+            logger=logger
+        )
+    except (ValueError, OSError) as e:
+        logger.warning(f'Response cache disabled ({e})')
@@ -0,0 +1,184 @@
+import logging
+import os
+import json
+import time
+import pickle
+import hashlib
+import datetime
+import threading
+from pathlib import Path
+import utils.misc as misc
+
+
+# "Main" properties that do not affect the result of an operation
+_IGNORED_MAIN_PROPS = ('Concurrency', 'Bypass Cache', 'Reorder Iterations', 'Memory Limit', 'Incremental')
+# "Default Settings" properties that only set the range of dates of an operation
+_DATE_RANGE_PROPS = ('Start Date', 'End Date')
+
+
+def _strip_meta_info(value):
+    if misc.is_dict(value):
+        if 'meta_info' in value and 'value' in value:
+            return _strip_meta_info(value['value'])
+        return {key: _strip_meta_info(item) for key, item in value.items()}
+    if misc.is_list(value):
+        return [_strip_meta_info(item) for item in value]
+    return value
+
+
+def get_input_hash(data: dict):
+    """
+    :param data: validated input (with meta info annotations)
+    :return: hash of the input properties that affect the result of the operation
+    """
+    data = _strip_meta_info(data)
+    data['Main'] = {key: value for key, value in data['Main'].items() if key not in _IGNORED_MAIN_PROPS}
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_run_key(data: dict):
+    """
+    :param data: validated input (with meta info annotations)
+    :return: key of the input regardless of its date range, runs of the same input over more dates share it
+    """
+    data = dict(data, **{'Default Settings': {
+        key: value for key, value in data['Default Settings'].items() if key not in _DATE_RANGE_PROPS}})
+    return get_input_hash(data)[:16]
+
+
+class Checkpoint:
+    """
+    Append-only journal of the completed tasks of an operation, kept on disk so that an interrupted run (crash, closed
+    window, network outage) of the same input can be resumed instead of started over. The journal file is created
+    with the first completed task and removed once the operation is done.
+    """
+    def __init__(self, *, folder: str, data: dict, logger: logging.Logger):
+        self._logger = logger
+        self._input_hash = get_input_hash(data)
+        self._file = os.path.join(folder, self._input_hash + '.ckpt')
+        self._lock = threading.Lock()
+        self._stream = None
+        self._valid_size = 0
+        self._task_idxs = set()
+        self._results = {}
+        self._runs = {}
+        # hash of the tasks the journal was written for, see set_task_key
+        self._task_hash = None
+        self._loaded_task_hash = None
+        Path(folder).mkdir(parents=True, exist_ok=True)
+
+    def load(self):
+        """
+        Reads the journal of a previous run of the same input, a record truncated by a crash ends the journal.
+        :return: number of completed tasks found
+        """
+        self._results = {}
+        self._runs = {}
+        try:
+            with open(self._file, 'rb') as stream:
+                header = pickle.load(stream)
+                if header.get('hash') != self._input_hash:
+                    raise ValueError('input hash mismatch')
+                self._loaded_task_hash = header.get('tasks')
+                self._valid_size = stream.tell()
+                while True:
+                    try:
+                        record = pickle.load(stream)
+                    except EOFError:
+                        break
+                    if record[0] == 'result':
+                        self._results[record[1]] = record[2]
+                    elif record[0] == 'run':
+                        self._runs.setdefault(record[1], {})[record[2]] = record[3]
+                    self._valid_size = stream.tell()
+        except FileNotFoundError:
+            return 0
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError, AttributeError, IndexError, TypeError) as e:
+            if not self._valid_size:
+                self._logger.warning(f'Checkpoint is corrupted ({e}), discarding it')
+                self.discard()
+                return 0
+        self._task_idxs = set(self._results)
+        return len(self._results)
+
+    def set_task_key(self, task_key):
+        """
+        Results are restored by task index: a journal written for other tasks than the operation's (same input, but
+        tasks depending on the state of the cache when the run started) is discarded
+        :param task_key: see Operation._get_task_key
+        """
+        self._task_hash = hashlib.sha256(json.dumps(task_key).encode()).hexdigest() if task_key is not None else None
+        if self._valid_size and self._loaded_task_hash != self._task_hash:
+            self._logger.warning('Checkpoint was written for other tasks, discarding it')
+            self.discard()
+
+    def pop_results(self):
+        """
+        :return: dict of the results of the completed tasks by task index
+        """
+        results = self._results
+        self._results = {}
+        return results
+
+    def pop_runs(self):
+        """
+        :return: dict of the partial runs of unfinished tasks: task index => {run index => result}
+        """
+        runs = self._runs
+        self._runs = {}
+        return runs
+
+    def _write(self, record):
+        with self._lock:
+            try:
+                if self._stream is None:
+                    if self._valid_size:
+                        # resuming, drop a record truncated by a crash
+                        self._stream = open(self._file, 'r+b')
+                        self._stream.truncate(self._valid_size)
+                        self._stream.seek(self._valid_size)
+                    else:
+                        self._stream = open(self._file, 'wb')
+                        pickle.dump({'hash': self._input_hash, 'tasks': self._task_hash,
+                                     'created': str(datetime.datetime.now())}, self._stream)
+                pickle.dump(record, self._stream, protocol=pickle.HIGHEST_PROTOCOL)
+                self._stream.flush()
+            except OSError as e:
+                self._logger.warning(f'Unable to write checkpoint ({e})')
+
+    def add_result(self, idx: int, result):
+        if idx not in self._task_idxs:
+            self._task_idxs.add(idx)
+            self._write(('result', idx, result))
+
+    def add_run(self, idx: int, run_idx: int, result):
+        self._write(('run', idx, run_idx, result))
+
+    def close(self):
+        with self._lock:
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
+
+    def discard(self):
+        self.close()
+        self._valid_size = 0
+        self._task_idxs = set()
+        self._results = {}
+        self._runs = {}
+        try:
+            os.remove(self._file)
+        except OSError:
+            pass
+
+
+def remove_expired(*, folder: str, max_age_days: int = 14):
+    """
+    Removes checkpoints of runs that were never resumed
+    """
+    try:
+        for entry in os.scandir(folder):
+            if entry.name.endswith('.ckpt') and entry.stat().st_mtime < time.time() - max_age_days * 86400:
+                os.remove(entry.path)
+    except OSError:
+        pass
@@ -5,16 +5,22 @@ RANK_PERF_METRICS = (
     'Avg excess return in Down Markets', 'Sharpe', 'Sortino', 'StdDev', 'Max Drawdown', 'Beta', 'Alpha',
     'Avg # of positions'
 )
+# metrics of the buckets as a whole: slope of their annualized returns by bucket, spearman correlation of buckets
+# and returns, top bucket return minus bottom bucket return
+RANK_PERF_BUCKET_METRICS = ('Bucket return slope', 'Bucket return monotonicity', 'Top minus bottom spread')
 RANK_PERF_METHOD = {'long': 'long', 'short': 'short'}
+# server: one screen backtest per bucket, local: buckets formed from the ranks of each rebalance date
+# (see p123.backtest)
+RANK_PERF_ENGINES = ('server', 'local')
 ROLLING_SCREEN_COLUMNS = [
     {'name': 'Name', 'justify': 'left'},
     {'name': 'Start', 'justify': 'left', 'length': 10},
     {'name': 'End', 'justify': 'left', 'length': 10},
     'Periods', 'Avg#Pos', 'AvgRet%', 'AvgBench%', 'AvgExcess%',
-    'Min%NoSlip', 'Max%NoSlip', 'AvgStdDev', 'Last13AvgRet%', 'Last65AvgRet%',
-    'GeoMeanRet%', 'GeoMeanBench%', 'Last13GeoMeanRet%', 'Last65GeoMeanRet%',
-    'Last65Avg#Pos'
+    'Min%NoSlip', 'Max%NoSlip', 'AvgStdDev'
 ]
+# lookback windows (most recent periods) of the rolling screen stats, see util.get_rolling_screen_columns
+ROLLING_SCREEN_WINDOWS = [13, 65]
 ROLLING_SCREEN_COLUMNS_ALL = [
     'As of Dt', 'Rank Dt', 'Tran Dt', 'End Dt', '#Pos', 'Ret%', 'Bench%', 'Excess%', 'Min % no slip', 'Max % no slip',
     'StdDev'
@@ -32,6 +38,10 @@ FREQ = [
     {'label': '52weeks', 'value': 'Every 52 Weeks', 'days': 7 * 52}
 ]
 FREQ_BY_LABEL = {item['label']: item for item in FREQ}
+# max number of items of a data request, longer item lists are split into shards of this size
+DATA_SHARD_SIZE = 100
+# max number of values (dates x items x formulas) of a data request, longer date ranges are split into chunks
+DATA_CHUNK_VALUES = 200000
 SCREEN_METHOD = {'long': 'long', 'short': 'short', 'longshort': 'long/short', 'hedged': 'hedged'}
 SCREEN_ROLLING_BACKTEST_FREQ = {'1week': FREQ_BY_LABEL['1week']['value'], '4weeks': FREQ_BY_LABEL['4weeks']['value']}
 SCREEN_BACKTEST_FREQ = {item['label']: item['value'] for item in FREQ}
@@ -66,6 +66,16 @@ def screen_ranking(*, value, settings: dict, api_client: Client):
     return params
 
 
+def api_item(*, value, transform_fn):
+    """
+    Name of the server side item an inline definition gets uploaded to by its transform function, if any
+    """
+    if transform_fn is universe and misc.is_dict(value):
+        return 'ApiUniverse'
+    if transform_fn is screen_ranking and misc.is_dict(value) and 'Formula' not in value:
+        return 'ApiRankingSystem'
+
+
 def escape_xml_attr(data):
     return data.replace('"', '&quot;')
 
@@ -230,10 +230,44 @@ def screen_rolling_backtest_holding_period(val):
     return misc.is_int(val) and 1 <= val <= 730
 
 
+def rolling_screen_windows(val):
+    return misc.is_list(val) and len(val) > 0 and len(set(val)) == len(val) \
+        and all(misc.is_int(item) and not misc.is_bool(item) and 1 <= item <= 1000 for item in val)
+
+
+def screen_backtest_sub_periods(val):
+    if not misc.is_list(val) or not val:
+        return False
+    for item in val:
+        if not misc.is_dict(item) or not ('Start Date' in item or 'End Date' in item) \
+                or set(item) - {'Name', 'Start Date', 'End Date'} or not misc.is_str(item.get('Name', '')) \
+                or any(key in item and not date(item[key]) for key in ('Start Date', 'End Date')):
+            return False
+    return True
+
+
+def screen_backtest_rolling_windows(val):
+    return misc.is_list(val) and len(val) > 0 and len(set(val)) == len(val) \
+        and all(misc.is_int(item) and not misc.is_bool(item) and 2 <= item <= 1000 for item in val)
+
+
+def concurrency(val):
+    return misc.is_int(val) and 1 <= val <= 16
+
+
+def memory_limit(val):
+    size = misc.parse_size(val)
+    return size is not None and size > 0
+
+
 def rank_perf_buckets(val):
     return misc.is_int(val) and 1 <= val <= 20
 
 
+def ranks_period_delta_threshold(val):
+    return misc.is_number(val) and not misc.is_bool(val) and val >= 0
+
+
 def data_p123_uids(val):
     if misc.is_int(val):
         val = [val]
@@ -0,0 +1,102 @@
+"""
+As of date grids of the operations making one request per date, and the dates the server snaps them to: the API
+answers an as of date with the closest earlier date it has data for (the "dt" of the response), so around weekends
+and holidays several dates of a grid can resolve to the same date.
+"""
+import bisect
+import datetime
+import p123.data.cons as data_cons
+
+
+def get_freq_days(freq):
+    """
+    :param freq: label of data_cons.FREQ (case insensitive), None for the weekly default
+    :return: days between two dates of the grid
+    """
+    if freq is None:
+        freq = data_cons.FREQ[1]['label']
+    return data_cons.FREQ_BY_LABEL[freq.lower()]['days']
+
+
+def iter_grid(start_date: datetime.date, end_date: datetime.date = None, freq=None):
+    """
+    Dates from the first Saturday on or after the start date to the end date (today at the latest), generated lazily
+    :param start_date:
+    :param end_date: today if None
+    :param freq: see get_freq_days
+    """
+    weekday = start_date.weekday()
+    date = start_date + datetime.timedelta(days=5 - weekday if weekday <= 5 else 6)
+    today = datetime.date.today()
+    if end_date is None or end_date > today:
+        end_date = today
+    step = datetime.timedelta(days=get_freq_days(freq))
+    while date <= end_date:
+        yield date
+        date += step
+
+
+class SnappedDates:
+    """
+    Dates the server snapped as of dates to. The server picks the closest earlier date with data, so every date from
+    a snapped date to the as of date it was requested for resolves to that snapped date.
+    """
+    def __init__(self, ranges=None):
+        """
+        :param ranges: list of [snapped date, as of date] (YYYY-MM-DD), see get_ranges
+        """
+        # snapped date -> latest as of date known to resolve to it
+        self._as_of_dates = {}
+        self._snapped = []
+        self._added_cnt = 0
+        for snapped, as_of in ranges or []:
+            self.add(datetime.date.fromisoformat(as_of), datetime.date.fromisoformat(snapped))
+        self._added_cnt = 0
+
+    def add(self, as_of: datetime.date, snapped: datetime.date):
+        if snapped > as_of:
+            return
+        prev = self._as_of_dates.get(snapped)
+        if prev is None:
+            bisect.insort(self._snapped, snapped)
+        if prev is None or prev < as_of:
+            self._as_of_dates[snapped] = as_of
+            self._added_cnt += 1
+
+    def resolve(self, date: datetime.date):
+        """
+        :return: the date the server snaps the date to, None if unknown
+        """
+        idx = bisect.bisect_right(self._snapped, date)
+        if idx and date <= self._as_of_dates[self._snapped[idx - 1]]:
+            return self._snapped[idx - 1]
+
+    def dedup(self, dates: list):
+        """
+        :return: the dates that do not resolve to the same date as an earlier one
+        """
+        resolved = set()
+        kept = []
+        for date in dates:
+            snapped = self.resolve(date)
+            if snapped is None:
+                kept.append(date)
+            elif snapped not in resolved:
+                resolved.add(snapped)
+                kept.append(date)
+        return kept
+
+    def get_added_cnt(self):
+        """
+        :return: number of ranges added or extended since created
+        """
+        return self._added_cnt
+
+    def get_ranges(self, final: bool = True):
+        """
+        :param final: leave out the range of the latest snapped date, it can still grow once the server has data for
+            later dates
+        :return: list of [snapped date, as of date] (YYYY-MM-DD)
+        """
+        snapped_dates = self._snapped[:-1] if final else self._snapped
+        return [[str(snapped), str(self._as_of_dates[snapped])] for snapped in snapped_dates]
@@ -0,0 +1,111 @@
+import concurrent.futures
+
+
+def completed_future(result):
+    """
+    :return: a future holding an already known task result
+    """
+    future = concurrent.futures.Future()
+    future.set_result(result)
+    return future
+
+
+class OrderedExecutor:
+    """
+    Runs indexed tasks over a bounded pool of worker threads, finished tasks are handed back by index so the caller
+    can consume them strictly in order. With a single worker tasks are executed inline, in the calling thread.
+    """
+    def __init__(self, max_workers: int, bounded: bool = True):
+        """
+        :param max_workers:
+        :param bounded: limit the number of finished but not yet consumed tasks, only safe when tasks are submitted
+            in the order they are consumed
+        """
+        self._max_workers = max_workers
+        self._bounded = bounded
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+        self._futures = {}
+        self._api_items = {}
+
+    def _running(self):
+        return [future for future in self._futures.values() if not future.done()]
+
+    def has_capacity(self):
+        """
+        Checks if another task can be submitted; finished but not yet consumed tasks count towards the window too,
+        this way a slow task cannot make the number of buffered results grow unbounded
+        """
+        if self._bounded and len(self._futures) >= self._max_workers * 2:
+            return False
+        return len(self._running()) < self._max_workers
+
+    def is_idle(self):
+        return not self._running()
+
+    def is_compatible(self, api_items: dict):
+        """
+        Checks if a task relying on the specified server side API items (name => definition) can run alongside the
+        tasks currently running
+        :param api_items:
+        :return: bool
+        """
+        if api_items:
+            for idx, future in self._futures.items():
+                if future.done():
+                    continue
+                for name, definition in self._api_items.get(idx, {}).items():
+                    if name in api_items and api_items[name] != definition:
+                        return False
+        return True
+
+    def submit(self, idx: int, fn, api_items: dict = None):
+        if self._pool is not None:
+            future = self._pool.submit(fn)
+        else:
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(fn())
+            except Exception as e:
+                future.set_exception(e)
+        self._futures[idx] = future
+        if api_items:
+            self._api_items[idx] = api_items
+
+    def fail(self, idx: int, exc: Exception):
+        """
+        Registers a task that failed before it could be submitted
+        """
+        future = concurrent.futures.Future()
+        future.set_exception(exc)
+        self._futures[idx] = future
+
+    def pop(self, idx: int):
+        """
+        :return: the task's future if the task is done, None otherwise
+        """
+        future = self._futures.get(idx)
+        if future is None or not future.done():
+            return
+        del self._futures[idx]
+        self._api_items.pop(idx, None)
+        return future
+
+    def wait(self):
+        """
+        Blocks until at least one of the running tasks is done
+        """
+        running = self._running()
+        if running:
+            concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+
+    def shutdown(self):
+        """
+        Waits for the running tasks to finish
+        :return: dict of the futures that were not consumed by task index
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+        futures = self._futures
+        self._futures = {}
+        self._api_items.clear()
+        return futures
@@ -0,0 +1,588 @@
+import io
+import os
+import re
+import csv
+import gzip
+import sqlite3
+import logging
+import datetime
+import itertools
+import threading
+import configparser
+from p123.result import ResultStore, KEY, NUM
+
+FORMATS = ('csv', 'csv.gz', 'csv.zst', 'tsv', 'tsv.gz', 'tsv.zst', 'parquet', 'sqlite')
+
+DEFAULT_OPTIONS = {'format': 'csv', 'gzip_level': 6, 'zstd_level': 3}
+
+# sqlite outputs of all operations go into the same file, one table each
+SQLITE_FILE_NAME = 'results.sqlite'
+# columns rows are upserted on (along with the run key) when the result has them
+SQLITE_KEY_COLUMNS = ('Date', 'P123 UID')
+
+_DATE_RE = re.compile(r'\d{4}-\d{2}-\d{2}$')
+
+
+def get_file_name(operation_name, extension: str = 'csv'):
+    """
+    :return: timestamped output file name for an operation, the shared file of sqlite outputs
+    """
+    if extension == 'sqlite':
+        return SQLITE_FILE_NAME
+    return str(operation_name).lower() + '_' + datetime.datetime.now().strftime('%Y%m%d_%H%M%S') + '.' + extension
+
+
+def get_format(file: str):
+    """
+    :return: output format of a file, by extension (csv if unknown)
+    """
+    name = os.path.basename(file).lower()
+    for file_format in sorted(FORMATS, key=len, reverse=True):
+        if name.endswith('.' + file_format):
+            return file_format
+    return 'csv'
+
+
+def init_from_config(*, config: configparser.ConfigParser, logger: logging.Logger):
+    """
+    Reads the output options from the [OUTPUT] section of the config:
+        format - format of auto saved outputs (default csv), see FORMATS
+        gzip_level - compression level of .gz outputs, 1 (fastest) to 9 (smallest), default 6
+        zstd_level - compression level of .zst outputs, 1 (fastest) to 22 (smallest), default 3
+    :return: dict of output options
+    """
+    options = dict(DEFAULT_OPTIONS)
+    try:
+        file_format = config.get('OUTPUT', 'format', fallback=options['format']).lower().lstrip('.')
+        if file_format in FORMATS:
+            options['format'] = file_format
+        else:
+            logger.warning(f'Unknown output format {file_format}, using {options["format"]}')
+        options['gzip_level'] = min(max(config.getint('OUTPUT', 'gzip_level', fallback=options['gzip_level']), 1), 9)
+        options['zstd_level'] = min(max(config.getint('OUTPUT', 'zstd_level', fallback=options['zstd_level']), 1), 22)
+    except ValueError as e:
+        logger.warning(f'Invalid output options ({e})')
+    return options
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise OSError('zstd output requires zstandard (pip install zstandard)')
+    return zstandard
+
+
+class CsvSink:
+    """Writes rows into a csv (or tab separated) file as they come, compressing them on the fly if needed"""
+    def __init__(self, file: str, *, delimiter: str = ',', compression: str = None, level: int = None):
+        """
+        :param file:
+        :param delimiter:
+        :param compression: gz, zst or None
+        :param level: compression level
+        """
+        if compression == 'gz':
+            self._stream = gzip.open(file, 'wt', newline='', compresslevel=level or DEFAULT_OPTIONS['gzip_level'])
+        elif compression == 'zst':
+            zstandard = _import_zstandard()
+            compressor = zstandard.ZstdCompressor(level=level or DEFAULT_OPTIONS['zstd_level'])
+            self._stream = io.TextIOWrapper(compressor.stream_writer(open(file, 'wb')), newline='')
+        else:
+            self._stream = open(file, 'w', newline='')
+        self._writer = csv.writer(self._stream, delimiter=delimiter)
+
+    def write_header(self, header: list):
+        self._writer.writerow(header)
+
+    def write_rows(self, rows):
+        self._writer.writerows(rows)
+        self._stream.flush()
+
+    def write_block(self, block):
+        """
+        :param block: p123.result.Block
+        """
+        self.write_rows(block.iter_rows())
+
+    def close(self):
+        self._stream.close()
+
+
+def _get_column_names(header: list):
+    """
+    :return: non empty and distinct column names
+    """
+    names = []
+    for idx, name in enumerate(header):
+        name = str(name) if name is not None and str(name) else f'Column {idx + 1}'
+        while name in names:
+            name += '_'
+        names.append(name)
+    return names
+
+
+def _slugify(text: str):
+    return re.sub(r'[^0-9a-z]+', '_', str(text).lower()).strip('_')
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.parquet
+    except ImportError:
+        raise OSError('Parquet output requires pyarrow (pip install pyarrow)')
+    return pyarrow
+
+
+def _has_fractions(column):
+    """
+    :param column: numeric or key column of a p123.result.Block
+    :return: True if the column holds values not flagged as integers (floats for a key column)
+    """
+    if column.kind == KEY:
+        return any(isinstance(value, float) for value in column.dictionary.values)
+    ints = column.ints if column.ints is not None else bytes(len(column.values))
+    return any(not flag and value == value for flag, value in zip(ints, column.values))
+
+
+class ParquetSink:
+    """
+    Writes rows into a parquet file, one row group per block (date, iteration...). Column types are set by the first
+    rows written: strings, dates (ISO date strings included), booleans and floats (float32 if the result uses them).
+    Numeric and key result columns only holding integers (P123 UIDs...) are written as integers, the column is switched
+    to floats (rewriting the row groups already written) if a later block holds fractions.
+    """
+    def __init__(self, file: str):
+        self._pa = _import_pyarrow()
+        self._file = file
+        self._names = None
+        self._schema = None
+        self._writer = None
+        # converted dictionary of key columns: column index => (number of values, array)
+        self._dictionaries = {}
+        # fail right away if the file cannot be written
+        open(file, 'wb').close()
+
+    def write_header(self, header: list):
+        self._names = _get_column_names(header)
+
+    def _get_names(self, width: int):
+        names = list(self._names or [])
+        return names[:width] + [f'Column {idx + 1}' for idx in range(len(names), width)]
+
+    def _infer_type(self, values, typecode: str = None, ints: bool = False):
+        pa = self._pa
+        types = set(type(value) for value in values if value is not None)
+        if types == {bool}:
+            return pa.bool_()
+        if types and types <= {int, float}:
+            if ints:
+                return pa.int64()
+            return pa.float32() if typecode == 'f' else pa.float64()
+        if types and all(issubclass(item, datetime.date) and not issubclass(item, datetime.datetime) for item in types):
+            return pa.date32()
+        if types == {str} and all(_DATE_RE.match(value) for value in values if value is not None):
+            return pa.date32()
+        if not types:
+            return pa.float32() if typecode == 'f' else pa.float64()
+        return pa.string()
+
+    def _convert(self, values, pa_type):
+        pa = self._pa
+        if pa.types.is_date32(pa_type):
+            values = [datetime.date.fromisoformat(value) if isinstance(value, str) else value for value in values]
+        elif pa.types.is_string(pa_type):
+            values = [str(value) if value is not None and not isinstance(value, str) else value for value in values]
+        elif pa.types.is_integer(pa_type):
+            values = [int(value) if value is not None else None for value in values]
+        return pa.array(values, type=pa_type)
+
+    def _get_column_values(self, column):
+        """
+        :param column: column of a p123.result.Block
+        :return: (python values, float typecode, True if only integers) of a column
+        """
+        if column.kind == NUM:
+            return column.get_values(), column.values.typecode, column.ints is not None and not _has_fractions(column)
+        if column.kind == KEY:
+            values = column.dictionary.values
+            return column.get_values(), None, bool(values) and all(type(value) is int for value in values)
+        return column.get_values(), None, False
+
+    def _convert_column(self, col_idx: int, column, pa_type):
+        pa = self._pa
+        if column.kind == KEY:
+            # only the distinct values get converted
+            dictionary = column.dictionary.values
+            cnt, converted = self._dictionaries.get(col_idx, (0, None))
+            if cnt < len(dictionary):
+                new_values = self._convert(dictionary[cnt:], pa_type)
+                converted = new_values if converted is None else pa.concat_arrays([converted, new_values])
+                self._dictionaries[col_idx] = (len(dictionary), converted)
+            codes = pa.Array.from_buffers(pa.int32(), len(column.codes), [None, pa.py_buffer(column.codes)])
+            codes = pa.compute.if_else(pa.compute.less(codes, 0), pa.scalar(None, pa.int32()), codes)
+            return converted.take(codes) if converted is not None else pa.nulls(len(column.codes), pa_type)
+        if column.kind == NUM and column.ints is None and pa.types.is_floating(pa_type) \
+                and column.values.typecode == ('f' if pa.types.is_float32(pa_type) else 'd'):
+            values = pa.Array.from_buffers(pa_type, len(column.values), [None, pa.py_buffer(column.values)])
+            return pa.compute.if_else(pa.compute.is_nan(values), pa.scalar(None, pa_type), values)
+        return self._convert(column.get_values(), pa_type)
+
+    def _init_schema(self, columns: list):
+        pa = self._pa
+        fields = []
+        for name, (values, typecode, ints) in zip(self._get_names(len(columns)), columns):
+            fields.append(pa.field(name, self._infer_type(values, typecode, ints)))
+        self._schema = pa.schema(fields)
+        self._writer = pa.parquet.ParquetWriter(self._file, self._schema)
+
+    def _widen(self, col_idx: int, typecode: str):
+        """
+        Switches an integer column to floats, the row groups written so far are read back and rewritten
+        """
+        pa = self._pa
+        self._writer.close()
+        table = pa.parquet.read_table(self._file)
+        field = self._schema.field(col_idx)
+        self._schema = self._schema.set(col_idx, field.with_type(pa.float32() if typecode == 'f' else pa.float64()))
+        self._dictionaries.pop(col_idx, None)
+        self._writer = pa.parquet.ParquetWriter(self._file, self._schema)
+        for batch in table.cast(self._schema).to_batches():
+            self._writer.write_table(pa.Table.from_batches([batch], schema=self._schema))
+
+    def _write_arrays(self, arrays: list, length: int):
+        pa = self._pa
+        width = len(self._schema)
+        arrays = arrays[:width] + [pa.nulls(length, self._schema.field(idx).type) for idx in range(len(arrays), width)]
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self._schema))
+
+    def write_rows(self, rows):
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, 65536))
+            if not chunk:
+                return
+            width = max([len(row) for row in chunk] + [len(self._names or [])])
+            columns = [[row[idx] if idx < len(row) else None for row in chunk] for idx in range(width)]
+            if self._writer is None:
+                self._init_schema([(values, None, False) for values in columns])
+            self._write_arrays([
+                self._convert(values, self._schema.field(idx).type)
+                for idx, values in enumerate(columns[:len(self._schema)])], len(chunk))
+
+    def write_block(self, block):
+        """
+        :param block: p123.result.Block
+        """
+        pa = self._pa
+        if self._writer is None:
+            self._init_schema([self._get_column_values(column) for column in block.columns])
+        for idx, column in enumerate(block.columns[:len(self._schema)]):
+            if column.kind in (NUM, KEY) and pa.types.is_integer(self._schema.field(idx).type) \
+                    and _has_fractions(column):
+                self._widen(idx, column.values.typecode if column.kind == NUM else 'd')
+        self._write_arrays([
+            self._convert_column(idx, column, self._schema.field(idx).type)
+            for idx, column in enumerate(block.columns[:len(self._schema)])], block.length)
+
+    def close(self):
+        if self._writer is None:
+            # no rows, header only
+            self._init_schema([([], None, False) for _ in self._names or []])
+        self._writer.close()
+
+
+def _quote(name: str):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SqliteSink:
+    """
+    Upserts rows into a table of a SQLite database so that the runs of an operation accumulate into one store: rows are
+    keyed by run key (see checkpoint.get_run_key), date and P123 UID (row number if the result has neither), running
+    the same input again replaces its rows and adds the new ones. Columns missing from the table get added.
+    """
+    def __init__(self, file: str, *, table: str = 'result', run_key: str = ''):
+        """
+        :param file:
+        :param table: name of the table
+        :param run_key: key of the run (input)
+        """
+        self._table = _slugify(table) or 'result'
+        self._run_key = run_key
+        self._names = None
+        self._key_names = None
+        self._insert = None
+        self._width = 0
+        self._row_cnt = 0
+        self._file = file
+        # the operation may write from other threads than the one creating it (GUI runs, resumes), the connection is
+        # opened by the first write and shared under the lock
+        self._conn = None
+        self._lock = threading.Lock()
+        try:
+            sqlite3.connect(file, timeout=60).close()
+        except sqlite3.Error as e:
+            raise OSError(f'Cannot open {file} ({e})')
+
+    def _connect(self):
+        if self._conn is None:
+            try:
+                self._conn = sqlite3.connect(self._file, timeout=60, check_same_thread=False)
+            except sqlite3.Error as e:
+                raise OSError(f'Cannot open {self._file} ({e})')
+        return self._conn
+
+    def write_header(self, header: list):
+        self._names = _get_column_names(header)
+
+    def _get_table_columns(self):
+        return [row[1] for row in self._conn.execute(f'PRAGMA table_info({_quote(self._table)})')]
+
+    def _get_table_key(self):
+        """
+        :return: key columns of the existing table, None if there is no such table
+        """
+        for row in self._conn.execute(f'PRAGMA index_list({_quote(self._table)})'):
+            if row[1] == self._table + '_key':
+                return [info[2] for info in self._conn.execute(f'PRAGMA index_info({_quote(row[1])})')][1:]
+
+    def _init_table(self, width: int, sample: list):
+        """
+        Creates the table or adds the missing columns
+        :param sample: first rows, setting the type of new columns
+        """
+        names = list(self._names or [])
+        names = names[:width] + [f'Column {idx + 1}' for idx in range(len(names), width)]
+        self._key_names = [name for name in SQLITE_KEY_COLUMNS if name in names] or ['Row']
+        if self._key_names == ['Row']:
+            names.append('Row')
+        types = []
+        for idx in range(len(names)):
+            values = [row[idx] for row in sample if idx < len(row) and row[idx] is not None]
+            numeric = values and all(isinstance(value, (int, float)) for value in values)
+            types.append('NUMERIC' if numeric else 'TEXT')
+
+        table = _quote(self._table)
+        self._connect()
+        try:
+            with self._conn:
+                columns = self._get_table_columns()
+                if not columns:
+                    self._conn.execute(f'CREATE TABLE {table} ("Run Key" TEXT NOT NULL, ' + ', '.join(
+                        f'{_quote(name)} {col_type}' for name, col_type in zip(names, types)) + ')')
+                    self._conn.execute(
+                        f'CREATE UNIQUE INDEX {_quote(self._table + "_key")} ON {table} ("Run Key", '
+                        + ', '.join(_quote(name) for name in self._key_names) + ')')
+                    for name in SQLITE_KEY_COLUMNS:
+                        if name in self._key_names:
+                            index = _quote(self._table + '_' + _slugify(name))
+                            self._conn.execute(f'CREATE INDEX {index} ON {table} ({_quote(name)})')
+                else:
+                    key_names = self._get_table_key()
+                    if key_names != self._key_names:
+                        raise OSError(
+                            f'Table {self._table} of {self._file} is keyed by {", ".join(key_names or [])}, the '
+                            f'result by {", ".join(self._key_names)}')
+                    for name, col_type in zip(names, types):
+                        if name not in columns:
+                            self._conn.execute(f'ALTER TABLE {table} ADD COLUMN {_quote(name)} {col_type}')
+        except sqlite3.Error as e:
+            raise OSError(f'Cannot write {self._file} ({e})')
+
+        updates = [name for name in names if name not in self._key_names]
+        self._insert = (
+            f'INSERT INTO {table} ("Run Key", ' + ', '.join(_quote(name) for name in names) + ') VALUES (?'
+            + ', ?' * len(names) + ') ON CONFLICT ("Run Key", ' + ', '.join(_quote(name) for name in self._key_names)
+            + ') DO ' + ('UPDATE SET ' + ', '.join(f'{_quote(name)} = excluded.{_quote(name)}' for name in updates)
+                         if updates else 'NOTHING'))
+        self._width = width
+
+    @staticmethod
+    def _convert(value):
+        if value is None or isinstance(value, (int, float, str)):
+            return value
+        if isinstance(value, datetime.date):
+            return value.isoformat()
+        return str(value)
+
+    def write_rows(self, rows):
+        with self._lock:
+            self._write_rows(rows)
+
+    def _write_rows(self, rows):
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, 65536))
+            if not chunk:
+                return
+            if self._insert is None:
+                self._init_table(max([len(row) for row in chunk] + [len(self._names or [])]), chunk[:100])
+            params = []
+            for row in chunk:
+                row = [self._convert(value) for value in row[:self._width]] + [None] * (self._width - len(row))
+                self._row_cnt += 1
+                if self._key_names == ['Row']:
+                    row.append(self._row_cnt)
+                params.append([self._run_key] + row)
+            try:
+                with self._conn:
+                    self._conn.executemany(self._insert, params)
+            except sqlite3.Error as e:
+                raise OSError(f'Cannot write {self._file} ({e})')
+
+    def write_block(self, block):
+        """
+        :param block: p123.result.Block
+        """
+        self.write_rows(block.iter_rows())
+
+    def close(self):
+        with self._lock:
+            if self._insert is None and self._names:
+                # no rows, creates the table anyway
+                self._init_table(len(self._names), [])
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def get_stored_dates(file: str, options: dict):
+    """
+    :param file: sqlite output
+    :param options: see open_sink
+    :return: set of dates stored for the table and run key of options, from the Date column or from the date columns
+        holding values (wide results)
+    :raises OSError
+    """
+    if not os.path.isfile(file):
+        return set()
+    table = _quote(_slugify(options.get('table', 'result')) or 'result')
+    try:
+        conn = sqlite3.connect(file, timeout=60)
+        try:
+            columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+            if 'Date' in columns:
+                values = [row[0] for row in conn.execute(
+                    f'SELECT DISTINCT "Date" FROM {table} WHERE "Run Key" = ?', (options.get('run_key', ''),))]
+            else:
+                columns = [name for name in columns if _DATE_RE.match(name)]
+                counts = conn.execute(
+                    'SELECT ' + ', '.join(f'COUNT({_quote(name)})' for name in columns) + f' FROM {table} '
+                    'WHERE "Run Key" = ?', (options.get('run_key', ''),)).fetchone() if columns else []
+                values = [name for name, cnt in zip(columns, counts) if cnt]
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        raise OSError(f'Cannot read {file} ({e})')
+    return set(datetime.date.fromisoformat(value) for value in values
+               if isinstance(value, str) and _DATE_RE.match(value))
+
+
+def open_sink(file: str, options: dict = None):
+    """
+    :param file:
+    :param options: see init_from_config, plus the table and run_key of sqlite outputs (see SqliteSink)
+    :return: sink writing into file, format set by the file extension (see FORMATS)
+    :raises OSError
+    """
+    options = options or DEFAULT_OPTIONS
+    file_format = get_format(file)
+    if file_format == 'parquet':
+        return ParquetSink(file)
+    if file_format == 'sqlite':
+        return SqliteSink(file, table=options.get('table', 'result'), run_key=options.get('run_key', ''))
+    compression = file_format[4:] or None
+    return CsvSink(
+        file, delimiter='\t' if file_format.startswith('tsv') else ',', compression=compression,
+        level=options['gzip_level'] if compression == 'gz' else options['zstd_level'])
+
+
+def split_sections(rows):
+    """
+    Splits a result made of several tables separated by empty rows, each table optionally starting with a title row
+    (e.g. Stats, Results and Time Series of a screen backtest)
+    :return: list of (title or None, rows of the table)
+    """
+    sections = []
+    table = None
+    for row in rows:
+        if not row:
+            table = None
+            continue
+        if table is None:
+            title = None
+            if len(row) == 1 and isinstance(row[0], str):
+                title = row[0]
+            table = []
+            sections.append((title, table))
+            if title is not None:
+                continue
+        table.append(row)
+    return sections
+
+
+def _get_section_name(root: str, title, idx: int, used: set, extension: str = ''):
+    name = _slugify(title) if title is not None else ''
+    name = name or f'table_{idx + 1}'
+    section_name = f'{root}_{name}{extension}'
+    suffix = 1
+    while section_name in used:
+        suffix += 1
+        section_name = f'{root}_{name}_{suffix}{extension}'
+    used.add(section_name)
+    return section_name
+
+
+def write_result(rows, file: str, sections: list = None, options: dict = None):
+    """
+    Writes an operation result into a file
+    :param rows: list of rows or ResultStore
+    :param file:
+    :param sections: tables the result is made of (see Operation.get_sections), formats that cannot mix tables
+        write each of them into its own file (parquet) or database table (sqlite) named after the table
+    :param options: see open_sink
+    :return: list of files written
+    :raises OSError
+    """
+    if isinstance(rows, ResultStore):
+        # block by block, one row group each
+        sink = open_sink(file, options)
+        try:
+            if rows.get_header() is not None:
+                sink.write_header(rows.get_header())
+            for block in rows.iter_blocks():
+                sink.write_block(block)
+        finally:
+            sink.close()
+        return [file]
+
+    file_format = get_format(file)
+    if sections is None or file_format not in ('parquet', 'sqlite'):
+        sections = [(None, rows)]
+    files = []
+    used = set()
+    for idx, (title, section_rows) in enumerate(sections):
+        section_file = file
+        section_options = options
+        if len(sections) > 1 and file_format == 'sqlite':
+            options = options or DEFAULT_OPTIONS
+            section_options = dict(
+                options, table=_get_section_name(_slugify(options.get('table', 'result')), title, idx, used))
+        elif len(sections) > 1:
+            root, extension = os.path.splitext(file)
+            section_file = _get_section_name(root, title, idx, used, extension)
+        sink = open_sink(section_file, section_options)
+        try:
+            section_rows = iter(section_rows)
+            header = next(section_rows, None)
+            if header is not None:
+                sink.write_header(header)
+            sink.write_rows(section_rows)
+        finally:
+            sink.close()
+        if section_file not in files:
+            files.append(section_file)
+    return files
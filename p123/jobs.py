@@ -0,0 +1,252 @@
+import logging
+import os
+import time
+import traceback
+import multiprocessing
+import threading
+import concurrent.futures
+from pathlib import Path
+import yaml
+from p123api import Client
+import utils.misc as misc
+from utils.config import Config
+import p123.operation as operation
+import p123.util as util
+import p123.cache as cache
+import p123.checkpoint as checkpoint
+import p123.export as export
+
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_FAILED_ITERATIONS = 2
+
+OUTCOMES = {EXIT_OK: 'done', EXIT_ERROR: 'error', EXIT_FAILED_ITERATIONS: 'failed iterations'}
+
+# state of a job runner process, see _init_worker
+_worker = {}
+
+
+def _add_job(jobs: list, file, priority, output, logger: logging.Logger):
+    if os.path.isdir(file):
+        for entry in sorted(Path(file).iterdir()):
+            if entry.suffix.lower() in ('.yaml', '.yml') and entry.is_file():
+                _add_job(jobs, str(entry), priority, None, logger)
+        return True
+    if not os.path.isfile(file):
+        logger.error(f'Input file {file} not found')
+        return False
+
+    try:
+        with open(file) as stream:
+            data = yaml.safe_load(stream)
+    except (OSError, yaml.YAMLError) as e:
+        logger.error(e)
+        return False
+    if misc.is_dict(data) and 'Jobs' in data:
+        return _add_manifest_jobs(jobs, file, data['Jobs'], logger)
+
+    jobs.append({'file': file, 'priority': priority, 'output': output})
+    return True
+
+
+def _add_manifest_jobs(jobs: list, manifest: str, entries, logger: logging.Logger):
+    """
+    Adds the jobs of a manifest, a list of input files or folders (relative to the manifest):
+        Jobs:
+          - inputs/ranks.yaml
+          - File: inputs/data
+            Priority: 10
+          - File: inputs/rank_perf.yaml
+            Output: rank_perf_core.csv
+    """
+    if not misc.is_list(entries):
+        logger.error(f'"Jobs" section of {manifest} is not valid')
+        return False
+    folder = os.path.dirname(manifest)
+    for idx, entry in enumerate(entries):
+        if misc.is_str(entry):
+            entry = {'File': entry}
+        if not misc.is_dict(entry) or not misc.is_str(entry.get('File')) \
+                or not misc.is_int(entry.get('Priority', 0)) or not misc.is_str(entry.get('Output', '')):
+            logger.error(f'Job #{idx + 1} of {manifest} is not valid')
+            return False
+        if not _add_job(
+                jobs, os.path.join(folder, entry['File']), entry.get('Priority', 0), entry.get('Output'), logger):
+            return False
+    return True
+
+
+def load_jobs(*, inputs: list, logger: logging.Logger, file_format: str = 'csv'):
+    """
+    Collects the jobs to run, sorted by priority (higher first)
+    :param inputs: input files, folders (all yaml files in it) or manifests (see _add_manifest_jobs)
+    :param logger:
+    :param file_format: format of the outputs not named in a manifest (see export.FORMATS)
+    :return: list of jobs or None if an input is not valid
+    """
+    jobs = []
+    for file in inputs:
+        if not _add_job(jobs, file, 0, None, logger):
+            return
+
+    outputs = set()
+    for job in jobs:
+        output = job['output'] or Path(job['file']).stem + '.' + file_format
+        name, ext = os.path.splitext(output)
+        idx = 1
+        while output in outputs:
+            idx += 1
+            output = f'{name}_{idx}{ext}'
+        outputs.add(output)
+        job['output'] = output
+    jobs.sort(key=lambda item: -item['priority'])
+    return jobs
+
+
+def _init_worker(settings: dict, request_semaphore, api_item_lock):
+    """
+    Initializes a job runner process
+    :param settings: see run_jobs
+    :param request_semaphore: caps the number of API requests in flight across all jobs
+    :param api_item_lock: held by jobs relying on API items, they would overwrite each other's definitions
+    """
+    logger = logging.getLogger('p123')
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s: %(levelname)s: %(name)s: %(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(settings['log_level'])
+    _worker['settings'] = settings
+    _worker['request_semaphore'] = request_semaphore
+    _worker['api_item_lock'] = api_item_lock
+    _worker['api_client'] = Client(api_id=settings['api_id'], api_key=settings['api_key'])
+    config = Config(logger, settings['config_file'])
+    _worker['output_options'] = export.init_from_config(config=config, logger=logger)
+    _worker['cache'] = None
+    if settings['use_cache']:
+        _worker['cache'] = cache.init_from_config(
+            config=config, app_user_folder=settings['app_user_folder'], logger=logger)
+
+
+def _uses_api_items(data: dict):
+    sections = [data['Default Settings']] + (data.get('Iterations') or [])
+    return any(util.get_api_items(section) for section in sections)
+
+
+def run_job(job: dict):
+    """
+    Runs a job in a job runner process
+    :return: job report
+    """
+    logger = logging.getLogger('p123.' + Path(job['file']).stem)
+    report = dict(job, operation=None, exit_code=EXIT_ERROR, failed_cnt=0, duration=0, output_file=None)
+    start = time.monotonic()
+    try:
+        report['exit_code'] = _run_job(job, report, logger)
+    except Exception:
+        logger.error(traceback.format_exc())
+    report['duration'] = round(time.monotonic() - start, 1)
+    return report
+
+
+def _run_job(job: dict, report: dict, logger: logging.Logger):
+    settings = _worker['settings']
+    logger.info(f"Processing {job['file']}")
+    try:
+        with open(job['file']) as stream:
+            data = yaml.safe_load(stream)
+    except (OSError, yaml.YAMLError) as e:
+        logger.error(e)
+        return EXIT_ERROR
+    if not operation.process_input(data=data, logger=logger):
+        return EXIT_ERROR
+    report['operation'] = data['Main']['Operation']
+
+    try:
+        op_checkpoint = checkpoint.Checkpoint(folder=settings['checkpoint_folder'], data=data, logger=logger)
+        if not settings['resume'] or not op_checkpoint.load():
+            op_checkpoint.discard()
+    except OSError as e:
+        logger.warning(f'Checkpoints disabled ({e})')
+        op_checkpoint = None
+
+    output_file = os.path.join(settings['output_folder'], job['output'])
+    api_item_lock = _worker['api_item_lock'] if _uses_api_items(data) else None
+    if api_item_lock is not None:
+        api_item_lock.acquire()
+    try:
+        op = operation.Operation.init(
+            api_client=_worker['api_client'], data=data, output=None, logger=logger, cache=_worker['cache'],
+            checkpoint=op_checkpoint, request_semaphore=_worker['request_semaphore'], output_file=output_file,
+            output_options=_worker['output_options']
+        )
+        if op is None:
+            return EXIT_ERROR
+        try:
+            run_outcome = op.run()
+        except Exception:
+            logger.error(traceback.format_exc())
+            run_outcome = False
+    finally:
+        if api_item_lock is not None:
+            api_item_lock.release()
+    report['failed_cnt'] = op.get_failed_cnt()
+    # the result is streamed into the output file
+    if op.get_result():
+        report['output_file'] = output_file
+
+    if not run_outcome:
+        return EXIT_ERROR
+    return EXIT_FAILED_ITERATIONS if op.get_failed_cnt() else EXIT_OK
+
+
+def run_jobs(*, jobs: list, processes: int, max_requests: int = None, settings: dict):
+    """
+    Runs jobs as separate operations over a pool of processes, in job order
+    :param jobs: see load_jobs
+    :param processes: max number of jobs running at the same time
+    :param max_requests: max number of API requests in flight across all jobs (no limit if None)
+    :param settings:
+        api_id, api_key
+        output_folder
+        config_file
+        use_cache - use the response cache configured in the config file
+        app_user_folder
+        checkpoint_folder
+        resume - resume interrupted runs of the same input
+        log_level
+    :return: list of job reports, in job order
+    """
+    if processes <= 1:
+        _init_worker(settings, threading.BoundedSemaphore(max_requests) if max_requests else None, None)
+        return [run_job(job) for job in jobs]
+
+    request_semaphore = multiprocessing.BoundedSemaphore(max_requests) if max_requests else None
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=processes, initializer=_init_worker,
+            initargs=(settings, request_semaphore, multiprocessing.Lock())) as pool:
+        return list(pool.map(run_job, jobs))
+
+
+def write_summary(*, reports: list, file: str, logger: logging.Logger):
+    """
+    Logs the job reports and saves them as csv
+    """
+    header = ['File', 'Operation', 'Outcome', 'Failed Iterations', 'Duration (s)', 'Output']
+    rows = [header]
+    for report in reports:
+        rows.append([
+            report['file'], report['operation'], OUTCOMES[report['exit_code']], report['failed_cnt'],
+            report['duration'], report['output_file']
+        ])
+    lengths = [max(len(str(row[idx])) for row in rows) for idx in range(len(header))]
+    for row in rows:
+        logger.info('  '.join(str(val if val is not None else '').ljust(lengths[idx]) for idx, val in enumerate(row)))
+    done_cnt = sum(1 for report in reports if report['exit_code'] == EXIT_OK)
+    duration = sum(report['duration'] for report in reports)
+    logger.info(f'{done_cnt}/{len(reports)} jobs done without failures, total job duration {duration:.1f}s')
+    try:
+        export.write_result(rows, file)
+        logger.info('Summary saved to ' + file)
+    except OSError as e:
+        logger.error(e)
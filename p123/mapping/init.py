@@ -12,6 +12,24 @@ MAIN = {
     },
     'Precision': {
         'isValid': functools.partial(validation.from_mapping_any, mapping=(2, 3, 4))
+    },
+    'Concurrency': {
+        'isValid': validation.concurrency
+    },
+    'Bypass Cache': {
+        'isValid': misc.is_bool
+    },
+    'Reorder Iterations': {
+        'isValid': misc.is_bool
+    },
+    'Float Type': {
+        'isValid': functools.partial(validation.from_mapping, mapping=('float64', 'float32'))
+    },
+    'Memory Limit': {
+        'isValid': validation.memory_limit
+    },
+    'Incremental': {
+        'isValid': misc.is_bool
     }
 }
 
@@ -64,6 +64,15 @@ RANKS['Additional Data'] = {
 
 RANKS_PERIOD = RANKS_COMMON.copy()
 del RANKS_PERIOD['Columns']
+RANKS_PERIOD['Panel'] = {
+    'isValid': functools.partial(validation.from_mapping, mapping=('dense', 'sparse', 'delta'))
+}
+RANKS_PERIOD['Delta Threshold'] = {
+    'isValid': validation.ranks_period_delta_threshold
+}
+RANKS_PERIOD['Output Layout'] = {
+    'isValid': functools.partial(validation.from_mapping, mapping=('wide', 'long'))
+}
 
 
 RANKS_MULTI_SETTINGS = RANKS_COMMON.copy()
@@ -160,6 +160,12 @@ SCREEN_BACKTEST.update(SCREEN_BACKTEST_SHARED)
 SCREEN_BACKTEST_SETTINGS = init.SETTINGS.copy()
 SCREEN_BACKTEST_SETTINGS.update(SCREEN_BACKTEST)
 SCREEN_BACKTEST_SETTINGS.update(SCREEN)
+SCREEN_BACKTEST_SETTINGS['Sub-Periods'] = {
+    'isValid': validation.screen_backtest_sub_periods
+}
+SCREEN_BACKTEST_SETTINGS['Rolling Windows'] = {
+    'isValid': validation.screen_backtest_rolling_windows
+}
 
 ROLLING_SCREEN = {}
 ROLLING_SCREEN.update(SCREEN)
@@ -170,6 +176,9 @@ ROLLING_SCREEN_SETTINGS.update(ROLLING_SCREEN)
 ROLLING_SCREEN_SETTINGS['Include Results'] = {
     'isValid': misc.is_bool
 }
+ROLLING_SCREEN_SETTINGS['Windows'] = {
+    'isValid': validation.rolling_screen_windows
+}
 
 ROLLING_SCREEN_ITERATIONS = init.ITERATIONS.copy()
 ROLLING_SCREEN_ITERATIONS.update(ROLLING_SCREEN)
@@ -204,6 +213,15 @@ RANK_PERF_SETTINGS = {
     'Buckets': {
         'isValid': validation.rank_perf_buckets,
         'required': True
+    },
+    'Bucket Metrics': {
+        'isValid': misc.is_bool
+    },
+    'Bucket Engine': {
+        'isValid': functools.partial(validation.from_mapping, mapping=cons.RANK_PERF_ENGINES)
+    },
+    'Return Formula': {
+        'isValid': misc.is_str
     }
 }
 RANK_PERF_SETTINGS.update(init.SETTINGS)
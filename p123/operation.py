@@ -1,7 +1,9 @@
+import bisect
 import logging
+import functools
+import collections
 import p123.data.cons as data_cons
 import utils.misc as misc
-import tkinter as tk
 import p123.data.transform as transform
 from p123api import Client, ClientException
 import p123.util as util
@@ -10,6 +12,15 @@ import p123.mapping.init as mapping_init
 import p123.mapping.data as mapping_data
 import p123.mapping.rank as mapping_rank
 import p123.mapping.screen as mapping_screen
+from p123.executor import OrderedExecutor, completed_future
+from p123.api_client import ApiClient
+from p123.cache import ResponseCache
+from p123.checkpoint import Checkpoint, get_run_key
+from p123.result import ResultStore, KEY, NUM
+from p123.pivot import Pivot
+import p123.export as export
+import p123.backtest as backtest
+import p123.dates as dates
 
 
 class Operation:
@@ -26,6 +37,18 @@ class Operation:
         self._output = output
         self._continue_on_error = self._data['Main']['On Error'].lower() == 'continue' \
             if 'On Error' in self._data['Main'] else True
+        self._max_workers = self._data['Main'].get('Concurrency', 1)
+        self._task_order = None
+        self._task_results = {}
+        self._checkpoint = None
+        self._failed_cnt = 0
+        self._output_file = None
+        self._output_options = None
+        self._output_closed = False
+        # results past this size (bytes) are spilled to disk
+        self._memory_limit = misc.parse_size(self._data['Main']['Memory Limit']) \
+            if 'Memory Limit' in self._data['Main'] else None
+        self._reported_disk_usage = 0
 
         self._init_default_params()
         self._init_header_row()
@@ -64,6 +87,29 @@ class Operation:
     def _init_header_row(self):
         self._header_row = []
 
+    def _new_result_store(self, kinds: list = None):
+        return ResultStore(
+            kinds=kinds, float_type=self._data['Main'].get('Float Type'), memory_limit=self._memory_limit)
+
+    def _new_pivot(self, **kwargs):
+        """
+        :return: Pivot of the values of each iteration, kept in a spill file if the result is streamed or memory limited
+        """
+        if self._memory_limit is not None:
+            # values read back at once stay well within the limit
+            kwargs.setdefault('chunk_bytes', max(1024 * 1024, min(64 * 1024 * 1024, self._memory_limit // 4)))
+        return Pivot(
+            period_cnt=self._iter_cnt, spill=self._output_file is not None or self._memory_limit is not None, **kwargs)
+
+    def _init_incremental(self):
+        """
+        Incremental mode ("Incremental" in "Main"): skips the work already saved in the output
+        :return: whether some work was skipped
+        :raises OSError
+        """
+        self._logger.warning(f'Incremental mode is not supported by {self.get_name()}, running in full')
+        return False
+
     def get_name(self):
         return self._data['Main'].get('Operation')
 
@@ -78,14 +124,102 @@ class Operation:
 
     def stop(self):
         self._stopped = True
+        if self._checkpoint is not None:
+            self._checkpoint.close()
+        self._close_output()
+
+    def set_checkpoint(self, checkpoint: Checkpoint):
+        """
+        Journals completed tasks into the checkpoint; tasks already completed in the checkpoint are restored instead
+        of being run again.
+        """
+        self._checkpoint = checkpoint
+        checkpoint.set_task_key(self._get_task_key())
+        results = checkpoint.pop_results()
+        for idx, result in results.items():
+            self._task_results[idx] = completed_future(result)
+        if results:
+            self._logger.info(f'Resuming from checkpoint: {len(results)} completed iterations restored')
+
+    def _get_task_key(self):
+        """
+        :return: JSON serializable description of the tasks when they depend on more than the input (None otherwise),
+            a checkpoint only restores the results of the same tasks
+        """
+
+    def set_output_file(self, file: str, options: dict = None):
+        """
+        Saves the result into file: rows kept in a ResultStore are streamed into it as tasks get committed, so that
+        they do not pile up in memory; other results are written once the operation is done.
+        :param file: format set by the extension, see export.FORMATS
+        :param options: see export.init_from_config
+        :raises OSError
+        """
+        self._output_file = file
+        self._output_options = self.get_output_options(options)
+        if isinstance(self._result, ResultStore):
+            self._result.set_sink(export.open_sink(file, self._output_options))
+
+    def get_output_options(self, options: dict = None):
+        """
+        :param options: see export.init_from_config
+        :return: options completed with the table and run key of the operation (sqlite outputs)
+        """
+        return dict(options or export.DEFAULT_OPTIONS, table=self.get_name(), run_key=get_run_key(self._data))
+
+    def get_output_file(self):
+        return self._output_file
+
+    def is_output_streamed(self):
+        """
+        :return: whether the rows are streamed into the output file instead of being kept in memory
+        """
+        return self._output_file is not None and isinstance(self._result, ResultStore)
+
+    def _close_output(self):
+        """
+        Completes the output file if any
+        :return: False if it could not be written
+        """
+        if self._output_file is None or self._output_closed:
+            return True
+        self._output_closed = True
+        files = [self._output_file]
+        try:
+            if isinstance(self._result, ResultStore):
+                self._result.close()
+            elif self._result:
+                files = export.write_result(
+                    self._result, self._output_file, self.get_sections(), self._output_options)
+        except OSError as e:
+            self._logger.error(e)
+            return False
+        if self._result:
+            self._logger.info('Output saved to ' + ', '.join(files))
+        else:
+            self._logger.warning('Output is empty')
+        return True
 
     def is_finished(self):
         return self._finished or self._stopped
 
+    def get_failed_cnt(self):
+        """
+        :return: number of failed iterations
+        """
+        return self._failed_cnt
+
+    def _write_to_output(self, text: str):
+        """
+        Appends text to the preview, output can be any object with a write(text) method or None (no preview)
+        """
+        if self._output is not None:
+            self._output.write(text)
+
     def _write_row_to_output(self, row, newline: bool = True):
-        self._output.configure(state='normal')
-        if newline:
-            self._output.insert(tk.END, '\n')
+        if self._output is None:
+            return
+        text = '\n' if newline else ''
         for idx, content in enumerate(row):
             if content is not None:
                 content = f'{content:.2f}' if misc.is_float(content) else str(content)
@@ -93,18 +227,17 @@ class Operation:
                 content = 'NA'
             length = self._col_setup[idx]['length']
             justify = self._col_setup[idx]['justify']
-            self._output.insert(
-                tk.END, content.rjust(length, ' ') if justify == 'right' else content.ljust(length, ' '))
-        self._output.configure(state='disabled')
+            text += content.rjust(length, ' ') if justify == 'right' else content.ljust(length, ' ')
+        self._write_to_output(text)
 
     def _write_value_to_output(self, value, newline: bool = True):
-        self._output.configure(state='normal')
-        if newline:
-            self._output.insert(tk.END, '\n')
-        self._output.insert(tk.END, str(value))
-        self._output.configure(state='disabled')
+        self._write_to_output(('\n' if newline else '') + str(value))
 
     def run(self):
+        """
+        Runs or resumes the operation
+        :return: same as _run
+        """
         exc = None
         try:
             run_outcome = self._run()
@@ -113,10 +246,40 @@ class Operation:
             run_outcome = False
         if run_outcome is not None:
             self._finished = True
+            if self._checkpoint is not None:
+                if run_outcome:
+                    self._checkpoint.discard()
+                else:
+                    self._checkpoint.close()
+            if not self._close_output():
+                run_outcome = False
+            self._log_result_usage(final=True)
+            if isinstance(self._api_client, ApiClient):
+                self._log_api_client_stats()
             if run_outcome:
                 self._logger.info(f"Done ({self._data['Main']['Operation']})")
         if exc is not None:
             raise exc
+        return run_outcome
+
+    def _log_result_usage(self, final: bool = False):
+        """
+        Logs the memory and disk usage of the result when a memory limit is set, each time it spills and once done
+        """
+        if self._memory_limit is None or not isinstance(self._result, ResultStore):
+            return
+        memory, disk = self._result.get_usage()
+        if final or disk > self._reported_disk_usage:
+            self._reported_disk_usage = disk
+            self._logger.info(f'Result: {memory / 1e6:.1f} MB in memory, {disk / 1e6:.1f} MB on disk')
+
+    def _log_api_client_stats(self):
+        cache_stats = self._api_client.get_cache_stats()
+        if cache_stats is not None:
+            self._logger.info(f'Cache: {cache_stats[0]} responses reused, {cache_stats[1]} downloaded')
+        uploads, uploads_skipped = self._api_client.get_api_item_stats()
+        if uploads_skipped:
+            self._logger.info(f'API items: {uploads} definitions uploaded, {uploads_skipped} redundant uploads skipped')
 
     def _run(self):
         """
@@ -127,17 +290,131 @@ class Operation:
             True - otherwise
         """
 
+    def _get_task_api_items(self, idx: int):
+        """
+        Server side API items (name => definition) task #idx relies on while running
+        """
+
+    def _prepare_task(self, idx: int):
+        """
+        Prepares task #idx, called in the running thread right before the task gets submitted.
+        :return: dict of keyword arguments for _run_task
+        :raises IterationFailedException
+        """
+        return {}
+
+    def _run_task(self, *, idx: int, **kwargs):
+        """
+        Task logic, called in a worker thread so it must not change the operation's state.
+        :return: the task result to be committed
+        :raises IterationFailedException, OperationPausedException
+        """
+
+    def _commit_task(self, *, idx: int, result):
+        """
+        Stores the result of task #idx, called in the running thread in task order.
+        """
+
+    def _get_task_order(self):
+        """
+        Order in which tasks are executed, results are still committed in task order.
+        :return: list of task indexes
+        """
+        return list(range(self._iter_cnt))
+
+    def _run_tasks(self):
+        """
+        Runs tasks #self._iter_idx to #self._iter_cnt - 1 over a bounded pool of worker threads ("Concurrency" in
+        "Main"), results get committed strictly in task order. Tasks relying on different definitions of the same
+        server side API item never run at the same time.
+        :return: same as _run
+        """
+        if self._task_order is None:
+            self._task_order = self._get_task_order()
+        pending = collections.deque(
+            idx for idx in self._task_order if idx >= self._iter_idx and idx not in self._task_results)
+        # tasks executed out of order can finish any number of tasks ahead of the next one to commit
+        executor = OrderedExecutor(self._max_workers, bounded=list(pending) == sorted(pending))
+        try:
+            while self._iter_idx < self._iter_cnt:
+                future = self._task_results.pop(self._iter_idx, None)
+                if future is None:
+                    future = executor.pop(self._iter_idx)
+                if future is not None:
+                    try:
+                        result = future.result()
+                        self._commit_task(idx=self._iter_idx, result=result)
+                        if self._checkpoint is not None:
+                            self._checkpoint.add_result(self._iter_idx, result)
+                        self._log_result_usage()
+                    except OperationPausedException:
+                        return
+                    except IterationFailedException:
+                        self._failed_cnt += 1
+                        if not self._continue_on_error:
+                            return False
+                    self._iter_idx += 1
+                    continue
+
+                if pending and not self.is_paused() and executor.has_capacity():
+                    api_items = self._get_task_api_items(pending[0])
+                    if executor.is_compatible(api_items):
+                        idx = pending.popleft()
+                        try:
+                            task = functools.partial(self._run_task, idx=idx, **self._prepare_task(idx))
+                            executor.submit(idx, task, api_items)
+                        except IterationFailedException as e:
+                            executor.fail(idx, e)
+                        continue
+
+                if executor.is_idle():
+                    # paused, the finished tasks are kept until the operation is resumed
+                    return
+                executor.wait()
+        finally:
+            # keep the results of finished tasks that could not be committed yet, paused tasks have to run again
+            for idx, future in executor.shutdown().items():
+                if not isinstance(future.exception(), OperationPausedException):
+                    self._task_results[idx] = future
+
+        return True
+
     def get_result(self):
         return self._result
 
+    def get_sections(self):
+        """
+        Tables the result is made of, for results mixing several tables that formats like parquet cannot hold in a
+        single file
+        :return: list of (title, rows of the table, header first) or None if the result is a single table
+        """
+
     @staticmethod
-    def init(*, api_client, data, output, logger: logging.Logger):
+    def init(*, api_client, data, output, logger: logging.Logger, cache: ResponseCache = None,
+             checkpoint: Checkpoint = None, request_semaphore=None, output_file: str = None,
+             output_options: dict = None):
+        if data['Main'].get('Bypass Cache'):
+            cache = None
+        api_client = ApiClient(client=api_client, cache=cache, request_semaphore=request_semaphore, logger=logger)
         try:
-            return OPERATIONS.get(data['Main']['Operation'].lower())['class'](
+            op = OPERATIONS.get(data['Main']['Operation'].lower())['class'](
                 api_client=api_client, data=data, output=output, logger=logger
             )
         except InitException:
-            pass
+            return
+        skipped = False
+        try:
+            if output_file is not None:
+                op.set_output_file(output_file, output_options)
+            if data['Main'].get('Incremental'):
+                skipped = op._init_incremental()
+        except OSError as e:
+            logger.error(e)
+            return
+        # the tasks of an incremental run do not match the checkpoint's, the output store resumes it anyway
+        if checkpoint is not None and not skipped:
+            op.set_checkpoint(checkpoint)
+        return op
 
 
 class IterOperation(Operation):
@@ -152,16 +429,26 @@ class IterOperation(Operation):
         self._iter_cnt = len(data['Iterations'])
         self._api_item_changed = {}
 
-    def _run_iter(self, *, iter_data, iter_params):
-        pass
+    def _run_iter(self, *, iter_idx, iter_data, iter_params):
+        """
+        Runs an iteration, called in a worker thread so it must not change the operation's state.
+        :return: the iteration result passed to _commit_iter
+        """
+
+    def _commit_iter(self, *, iter_idx, iter_data, result):
+        """
+        Stores an iteration result, called in the running thread in iteration order.
+        """
 
     def _check_api_item_change(self, iter_params):
         screen = self._default_params.get('screen')
         if misc.is_dict(screen):
+            iter_screen = iter_params.get('screen')
             for change in IterOperation._api_item_change_checks:
-                if self._default_params['screen'].get(change[0]) == change[1]:
-                    if iter_params.get('screen') and iter_params['screen'].get(change[0]) == change[1]:
-                        self._api_item_changed[change[0]] = True
+                if screen.get(change[0]) == change[1]:
+                    if misc.is_dict(iter_screen) and change[0] in iter_screen:
+                        if iter_screen[change[0]] == change[1]:
+                            self._api_item_changed[change[0]] = True
                     elif self._api_item_changed.get(change[0]):
                         change[2](
                             value=self._data['Default Settings'][change[0].capitalize()]['value'],
@@ -169,35 +456,47 @@ class IterOperation(Operation):
                         )
                         del self._api_item_changed[change[0]]
 
-    def _run(self):
-        while self._iter_idx < self._iter_cnt:
-            if self.is_paused():
-                return
-
-            iter_data = self._data['Iterations'][self._iter_idx]
-            iter_params = None
-            try:
-                iter_params = util.generate_params(
-                    data=iter_data, settings=self._data['Default Settings'],
-                    api_client=self._api_client, logger=self._logger
-                )
-            except ClientException as e:
-                self._logger.error(e)
-
-            try:
-                if iter_params is None:
-                    raise IterationFailedException
+    def _get_task_api_items(self, idx: int):
+        return util.get_api_items(self._data['Default Settings'], self._data['Iterations'][idx])
+
+    def _get_task_order(self):
+        if not self._data['Main'].get('Reorder Iterations'):
+            return super()._get_task_order()
+        loaded = util.get_api_items(self._data['Default Settings'])
+        api_items_seq = [self._get_task_api_items(idx) for idx in range(self._iter_cnt)]
+        order = util.group_by_api_items(api_items_seq, loaded)
+        uploads = util.count_api_item_uploads(api_items_seq, loaded)
+        reordered_uploads = util.count_api_item_uploads((api_items_seq[idx] for idx in order), loaded)
+        self._logger.info(
+            f'Iterations reordered by API item definition: {uploads - reordered_uploads} uploads saved '
+            f'({reordered_uploads} instead of {uploads})')
+        return order
+
+    def _prepare_task(self, idx: int):
+        iter_data = self._data['Iterations'][idx]
+        try:
+            iter_params = util.generate_params(
+                data=iter_data, settings=self._data['Default Settings'],
+                api_client=self._api_client, logger=self._logger
+            )
+            if iter_params is not None:
                 self._check_api_item_change(iter_params)
-                self._run_iter(iter_data=iter_data, iter_params=iter_params)
-            except OperationPausedException:
-                return
-            except IterationFailedException:
-                if not self._continue_on_error:
-                    return False
+        except ClientException as e:
+            self._logger.error(e)
+            iter_params = None
 
-            self._iter_idx += 1
+        if iter_params is None:
+            raise IterationFailedException
+        return {'iter_data': iter_data, 'iter_params': iter_params}
 
-        return True
+    def _run_task(self, *, idx: int, iter_data, iter_params):
+        return self._run_iter(iter_idx=idx, iter_data=iter_data, iter_params=iter_params)
+
+    def _commit_task(self, *, idx: int, result):
+        self._commit_iter(iter_idx=idx, iter_data=self._data['Iterations'][idx], result=result)
+
+    def _run(self):
+        return self._run_tasks()
 
 
 class ScreenRollingBacktestOperation(IterOperation):
@@ -213,44 +512,63 @@ class ScreenRollingBacktestOperation(IterOperation):
             name_len = len(iter_data['Name'] if 'Name' in iter_data else f'Iteration {iter_idx + 1}')
             if max_len < name_len:
                 max_len = name_len
-        self._header_row = data_cons.ROLLING_SCREEN_COLUMNS.copy()
+        self._header_row = util.get_rolling_screen_columns(self._data['Default Settings'].get('Windows'))
         self._header_row[0] = self._header_row[0].copy()
         self._header_row[0]['length'] = max_len
 
-    def _run_iter(self, *, iter_data, iter_params):
+    def _run_iter(self, *, iter_idx, iter_data, iter_params):
         try:
             params = util.update_iter_params(self._default_params, iter_params)
             json = self._api_client.screen_rolling_backtest(params)
             row = util.process_screen_rolling_backtest_result(
-                json, params.get('startDt'), params.get('endDt'), params.get('precision'))
-            name = iter_data['Name'] if 'Name' in iter_data else 'Iteration ' + str(self._iter_idx + 1)
+                json, params.get('startDt'), params.get('endDt'), params.get('precision'),
+                self._data['Default Settings'].get('Windows'))
+            name = iter_data['Name'] if 'Name' in iter_data else 'Iteration ' + str(iter_idx + 1)
             row = [name] + row
-            self._result.insert(self._iter_idx + 1, row)
-            self._write_row_to_output(row)
 
-            # append all results
+            # round all results
             if self._include_results:
                 precision = params.get('precision')
                 if precision is None:
                     precision = 2
-                self._result.append([])
-                self._result.append([name])
-                self._result.append(data_cons.ROLLING_SCREEN_COLUMNS_ALL)
-                for row in json['rows']:
-                    for row_idx, row_data in enumerate(row[5:]):
-                        row[5 + row_idx] = round(row_data, precision)
-                    self._result.append(row)
-
-            self._logger.info(f"Iteration {self._iter_idx + 1}/{self._iter_cnt}: success")
+                for result_row in json['rows']:
+                    for row_idx, row_data in enumerate(result_row[5:]):
+                        result_row[5 + row_idx] = round(row_data, precision)
+
+            self._logger.info(f"Iteration {iter_idx + 1}/{self._iter_cnt}: success")
+            return row, json['rows']
         except ClientException as e:
             self._logger.error(e)
-            self._logger.warning(f"Iteration {self._iter_idx + 1}/{self._iter_cnt}: failed")
+            self._logger.warning(f"Iteration {iter_idx + 1}/{self._iter_cnt}: failed")
             raise IterationFailedException
 
+    def _commit_iter(self, *, iter_idx, iter_data, result):
+        row, result_rows = result
+        self._result.insert(iter_idx + 1, row)
+        self._write_row_to_output(row)
+
+        # append all results
+        if self._include_results:
+            self._result.append([])
+            self._result.append([row[0]])
+            self._result.append(data_cons.ROLLING_SCREEN_COLUMNS_ALL)
+            self._result += result_rows
+
+    def get_sections(self):
+        if not self._include_results:
+            return
+        # summary, then the results of all iterations in one table
+        sections = export.split_sections(self._result)
+        rows = [['Iteration'] + data_cons.ROLLING_SCREEN_COLUMNS_ALL]
+        for name, section_rows in sections[1:]:
+            rows += [[name] + row for row in section_rows[1:]]
+        return [('Summary', sections[0][1]), ('Results', rows)]
+
 
 class ScreenRunOperation(Operation):
     def __init__(self, *, api_client, data, output, logger: logging.Logger):
         super().__init__(api_client=api_client, data=data, output=output, logger=logger)
+        self._result = self._new_result_store()
 
     def _init_header_row_custom(self, columns: list):
         name_idx = 0
@@ -279,7 +597,7 @@ class ScreenRunOperation(Operation):
                 self._header_row.append(column)
 
         self._init_col_setup()
-        self._result.insert(0, self._header_row)
+        self._result.set_header(self._header_row)
         self._write_row_to_output(self._header_row, False)
 
     def _run(self):
@@ -287,14 +605,12 @@ class ScreenRunOperation(Operation):
             if 'screen' not in self._default_params:
                 self._default_params['screen'] = {'type': self._data['Default Settings']['Type']}
             json = self._api_client.screen_run(self._default_params)
-            self._result += json['rows']
+            self._result.extend(json['rows'])
             self._init_header_row_custom(json['columns'])
             for row in self._result[1:101]:
                 self._write_row_to_output(row)
             if len(self._result) > 101:
-                self._output.configure(state='normal')
-                self._output.insert(tk.END, '\nOnly showing first 100 rows in preview.')
-                self._output.configure(state='disabled')
+                self._write_to_output('\nOnly showing first 100 rows in preview.')
 
         except ClientException as e:
             self._logger.error(e)
@@ -331,6 +647,54 @@ class ScreenBacktestOperation(Operation):
         self._init_col_setup()
         self._result.append(self._header_row)
 
+    def _write_preview_rows(self, rows_written_cnt):
+        """
+        Writes the rows added since the last call, within the first 100 rows of the preview
+        :return: number of rows written so far
+        """
+        rows_to_write = self._result[rows_written_cnt:100]
+        for row in rows_to_write:
+            self._write_row_to_output(row)
+        return rows_written_cnt + len(rows_to_write)
+
+    def _add_chart_stats(self, chart, rows_written_cnt):
+        """
+        Adds the stats of the sub-periods and rolling windows of the chart computed locally, if any
+        """
+        settings = self._data['Default Settings']
+        sub_periods = settings.get('Sub-Periods')
+        windows = settings.get('Rolling Windows')
+        if not sub_periods and not windows:
+            return
+        sub_periods = [('Full', None, None)] + [(
+            item.get('Name', f'Sub-Period {idx + 1}'),
+            *(transform.date(value=item[key]) if key in item else None for key in ('Start Date', 'End Date'))
+        ) for idx, item in enumerate(sub_periods or [])]
+        sub_period_rows, rolling_rows = backtest.process_screen_backtest_chart(
+            chart, sub_periods, windows or [], self._default_params.get('precision'))
+
+        self._result.append([])
+        self._result.append(['Sub-Period Stats'])
+        self._header_row = [
+            {'name': '', 'length': max([12] + [len(row[0]) for row in sub_period_rows]), 'justify': 'left'},
+            {'name': 'Start', 'length': 10, 'justify': 'left'},
+            {'name': 'End', 'length': 10, 'justify': 'left'}
+        ] + backtest.CHART_STATS_COLUMNS
+        self._init_col_setup()
+        self._result.append(self._header_row)
+        self._result += sub_period_rows
+        rows_written_cnt = self._write_preview_rows(rows_written_cnt)
+
+        if windows:
+            self._result.append([])
+            self._result.append(['Rolling Stats'])
+            self._header_row = [{'name': 'Date', 'length': 10, 'justify': 'left'}]
+            self._header_row += [f'{name} ({window})' for window in windows for name in backtest.CHART_ROLLING_STATS]
+            self._init_col_setup()
+            self._result.append(self._header_row)
+            self._result += rolling_rows
+            self._write_preview_rows(rows_written_cnt)
+
     def _run(self):
         try:
             if 'screen' not in self._default_params:
@@ -384,15 +748,11 @@ class ScreenBacktestOperation(Operation):
                     date, chart['screenReturns'][idx], chart['benchReturns'][idx], chart['turnoverPct'][idx],
                     chart['positionCnt'][idx]
                 ])
-            if rows_written_cnt < 100:
-                rows_to_write = self._result[rows_written_cnt:100]
-                for row in rows_to_write:
-                    self._write_row_to_output(row)
+            rows_written_cnt = self._write_preview_rows(rows_written_cnt)
+            self._add_chart_stats(chart, rows_written_cnt)
 
             if len(self._result) > 101:
-                self._output.configure(state='normal')
-                self._output.insert(tk.END, '\nOnly showing first 100 rows in preview.')
-                self._output.configure(state='disabled')
+                self._write_to_output('\nOnly showing first 100 rows in preview.')
 
         except ClientException as e:
             self._logger.error(e)
@@ -400,14 +760,61 @@ class ScreenBacktestOperation(Operation):
 
         return True
 
+    def get_sections(self):
+        return export.split_sections(self._result)
+
 
 class DataOperation(Operation):
+    """
+    Item lists longer than a data request allows are split into shards of data_cons.DATA_SHARD_SIZE items, and date
+    ranges with more than data_cons.DATA_CHUNK_VALUES values per shard into chunks of dates. The requests of each
+    (chunk, shard) are fetched in parallel ("Concurrency"), the shards of a chunk merged back in input order and the
+    chunks added in date order. A failed request leaves its items out of its chunk: the run stops there ("On Error":
+    Stop) or goes on, the failed requests being logged once the rows of the other requests are written.
+    """
     def __init__(self, *, api_client, data, output, logger: logging.Logger):
         super().__init__(api_client=api_client, data=data, output=output, logger=logger)
         self._include_names = self._data['Default Settings'].get('Include Names')
         if self._include_names:
             self._include_names = self._include_names['value']
         self._include_cusips = self._data['Default Settings'].get('Cusips')
+        self._result = self._new_result_store(
+            [KEY, KEY, KEY] + [KEY] * bool(self._include_cusips) + [KEY] * bool(self._include_names)
+            + [NUM] * len(self._data['Default Settings']['Formulas']))
+        self._items_field = next(
+            field for field in ('p123Uids', 'tickers', 'cusips', 'gvkeys', 'ciks') if field in self._default_params)
+        items = self._default_params[self._items_field]
+        self._shards = [items[idx:idx + data_cons.DATA_SHARD_SIZE]
+                        for idx in range(0, len(items), data_cons.DATA_SHARD_SIZE)]
+        self._chunks = self._get_chunks(min(len(items), data_cons.DATA_SHARD_SIZE))
+        self._shard_jsons = {}
+        self._added_chunk_cnt = 0
+        self._last_date = None
+        self._failed_idxs = []
+        self._iter_idx = 0
+        self._iter_cnt = len(self._chunks) * len(self._shards)
+
+    def _get_chunks(self, item_cnt: int):
+        """
+        Splits the date range so that a request holds at most data_cons.DATA_CHUNK_VALUES values
+        :param item_cnt: number of items of the largest shard
+        :return: list of (start date, end date) (YYYY-MM-DD)
+        """
+        start_date = datetime.date.fromisoformat(self._default_params['startDt'])
+        end_date = datetime.date.fromisoformat(self._default_params['endDt']) \
+            if 'endDt' in self._default_params else datetime.date.today()
+        freq_days = next((item['days'] for item in data_cons.FREQ
+                          if item['value'] == self._default_params.get('frequency')), data_cons.FREQ[1]['days'])
+        date_cnt = max(1, data_cons.DATA_CHUNK_VALUES // (item_cnt * len(self._data['Default Settings']['Formulas'])))
+        chunk_days = date_cnt * freq_days
+        chunks = []
+        while True:
+            chunk_end_date = start_date + datetime.timedelta(days=chunk_days - 1)
+            if chunk_end_date >= end_date:
+                chunks.append((str(start_date), self._default_params.get('endDt')))
+                return chunks
+            chunks.append((str(start_date), str(chunk_end_date)))
+            start_date = chunk_end_date + datetime.timedelta(days=1)
 
     def _init_header_row_custom(self):
         self._header_row = [
@@ -430,63 +837,244 @@ class DataOperation(Operation):
             name = str(list(formula.keys())[0] if misc.is_dict(formula) else formula)[:50]
             self._header_row.append({'name': name, 'length': max(len(name), 12)})
         self._init_col_setup()
-        self._result.insert(0, self._header_row)
+        self._result.set_header(self._header_row)
         self._write_row_to_output(self._header_row, False)
 
-    def _run(self):
+    def _get_task_name(self, idx: int):
+        chunk_idx, shard_idx = divmod(idx, len(self._shards))
+        details = []
+        if len(self._shards) > 1:
+            start = shard_idx * data_cons.DATA_SHARD_SIZE
+            details.append(f'items {start + 1}-{start + len(self._shards[shard_idx])}')
+        if len(self._chunks) > 1:
+            start_date, end_date = self._chunks[chunk_idx]
+            details.append(f'{start_date} to {end_date or "today"}')
+        return f'Request {idx + 1}/{self._iter_cnt}' + (f' ({", ".join(details)})' if details else '')
+
+    def _run_task(self, *, idx: int):
+        chunk_idx, shard_idx = divmod(idx, len(self._shards))
+        params = dict(self._default_params, **{self._items_field: self._shards[shard_idx]})
+        params['startDt'], end_date = self._chunks[chunk_idx]
+        if end_date is not None:
+            params['endDt'] = end_date
         try:
-            self._default_params['formulas'] = list(map(
-                lambda the_item: str(list(the_item.values())[0] if misc.is_dict(the_item) else the_item),
-                self._data['Default Settings']['Formulas']
-            ))
-            json = self._api_client.data(self._default_params)
-            for idx, date in enumerate(json['dates']):
-                for p123_uid, item in json['items'].items():
-                    row = [date, p123_uid, item['ticker']]
-                    if self._include_cusips:
-                        row.append(item['cusip'])
-                    if self._include_names:
-                        row.append(item['name'])
-                    for series_data in item['series']:
-                        row.append(series_data[idx])
-                    self._result.append(row)
+            json = self._api_client.data(params)
+            self._logger.info(f'{self._get_task_name(idx)}: success')
+            return json
+        except ClientException as e:
+            self._logger.error(e)
+            self._logger.warning(f'{self._get_task_name(idx)}: failed')
+            self._failed_idxs.append(idx)
+            raise IterationFailedException
+
+    def _commit_task(self, *, idx: int, result):
+        self._shard_jsons[idx] = result
+        # the chunks before this one are complete, so is this one once its last shard is in
+        self._add_chunk_rows(idx // len(self._shards) + ((idx + 1) % len(self._shards) == 0))
+
+    def _add_chunk_rows(self, chunk_cnt: int):
+        """
+        Adds the rows of the chunks up to #chunk_cnt - 1 not added yet
+        """
+        while self._added_chunk_cnt < chunk_cnt:
+            shard_cnt = len(self._shards)
+            start = self._added_chunk_cnt * shard_cnt
+            self._add_shard_rows([self._shard_jsons.pop(idx) for idx in range(start, start + shard_cnt)
+                                  if idx in self._shard_jsons])
+            self._added_chunk_cnt += 1
+
+    def _add_shard_rows(self, jsons: list):
+        """
+        Merges the responses of the shards of a chunk, items in input order, into one row per date and item
+        """
+        if not jsons:
+            return
+        # chunks are contiguous but the dates of the responses may not line up with their bounds
+        dates = [date for date in jsons[0]['dates'] if self._last_date is None or date > self._last_date]
+        if not dates:
+            return
+        self._last_date = dates[-1]
+        keys = []
+        items = []
+        item_series = []
+        for json in jsons:
+            shard_items = list(json['items'].values())
+            keys += json['items'].keys()
+            items += shard_items
+            if json['dates'] == dates:
+                item_series += [item['series'] for item in shard_items]
+                continue
+            # values of dates the other shards do not have are dropped, missing ones are left empty
+            date_idxs = {date: idx for idx, date in enumerate(json['dates'])}
+            idxs = [date_idxs.get(date) for date in dates]
+            item_series += [[[values[idx] if idx is not None else None for idx in idxs] for values in item['series']]
+                            for item in shard_items]
+
+        item_columns = [keys, [item['ticker'] for item in items]]
+        if self._include_cusips:
+            item_columns.append([item['cusip'] for item in items])
+        if self._include_names:
+            item_columns.append([item['name'] for item in items])
+        series_cnt = len(item_series[0]) if item_series else 0
+        for idx, date in enumerate(dates):
+            self._result.append_columns(
+                [date] + item_columns
+                + [[series[series_idx][idx] for series in item_series] for series_idx in range(series_cnt)],
+                len(items))
+        if self._result.get_header() is None and self._result.get_row_cnt() >= 100:
+            # the header only depends on the first 100 rows, once set the rows can be streamed into the output file
             self._init_header_row_custom()
+
+    def _run(self):
+        self._default_params['formulas'] = list(map(
+            lambda the_item: str(list(the_item.values())[0] if misc.is_dict(the_item) else the_item),
+            self._data['Default Settings']['Formulas']
+        ))
+
+        run_outcome = self._run_tasks()
+        if run_outcome and self._failed_cnt and self._iter_cnt == 1:
+            return False
+        if run_outcome is not None and self._iter_idx >= self._iter_cnt:
+            self._add_chunk_rows(len(self._chunks))
+            if self._result.get_header() is None:
+                self._init_header_row_custom()
             for row in self._result[1:101]:
                 self._write_row_to_output(row)
             if len(self._result) > 101:
-                self._output.configure(state='normal')
-                self._output.insert(tk.END, '\nOnly showing first 100 rows in preview.')
-                self._output.configure(state='disabled')
-        except ClientException as e:
-            self._logger.error(e)
-            return False
+                self._write_to_output('\nOnly showing first 100 rows in preview.')
+            if self._failed_idxs:
+                self._logger.error(
+                    f'{len(self._failed_idxs)} of {self._iter_cnt} requests failed, their items or dates are missing: '
+                    + ', '.join(self._get_task_name(idx) for idx in sorted(self._failed_idxs)))
 
-        return True
+        return run_outcome
 
 
-class DataUniverseOperation(Operation):
+class AsOfDatesOperation(Operation):
+    """
+    Operation that makes one request per as of date in self._dates; dates are fetched in parallel ("Concurrency")
+    and committed in date order.
+    A response only tells which dates resolve to its "dt" up to its own as of date, so the later dates of the grid
+    are never known to be duplicates before they are requested: within a run, duplicates are requested and dropped
+    when committed. The requests themselves are only saved by the next runs using the response cache with the same
+    request context, which leave the duplicates out of their grid (see _init_dates).
+    """
+    # API endpoint requested for each date
+    _endpoint = None
+
     def __init__(self, *, api_client, data, output, logger: logging.Logger):
         super().__init__(api_client=api_client, data=data, output=output, logger=logger)
-        date = self._data['Default Settings']['Start Date']
-        weekday = date.weekday()
-        date = date + datetime.timedelta(days=5 - weekday if weekday <= 5 else 6)
-        end_date = self._data['Default Settings'].get('End Date')
-        today = datetime.date.today()
-        if end_date is None or end_date > today:
-            end_date = today
         self._dates = []
-        freq = data['Default Settings'].get('Frequency')
-        if freq is None:
-            freq = data_cons.FREQ[1]['label']
-        days = data_cons.FREQ_BY_LABEL[freq.lower()]['days']
-        while date <= end_date:
-            self._dates.append(date)
-            date = date + datetime.timedelta(days=days)
+        self._freq_days = 7
+        self._iter_idx = 0
+        self._iter_cnt = 0
+        self._snapped_dates = None
+        self._committed_dates = set()
+        # indexes of the dates resolving to a date committed before them
+        self._skipped_idxs = set()
+
+    def _get_date_context(self):
+        """
+        :return: the request params the dates the server has data for depend on
+        """
+        return {meta_info['field']: self._default_params[meta_info['field']]
+                for meta_info in mapping_init.REQ_CONTEXT.values() if meta_info['field'] in self._default_params}
+
+    def _init_dates(self):
+        """
+        Sets the as of dates from the date grid of the settings, leaving out the dates known (from the responses of
+        previous runs) to resolve to the same date as an earlier one
+        """
+        settings = self._data['Default Settings']
+        freq = settings.get('Frequency')
+        self._freq_days = dates.get_freq_days(freq)
+        self._snapped_dates = self._api_client.get_snapped_dates(self._endpoint, self._get_date_context())
+        grid = list(dates.iter_grid(settings['Start Date'], settings.get('End Date'), freq))
+        self._dates = self._snapped_dates.dedup(grid)
+        if len(self._dates) < len(grid):
+            self._logger.info(
+                f'{len(grid) - len(self._dates)}/{len(grid)} dates skipped, they resolve to the same date as an '
+                f'earlier one')
         self._iter_idx = 0
         self._iter_cnt = len(self._dates)
+
+    def _get_task_key(self):
+        # the dates left out depend on the snapped dates cached when the run started
+        return [str(date) for date in self._dates]
+
+    def _init_incremental(self):
+        """
+        Drops the dates already stored in the sqlite output for the same input (see checkpoint.get_run_key). The API
+        may return the closest earlier date, so a date counts as stored if a stored date falls within the period it
+        starts.
+        """
+        if self._output_file is None or export.get_format(self._output_file) != 'sqlite':
+            self._logger.warning('Incremental mode requires a sqlite output, fetching all dates')
+            return False
+        stored = sorted(export.get_stored_dates(self._output_file, self._output_options))
+        dates = []
+        for date in self._dates:
+            idx = bisect.bisect_right(stored, date)
+            if not idx or (date - stored[idx - 1]).days >= self._freq_days:
+                dates.append(date)
+        self._logger.info(
+            f'Incremental mode: {len(self._dates) - len(dates)}/{len(self._dates)} dates already stored, '
+            f'{len(dates)} to fetch')
+        skipped = len(dates) < len(self._dates)
+        self._dates = dates
+        self._iter_cnt = len(dates)
+        return skipped
+
+    def _request(self, params):
+        """
+        The API request to make for each date
+        """
+        return getattr(self._api_client, self._endpoint)(params)
+
+    def _run_tasks(self):
+        run_outcome = super()._run_tasks()
+        if self._iter_idx >= self._iter_cnt and self._snapped_dates.get_added_cnt():
+            self._api_client.save_snapped_dates(self._endpoint, self._get_date_context(), self._snapped_dates)
+        return run_outcome
+
+    def _commit_task(self, *, idx: int, result):
+        snapped = datetime.date.fromisoformat(str(result['dt'])[:10])
+        self._snapped_dates.add(self._dates[idx], snapped)
+        if snapped in self._committed_dates:
+            self._logger.info(f'Iteration {idx + 1}/{self._iter_cnt}: {snapped} already fetched, skipped')
+            self._skipped_idxs.add(idx)
+            return
+        self._committed_dates.add(snapped)
+        self._commit_date(idx=idx, json=result)
+
+    def _commit_date(self, *, idx: int, json):
+        """
+        Stores the response for date #idx, called in date order once per date the server resolved to.
+        """
+
+    def _run_task(self, *, idx: int):
+        try:
+            json = self._request(dict(self._default_params, asOfDt=str(self._dates[idx])))
+            self._logger.info(f'Iteration {idx + 1}/{self._iter_cnt}: success')
+            return json
+        except ClientException as e:
+            self._logger.error(e)
+            self._logger.warning(f'Iteration {idx + 1}/{self._iter_cnt}: failed')
+            raise IterationFailedException
+
+
+class DataUniverseOperation(AsOfDatesOperation):
+    _endpoint = 'data_universe'
+
+    def __init__(self, *, api_client, data, output, logger: logging.Logger):
+        super().__init__(api_client=api_client, data=data, output=output, logger=logger)
+        self._init_dates()
         self._include_names = self._data['Default Settings'].get('Include Names')
         if self._include_names:
             self._include_names = self._include_names['value']
+        self._result = self._new_result_store(
+            [KEY, KEY, KEY] + [KEY] * bool(self._include_names)
+            + [NUM] * len(self._data['Default Settings']['Formulas']))
 
     def _init_default_params(self):
         super()._init_default_params()
@@ -510,7 +1098,7 @@ class DataUniverseOperation(Operation):
             name = str(list(formula.keys())[0] if misc.is_dict(formula) else formula)[:50]
             self._header_row.append({'name': name, 'length': max(len(name), 12)})
         self._init_col_setup()
-        self._result.insert(0, self._header_row)
+        self._result.set_header(self._header_row)
         self._write_row_to_output(self._header_row, False)
 
     def _run(self):
@@ -519,47 +1107,48 @@ class DataUniverseOperation(Operation):
             self._data['Default Settings']['Formulas']
         ))
 
-        while self._iter_idx < self._iter_cnt:
-            if self.is_paused():
-                return
-
-            try:
-                self._default_params['asOfDt'] = str(self._dates[self._iter_idx])
-                json = self._api_client.data_universe(self._default_params)
-                for idx, p123_uid in enumerate(json['p123Uids']):
-                    row = [json['dt'], p123_uid, json['tickers'][idx]]
-                    if self._include_names:
-                        row.append(json['names'][idx])
-                    for data in json['data']:
-                        row.append(data[idx])
-                    self._result.append(row)
-                self._logger.info(f'Iteration {self._iter_idx + 1}/{self._iter_cnt}: success')
-            except ClientException as e:
-                self._logger.error(e)
-                self._logger.warning(f'Iteration {self._iter_idx + 1}/{self._iter_cnt}: failed')
-                if not self._continue_on_error:
-                    break
-
-            self._iter_idx += 1
-
-        if self._iter_idx > 0:
-            self._init_header_row_custom()
+        run_outcome = self._run_tasks()
+        if run_outcome is not None and self._iter_idx > 0:
+            if self._result.get_header() is None:
+                self._init_header_row_custom()
             for row in self._result[1:101]:
                 self._write_row_to_output(row)
             if len(self._result) > 101:
-                self._output.configure(state='normal')
-                self._output.insert(tk.END, '\nOnly showing first 100 rows in preview.')
-                self._output.configure(state='disabled')
+                self._write_to_output('\nOnly showing first 100 rows in preview.')
 
-        return self._iter_idx == self._iter_cnt
+        return run_outcome
+
+    def _commit_date(self, *, idx: int, json):
+        columns = [json['dt'], json['p123Uids'], json['tickers']]
+        if self._include_names:
+            columns.append(json['names'])
+        self._result.append_columns(columns + json['data'], len(json['p123Uids']))
+        if self._result.get_header() is None and self._result.get_row_cnt() >= 100:
+            # the header only depends on the first 100 rows, once set the rows can be streamed into the output file
+            self._init_header_row_custom()
 
 
 class RankPerfOperation(IterOperation):
     def __init__(self, *, api_client, data, output, logger: logging.Logger):
         self._buckets = data['Default Settings']['Buckets']
+        self._metrics = data_cons.RANK_PERF_METRICS
+        # the local engine makes one rank request per rebalance date whatever the number of buckets
+        self._local = misc.coalesce(data['Default Settings'].get('Bucket Engine'), 'server').lower() == 'local'
+        if self._local:
+            self._metrics += backtest.RANK_PERF_LOCAL_METRICS
+        if data['Default Settings'].get('Bucket Metrics'):
+            self._metrics += data_cons.RANK_PERF_BUCKET_METRICS
         super().__init__(api_client=api_client, data=data, output=output, logger=logger)
-        self._run_idx = None
-        self._run_rows = None
+        # the bucket runs of an iteration are run in parallel instead of the iterations themselves, this way
+        # partial bucket runs can be kept across pauses
+        self._bucket_workers = self._max_workers
+        self._max_workers = 1
+        self._runs = None
+        self._checkpoint_runs = {}
+
+    def set_checkpoint(self, checkpoint: Checkpoint):
+        super().set_checkpoint(checkpoint)
+        self._checkpoint_runs = checkpoint.pop_runs()
 
     def _init_default_params(self):
         super()._init_default_params()
@@ -568,7 +1157,7 @@ class RankPerfOperation(IterOperation):
 
     def _init_header_row(self):
         max_len = 0
-        for name in data_cons.RANK_PERF_METRICS:
+        for name in self._metrics:
             name_len = len(name)
             if max_len < name_len:
                 max_len = name_len
@@ -577,98 +1166,172 @@ class RankPerfOperation(IterOperation):
         self._header_row.append('Universe')
         self._header_row.append('Benchmark')
 
-    def _run_iter(self, *, iter_data, iter_params):
-        params = util.update_iter_params(self._default_params, iter_params)
-        name = iter_data['Name'] if 'Name' in iter_data else 'Iteration ' + str(self._iter_idx + 1)
-
-        if self._run_idx is None:
-            self._run_idx = 0
-            self._run_rows = []
-            for metric in data_cons.RANK_PERF_METRICS:
-                self._run_rows.append([metric])
+    def _run_request(self, *, iter_idx, run_idx, run_cnt, request, params):
+        try:
+            json = request(params)
+            self._logger.info(f"Iteration {iter_idx + 1}/{self._iter_cnt} run {run_idx + 1}/{run_cnt}: success")
+            return json
+        except ClientException as e:
+            self._logger.error(e)
+            self._logger.warning(f"Iteration {iter_idx + 1}/{self._iter_cnt} run {run_idx + 1}/{run_cnt}: failed")
+            if not self._continue_on_error:
+                raise IterationFailedException
 
+    def _get_run_params(self, params, run_idx):
+        run_params = params.copy()
+        run_params['screen'] = params['screen'].copy()
         screen_rules = params['screen'].get('rules')
+        run_screen_rules = screen_rules.copy() if screen_rules else []
+        if run_idx < self._buckets:
+            start = round(100 / self._buckets * run_idx, 2)
+            end = round(100 / self._buckets * (run_idx + 1), 2)
+            formula = 'Rank >= {} and Rank <{} {}'.format(start, '=' if run_idx == self._buckets - 1 else '', end)
+            run_screen_rules.append({'formula': formula})
+        if run_screen_rules:
+            run_params['screen']['rules'] = run_screen_rules
+        elif 'rules' in run_params['screen']:
+            del run_params['screen']['rules']
+        return run_params
+
+    def _get_runs(self, params):
+        """
+        :return: list of (API method, params) of the runs of an iteration: one screen backtest per bucket then one for
+            the universe
+        """
+        return [(self._api_client.screen_backtest, self._get_run_params(params, run_idx))
+                for run_idx in range(self._buckets + 1)]
+
+    def _get_local_runs(self, params, min_price):
+        """
+        :return: list of (API method, params) of the runs of an iteration with the local engine: ranks and forward
+            returns for each rebalance date, then the benchmark returns if there is a benchmark
+        """
+        screen = params['screen']
+        if 'startDt' not in params:
+            self._logger.error('"Start Date" is required by the local bucket engine')
+            raise IterationFailedException
+        days = backtest.get_rebalance_days(params.get('rebalFreq'))
+        formula = misc.coalesce(
+            self._data['Default Settings'].get('Return Formula'), backtest.get_return_formula(days))
+        rank_params = {'rankingSystem': screen['ranking'], 'additionalData': [formula]}
+        if min_price is not None:
+            rank_params['additionalData'].append('close(0)')
+        if 'universe' in screen:
+            rank_params['universe'] = screen['universe']
+        for meta_info in mapping_init.REQ_CONTEXT.values():
+            if meta_info['field'] in params:
+                rank_params[meta_info['field']] = params[meta_info['field']]
+        dates = backtest.get_rebalance_dates(params['startDt'], params.get('endDt'), days)
+        runs = [(self._api_client.rank_ranks, dict(rank_params, asOfDt=date)) for date in dates]
+        if screen.get('benchmark') and dates:
+            freq = params.get('rebalFreq')
+            runs.append((self._api_client.data, {
+                'tickers': [screen['benchmark']], 'formulas': [formula], 'startDt': dates[0], 'endDt': dates[-1],
+                'frequency': freq if freq in mapping_data.FREQ.values() else data_cons.FREQ[1]['value']
+            }))
+        return runs
+
+    def _get_min_price(self, iter_data):
+        min_price = iter_data.get('Minimum Price', self._data['Default Settings'].get('Minimum Price'))
+        return min_price['value'] if min_price is not None else None
+
+    def _run_iter(self, *, iter_idx, iter_data, iter_params):
+        params = util.update_iter_params(self._default_params, iter_params)
         params['transPrice'] = 4
+        min_price = self._get_min_price(iter_data)
+        runs = self._get_local_runs(params, min_price) if self._local else self._get_runs(params)
 
-        # add one more run to the number of buckets for the universe
-        while self._run_idx < self._buckets + 1:
-            if self.is_paused():
-                raise OperationPausedException
-
-            run_screen_rules = screen_rules.copy() if screen_rules else []
-            if self._run_idx < self._buckets:
-                start = round(100 / self._buckets * self._run_idx, 2)
-                end = round(100 / self._buckets * (self._run_idx + 1), 2)
-                formula =\
-                    'Rank >= {} and Rank <{} {}'.format(start, '=' if self._run_idx == self._buckets - 1 else '', end)
-                run_screen_rules.append({'formula': formula})
-            if run_screen_rules:
-                params['screen']['rules'] = run_screen_rules
-            elif 'rules' in params['screen']:
-                del params['screen']['rules']
-
-            try:
-                json = self._api_client.screen_backtest(params)
-                util.process_rank_perf_result(json, self._run_rows, True, params.get('precision'))
-                if self._run_idx == self._buckets:
-                    util.process_rank_perf_result(json, self._run_rows, False, params.get('precision'))
-                self._logger.info(
-                    f"Iteration {self._iter_idx + 1}/{self._iter_cnt} "
-                    f"run {self._run_idx + 1}/{self._buckets + 1}: success")
-            except ClientException as e:
-                self._logger.error(e)
-                self._logger.warning(
-                    f"Iteration {self._iter_idx + 1}/{self._iter_cnt} "
-                    f"run {self._run_idx + 1}/{self._buckets + 1}: failed")
-                if not self._continue_on_error:
-                    raise IterationFailedException
-                for row in self._run_rows:
-                    row.append(None)
-
-            self._run_idx += 1
-
-        if self._iter_idx > 0:
+        if self._runs is None:
+            self._runs = self._checkpoint_runs.pop(iter_idx, {})
+
+        run_idxs = [run_idx for run_idx in range(len(runs)) if run_idx not in self._runs]
+        submitted = []
+        failed = False
+        executor = OrderedExecutor(self._bucket_workers)
+        try:
+            while True:
+                for run_idx in submitted.copy():
+                    future = executor.pop(run_idx)
+                    if future is not None:
+                        submitted.remove(run_idx)
+                        try:
+                            self._runs[run_idx] = future.result()
+                            if self._checkpoint is not None:
+                                self._checkpoint.add_run(iter_idx, run_idx, self._runs[run_idx])
+                        except IterationFailedException:
+                            failed = True
+
+                if not submitted and (failed or self.is_paused() or not run_idxs):
+                    break
+                if run_idxs and not failed and not self.is_paused() and executor.has_capacity():
+                    run_idx = run_idxs.pop(0)
+                    request, run_params = runs[run_idx]
+                    executor.submit(run_idx, functools.partial(
+                        self._run_request, iter_idx=iter_idx, run_idx=run_idx, run_cnt=len(runs), request=request,
+                        params=run_params))
+                    submitted.append(run_idx)
+                    continue
+                executor.wait()
+        finally:
+            executor.shutdown()
+
+        if failed:
+            self._runs = None
+            raise IterationFailedException
+        if run_idxs:
+            raise OperationPausedException
+
+        jsons = [self._runs[run_idx] for run_idx in range(len(runs))]
+        bucket_metrics = data_cons.RANK_PERF_BUCKET_METRICS[0] in self._metrics
+        if self._local:
+            has_bench = bool(runs) and bool(params['screen'].get('benchmark'))
+            run_rows = backtest.process_rank_perf(
+                rank_jsons=jsons[:-1] if has_bench else jsons, bench_json=jsons[-1] if has_bench else None,
+                buckets=self._buckets, short=params['screen'].get('method') == 'short', min_price=min_price,
+                slippage=params.get('slippage'), days=backtest.get_rebalance_days(params.get('rebalFreq')),
+                precision=params.get('precision'), bucket_metrics=bucket_metrics)
+        else:
+            run_rows = util.process_rank_perf_results(jsons, params.get('precision'), bucket_metrics)
+        self._runs = None
+        return run_rows
+
+    def _commit_iter(self, *, iter_idx, iter_data, result):
+        name = iter_data['Name'] if 'Name' in iter_data else 'Iteration ' + str(iter_idx + 1)
+        if iter_idx > 0:
             row = []
             self._result.append(row)
             self._write_row_to_output(row)
         row = [name]
         self._result.append(row)
-        self._write_row_to_output(row, newline=self._iter_idx > 0)
+        self._write_row_to_output(row, newline=iter_idx > 0)
         self._result.append(self._header_row)
         self._write_row_to_output(self._header_row)
-        for row in self._run_rows:
+        for row in result:
             self._result.append(row)
             self._write_row_to_output(row)
 
-        self._run_idx = None
+    def get_sections(self):
+        # one table for all iterations
+        rows = [['Iteration'] + self._header_row]
+        for name, section_rows in export.split_sections(self._result):
+            rows += [[name] + row for row in section_rows[1:]]
+        return [(None, rows)]
+
 
+class RankRanksOperation(AsOfDatesOperation):
+    _endpoint = 'rank_ranks'
 
-class RankRanksOperation(Operation):
     def __init__(self, *, api_client, data, output, logger: logging.Logger):
         super().__init__(api_client=api_client, data=data, output=output, logger=logger)
-        date = self._data['Default Settings']['Start Date']
-        weekday = date.weekday()
-        date = date + datetime.timedelta(days=5 - weekday if weekday <= 5 else 6)
-        end_date = self._data['Default Settings'].get('End Date')
-        today = datetime.date.today()
-        if end_date is None or end_date > today:
-            end_date = today
-        self._dates = []
-        freq = data['Default Settings'].get('Frequency')
-        if freq is None:
-            freq = data_cons.FREQ[1]['label']
-        days = data_cons.FREQ_BY_LABEL[freq.lower()]['days']
-        while date <= end_date:
-            self._dates.append(date)
-            date = date + datetime.timedelta(days=days)
-        self._iter_idx = 0
-        self._iter_cnt = len(self._dates)
+        self._init_dates()
         self._columns = misc.coalesce(self._data['Default Settings'].get('Columns'), 'ranks').lower()
         if self._columns != 'ranks':
             self._default_params['nodeDetails'] = self._columns
+        self._nodes = None
         self._include_names = self._data['Default Settings'].get('Include Names')
         if self._include_names:
             self._include_names = self._include_names['value']
+        self._result = self._new_result_store([KEY, KEY, KEY] + [KEY] * bool(self._include_names) + [NUM, KEY, NUM])
 
     def _init_header_row_custom(self):
         self._header_row = [
@@ -697,7 +1360,7 @@ class RankRanksOperation(Operation):
                 name = str(list(formula.keys())[0] if misc.is_dict(formula) else formula)[:50]
                 self._header_row.append({'name': name, 'length': max(len(name), 12)})
         self._init_col_setup()
-        self._result.insert(0, self._header_row)
+        self._result.set_header(self._header_row)
         self._write_row_to_output(self._header_row, False)
 
     def _add_nodes_to_header_row(self):
@@ -718,131 +1381,115 @@ class RankRanksOperation(Operation):
                 additional_data
             ))
 
-        while self._iter_idx < self._iter_cnt:
-            if self.is_paused():
-                return
-
-            try:
-                self._default_params['asOfDt'] = str(self._dates[self._iter_idx])
-                json = self._api_client.rank_ranks(self._default_params)
-                if self._columns != 'ranks' and self._iter_idx == 0:
-                    self._nodes = json['nodes']
-                additional_data = json.get('additionalData')
-                for idx, p123_uid in enumerate(json['p123Uids']):
-                    row = [json['dt'], p123_uid, json['tickers'][idx]]
-                    if self._include_names:
-                        row.append(json['names'][idx])
-                    row += [json['naCnt'][idx], 'Y' if json['finalStmt'][idx] else 'N', json['ranks'][idx]]
-                    if self._columns != 'ranks':
-                        for node_idx, rank in enumerate(json['nodes']['ranks'][idx]):
-                            if node_idx > 0:
-                                row.append(rank)
-                    if additional_data is not None:
-                        row += additional_data[idx]
-                    self._result.append(row)
-
-                self._logger.info(f'Iteration {self._iter_idx + 1}/{self._iter_cnt}: success')
-
-            except ClientException as e:
-                self._logger.error(e)
-                self._logger.warning(f'Iteration {self._iter_idx + 1}/{self._iter_cnt}: failed')
-                if not self._continue_on_error:
-                    break
-
-            self._iter_idx += 1
-
-        if self._iter_idx > 0:
-            self._init_header_row_custom()
+        run_outcome = self._run_tasks()
+        if run_outcome is not None and self._iter_idx > 0:
+            if self._result.get_header() is None:
+                self._init_header_row_custom()
             for row in self._result[1:101]:
                 self._write_row_to_output(row)
             if len(self._result) > 101:
-                self._output.configure(state='normal')
-                self._output.insert(tk.END, '\nOnly showing first 100 rows in preview.')
-                self._output.configure(state='disabled')
+                self._write_to_output('\nOnly showing first 100 rows in preview.')
 
-        return self._iter_idx == self._iter_cnt
+        return run_outcome
 
+    def _commit_date(self, *, idx: int, json):
+        if self._columns != 'ranks' and self._nodes is None:
+            self._nodes = json['nodes']
+        additional_data = json.get('additionalData')
+        columns = [json['dt'], json['p123Uids'], json['tickers']]
+        if self._include_names:
+            columns.append(json['names'])
+        columns += [json['naCnt'], ['Y' if final_stmt else 'N' for final_stmt in json['finalStmt']], json['ranks']]
+        # node ranks and additional data come row by row
+        if self._columns != 'ranks':
+            columns += list(zip(*json['nodes']['ranks']))[1:]
+        if additional_data is not None:
+            columns += zip(*additional_data)
+        self._result.append_columns(columns, len(json['p123Uids']))
+        if self._result.get_header() is None and self._result.get_row_cnt() >= 100:
+            # the header only depends on the first 100 rows, once set the rows can be streamed into the output file
+            self._init_header_row_custom()
+
+
+class RankRanksPeriodOperation(AsOfDatesOperation):
+    _endpoint = 'rank_ranks'
 
-class RankRanksPeriodOperation(Operation):
     def __init__(self, *, api_client, data, output, logger: logging.Logger):
         super().__init__(api_client=api_client, data=data, output=output, logger=logger)
-        date = self._data['Default Settings']['Start Date']
-        weekday = date.weekday()
-        date = date + datetime.timedelta(days=5 - weekday if weekday <= 5 else 6)
-        end_date = self._data['Default Settings'].get('End Date')
-        today = datetime.date.today()
-        if end_date is None or end_date > today:
-            end_date = today
-        self._dates = []
-        freq = data['Default Settings'].get('Frequency')
-        if freq is None:
-            freq = data_cons.FREQ[1]['label']
-        days = data_cons.FREQ_BY_LABEL[freq.lower()]['days']
-        while date <= end_date:
-            self._dates.append(date)
-            date = date + datetime.timedelta(days=days)
-        self._iter_idx = 0
-        self._iter_cnt = len(self._dates)
+        self._init_dates()
         self._include_names = self._data['Default Settings'].get('Include Names')
         if self._include_names:
             self._include_names = self._include_names['value']
-        self._ranks_by_p123_uid = {}
+        # wide: one row per stock, one column per date; long: one row per stored (stock, date, rank)
+        self._long_layout = self._data['Default Settings'].get('Output Layout', 'wide').lower() == 'long'
+        self._panel = self._data['Default Settings'].get('Panel', 'dense').lower()
+        if self._long_layout and self._panel == 'dense':
+            self._panel = 'sparse'
+        self._delta_threshold = self._data['Default Settings'].get('Delta Threshold', 0)
+        self._pivot = None
+        self._result = self._new_result_store(
+            [KEY, KEY] + [KEY] * bool(self._include_names)
+            + ([KEY, NUM] if self._long_layout else [NUM] * self._iter_cnt))
 
     def _init_header_row_custom(self):
         self._header_row = [{'name': 'P123 UID', 'justify': 'left', 'length': 10}]
         max_len = 0
-        for row in self._result[:100]:
+        for row in self._pivot.get_items()[:100]:
             max_len = max(max_len, len(row[1]))
         self._header_row.append({'name': 'Ticker', 'justify': 'left', 'length': max_len})
         if self._include_names:
             max_len = 0
-            for row in self._result[:100]:
+            for row in self._pivot.get_items()[:100]:
                 max_len = max(max_len, len(row[2]))
             self._header_row.append({'name': 'Name', 'justify': 'left', 'length': max_len})
-        for date in self._dates:
-            self._header_row.append(str(date))
+        if self._long_layout:
+            self._header_row += [{'name': 'Date', 'justify': 'left', 'length': 10}, 'Rank']
+        else:
+            for idx in self._get_period_idxs():
+                self._header_row.append(str(self._dates[idx]))
         self._init_col_setup()
-        self._result.insert(0, self._header_row)
+        self._result.set_header(self._header_row)
         self._write_row_to_output(self._header_row, False)
 
     def _run(self):
-        while self._iter_idx < self._iter_cnt:
-            if self.is_paused():
-                return
-
-            try:
-                self._default_params['asOfDt'] = str(self._dates[self._iter_idx])
-                json = self._api_client.rank_ranks(self._default_params)
-                self._dates[self._iter_idx] = json['dt']
-                for idx, p123_uid in enumerate(json['p123Uids']):
-                    if p123_uid not in self._ranks_by_p123_uid:
-                        row = [p123_uid, json['tickers'][idx]]
-                        if self._include_names:
-                            row.append(json['names'][idx])
-                        self._result.append(row)
-                        self._ranks_by_p123_uid[p123_uid] = [None] * self._iter_cnt
-                    self._ranks_by_p123_uid[p123_uid][self._iter_idx] = json['ranks'][idx]
-                self._logger.info(f'Iteration {self._iter_idx + 1}/{self._iter_cnt}: success')
-            except ClientException as e:
-                self._logger.error(e)
-                self._logger.warning(f'Iteration {self._iter_idx + 1}/{self._iter_cnt}: failed')
-                if not self._continue_on_error:
-                    break
-
-            self._iter_idx += 1
-
-        if self._iter_idx > 0:
-            for row in self._result:
-                row += self._ranks_by_p123_uid[row[0]]
+        if self._pivot is None:
+            self._pivot = self._new_pivot(encoding=self._panel, threshold=self._delta_threshold)
+        run_outcome = self._run_tasks()
+        if run_outcome is not None and self._iter_idx > 0:
             self._init_header_row_custom()
+            if self._panel != 'dense':
+                self._logger.info(
+                    f'Ranks panel ({self._panel}): {self._pivot.get_stored_cnt()} values stored out of '
+                    f'{len(self._pivot.get_items()) * self._iter_cnt}')
+            if self._long_layout:
+                blocks = self._pivot.iter_records([str(date) for date in self._dates])
+            else:
+                blocks = self._pivot.iter_blocks(self._get_period_idxs())
+            for length, columns in blocks:
+                self._result.append_columns(columns, length)
+            self._pivot.close()
             for row in self._result[1:101]:
                 self._write_row_to_output(row)
             if len(self._result) > 101:
-                self._output.configure(state='normal')
-                self._output.insert(tk.END, '\nOnly showing first 100 rows in preview.')
-                self._output.configure(state='disabled')
+                self._write_to_output('\nOnly showing first 100 rows in preview.')
+
+        return run_outcome
 
-        return self._iter_idx == self._iter_cnt
+    def _get_period_idxs(self):
+        """
+        :return: indexes of the dates of the wide layout columns, dates resolving to an earlier one are left out
+        """
+        return [idx for idx in range(self._iter_cnt) if idx not in self._skipped_idxs]
+
+    def _commit_date(self, *, idx: int, json):
+        self._dates[idx] = json['dt']
+        self._pivot.add_period(idx, json['p123Uids'], json['ranks'], functools.partial(self._get_item, json))
+
+    def _get_item(self, json, uid_idx: int):
+        row = [json['p123Uids'][uid_idx], json['tickers'][uid_idx]]
+        if self._include_names:
+            row.append(json['names'][uid_idx])
+        return row
 
 
 class RankRanksMultiOperation(IterOperation):
@@ -851,17 +1498,18 @@ class RankRanksMultiOperation(IterOperation):
         self._include_names = self._data['Default Settings'].get('Include Names')
         if self._include_names:
             self._include_names = self._include_names['value']
-        self._ranks_by_p123_uid = {}
+        self._pivot = None
+        self._result = self._new_result_store([KEY, KEY] + [KEY] * bool(self._include_names) + [NUM] * self._iter_cnt)
 
     def _init_header_row_custom(self):
         self._header_row = [{'name': 'P123 UID', 'justify': 'left', 'length': 10}]
         max_len = 0
-        for row in self._result[:100]:
+        for row in self._pivot.get_items()[:100]:
             max_len = max(max_len, len(row[1]))
         self._header_row.append({'name': 'Ticker', 'justify': 'left', 'length': max_len})
         if self._include_names:
             max_len = 0
-            for row in self._result[:100]:
+            for row in self._pivot.get_items()[:100]:
                 max_len = max(max_len, len(row[2]))
             self._header_row.append({'name': 'Name', 'justify': 'left', 'length': max_len})
         for iter_idx, iter_data in enumerate(self._data['Iterations']):
@@ -871,41 +1519,45 @@ class RankRanksMultiOperation(IterOperation):
                 name = ranking_system if misc.is_str(ranking_system) else f'Iteration {iter_idx + 1}'
             self._header_row.append(name)
         self._init_col_setup()
-        self._result.insert(0, self._header_row)
+        self._result.set_header(self._header_row)
         self._write_row_to_output(self._header_row, False)
 
     def _run(self):
+        if self._pivot is None:
+            self._pivot = self._new_pivot()
         run_outcome = super()._run()
         if run_outcome is not None and self._iter_idx > 0:
-            for row in self._result:
-                row += self._ranks_by_p123_uid[row[0]]
             self._init_header_row_custom()
+            for length, columns in self._pivot.iter_blocks():
+                self._result.append_columns(columns, length)
+            self._pivot.close()
             for row in self._result[1:101]:
                 self._write_row_to_output(row)
             if len(self._result) > 101:
-                self._output.configure(state='normal')
-                self._output.insert(tk.END, '\nOnly showing first 100 rows in preview.')
-                self._output.configure(state='disabled')
+                self._write_to_output('\nOnly showing first 100 rows in preview.')
         return run_outcome
 
-    def _run_iter(self, *, iter_data, iter_params):
+    def _run_iter(self, *, iter_idx, iter_data, iter_params):
         try:
             params = util.update_iter_params(self._default_params, iter_params)
             json = self._api_client.rank_ranks(params)
-            for idx, p123_uid in enumerate(json['p123Uids']):
-                if p123_uid not in self._ranks_by_p123_uid:
-                    row = [p123_uid, json['tickers'][idx]]
-                    if self._include_names:
-                        row.append(json['names'][idx])
-                    self._result.append(row)
-                    self._ranks_by_p123_uid[p123_uid] = [None] * self._iter_cnt
-                self._ranks_by_p123_uid[p123_uid][self._iter_idx] = json['ranks'][idx]
-            self._logger.info(f'Iteration {self._iter_idx + 1}/{self._iter_cnt}: success')
+            self._logger.info(f'Iteration {iter_idx + 1}/{self._iter_cnt}: success')
+            return json
         except ClientException as e:
             self._logger.error(e)
-            self._logger.warning(f'Iteration {self._iter_idx + 1}/{self._iter_cnt}: failed')
+            self._logger.warning(f'Iteration {iter_idx + 1}/{self._iter_cnt}: failed')
             raise IterationFailedException
 
+    def _commit_iter(self, *, iter_idx, iter_data, result):
+        json = result
+        self._pivot.add_period(iter_idx, json['p123Uids'], json['ranks'], functools.partial(self._get_item, json))
+
+    def _get_item(self, json, uid_idx: int):
+        row = [json['p123Uids'][uid_idx], json['tickers'][uid_idx]]
+        if self._include_names:
+            row.append(json['names'][uid_idx])
+        return row
+
 
 class OperationPausedException(Exception):
     pass
@@ -1057,6 +1709,9 @@ def process_input(*, data: dict, logger: logging.Logger):
         if not util.validate_iteration(
                 operation=operation, iteration_idx=iteration_idx, iteration_data=iteration_data, logger=logger):
             return False
+        if 'validate_iteration' in operation and not operation['validate_iteration'](
+                data['Default Settings'], iteration_idx, iteration_data, logger):
+            return False
 
     return True
 
@@ -1071,7 +1726,9 @@ OPERATIONS = {
     },
     'rankperformance': {
         'class': RankPerfOperation,
-        'mapping': {'settings': mapping_screen.RANK_PERF_SETTINGS, 'iterations': mapping_screen.RANK_PERF_ITERATIONS}
+        'mapping': {'settings': mapping_screen.RANK_PERF_SETTINGS, 'iterations': mapping_screen.RANK_PERF_ITERATIONS},
+        'validate_settings': util.validate_rank_perf_settings,
+        'validate_iteration': util.validate_rank_perf_iteration
     },
     'data': {
         'class': DataOperation,
@@ -0,0 +1,320 @@
+import array
+import struct
+import tempfile
+
+_NAN = float('nan')
+# period index, number of values, whether integers are flagged
+_RECORD_HEADER = struct.Struct('<iiB')
+
+ENCODINGS = ('dense', 'sparse', 'delta')
+
+
+class Pivot:
+    """
+    Values by item and period (ranks by stock and date, by stock and ranking system...) collected period by period
+    and read back item by item. Values are encoded as:
+        dense - a float matrix (one row per item, NaN when missing) or, when spilling, a temporary file so that only
+            the items (key and meta row) stay in memory
+        sparse - (item, period, value) records of the values present only
+        delta - records of the values that moved by more than a threshold since the last record of the item, items
+            leaving are recorded with a NaN value; values in between are filled from the previous record
+    Whatever the encoding the dense panel is read back by iter_blocks.
+    """
+    def __init__(self, *, period_cnt: int, spill: bool = False, encoding: str = 'dense', threshold: float = 0,
+                 chunk_bytes: int = 64 * 1024 * 1024):
+        """
+        :param period_cnt: number of periods (columns)
+        :param spill: write values of the dense encoding into a temporary file
+        :param encoding: see ENCODINGS
+        :param threshold: min change of a value recorded by the delta encoding
+        :param chunk_bytes: max size of the values read back at once
+        """
+        self._period_cnt = period_cnt
+        self._encoding = encoding
+        self._threshold = threshold
+        self._chunk_bytes = chunk_bytes
+        self._items = []
+        self._item_idxs = {}
+        self._nan_row = array.array('d', [_NAN]) * period_cnt
+        self._matrix = None
+        # integer flags of the matrix values, allocated with the first integer
+        self._ints = None
+        self._capacity = 0
+        self._spill = None
+        # records of the sparse and delta encodings, integer flags allocated with the first integer
+        self._record_items = array.array('i')
+        self._record_periods = array.array('i')
+        self._record_values = array.array('d')
+        self._record_ints = None
+        # periods added, others (failed) are read back as missing
+        self._periods = bytearray(period_cnt)
+        # delta encoding: last value recorded by item and items present in the last period
+        self._last_values = array.array('d')
+        self._present = set()
+        if encoding == 'dense':
+            if spill:
+                self._spill = tempfile.TemporaryFile()
+            else:
+                self._matrix = array.array('d')
+
+    def get_items(self):
+        """
+        :return: meta rows of the items, in order of appearance
+        """
+        return self._items
+
+    def _reserve(self, item_cnt: int):
+        """
+        Grows the matrix to hold at least item_cnt items, by half its size at least
+        """
+        if item_cnt <= self._capacity:
+            return
+        added_cnt = max(item_cnt - self._capacity, self._capacity // 2)
+        self._matrix.extend(self._nan_row * added_cnt)
+        if self._ints is not None:
+            self._ints.extend(bytes(added_cnt * self._period_cnt))
+        self._capacity += added_cnt
+
+    def add_period(self, period_idx: int, keys: list, values: list, get_item):
+        """
+        :param period_idx:
+        :param keys: item keys (P123 UIDs...)
+        :param values: value of each item
+        :param get_item: returns the meta row of the item at some index of keys, called for new items only
+        """
+        item_idxs = list(map(self._item_idxs.get, keys))
+        if None in item_idxs:
+            for idx, item_idx in enumerate(item_idxs):
+                if item_idx is None:
+                    item_idx = self._item_idxs.get(keys[idx])
+                    if item_idx is None:
+                        item_idx = self._item_idxs[keys[idx]] = len(self._items)
+                        self._items.append(get_item(idx))
+                    item_idxs[idx] = item_idx
+        item_idxs = array.array('i', item_idxs)
+
+        ints = None
+        if int in set(map(type, values)):
+            ints = bytearray(type(value) is int for value in values)
+        floats = array.array('d', [_NAN if value is None else value for value in values] if None in values else values)
+        self._periods[period_idx] = 1
+
+        if self._encoding == 'sparse':
+            self._add_records(period_idx, item_idxs, floats, ints, None not in values)
+            return
+        if self._encoding == 'delta':
+            self._add_delta_records(period_idx, item_idxs, floats, ints)
+            return
+        if self._spill is not None:
+            self._spill.write(_RECORD_HEADER.pack(period_idx, len(values), ints is not None))
+            self._spill.write(item_idxs.tobytes())
+            self._spill.write(floats.tobytes())
+            if ints is not None:
+                self._spill.write(ints)
+            return
+
+        self._reserve(len(self._items))
+        if ints is not None and self._ints is None:
+            self._ints = bytearray(len(self._matrix))
+        self._scatter(self._matrix, self._ints, 0, len(self._items), period_idx, item_idxs, floats, ints)
+
+    def _add_records(self, period_idx: int, item_idxs, floats, ints, all_present: bool):
+        if not all_present:
+            present = [idx for idx, value in enumerate(floats) if value == value]
+            item_idxs = array.array('i', [item_idxs[idx] for idx in present])
+            floats = array.array('d', [floats[idx] for idx in present])
+            ints = bytearray(ints[idx] for idx in present) if ints is not None else None
+        if ints is not None and self._record_ints is None:
+            self._record_ints = bytearray(len(self._record_values))
+        self._record_items.extend(item_idxs)
+        self._record_periods.extend(array.array('i', (period_idx,)) * len(item_idxs))
+        self._record_values.extend(floats)
+        if self._record_ints is not None:
+            self._record_ints.extend(ints if ints is not None else bytes(len(floats)))
+
+    def _add_delta_records(self, period_idx: int, item_idxs, floats, ints):
+        last_values = self._last_values
+        if len(last_values) < len(self._items):
+            last_values.extend(array.array('d', [_NAN]) * (len(self._items) - len(last_values)))
+        previous = self._present
+        present = set()
+        record_idxs = []
+        threshold = self._threshold
+        for idx, (item_idx, value) in enumerate(zip(item_idxs, floats)):
+            if value != value:
+                continue
+            present.add(item_idx)
+            if item_idx not in previous or abs(value - last_values[item_idx]) > threshold:
+                last_values[item_idx] = value
+                record_idxs.append(idx)
+        self._present = present
+        self._add_records(
+            period_idx, array.array('i', [item_idxs[idx] for idx in record_idxs]),
+            array.array('d', [floats[idx] for idx in record_idxs]),
+            bytearray(ints[idx] for idx in record_idxs) if ints is not None else None, True)
+        # items that left
+        left = sorted(previous - present)
+        if left:
+            self._add_records(
+                period_idx, array.array('i', left), array.array('d', [_NAN]) * len(left), None, True)
+
+    def get_stored_cnt(self):
+        """
+        :return: number of values stored, cells of the matrix or records
+        """
+        if self._encoding == 'dense':
+            return len(self._items) * self._period_cnt
+        return len(self._record_values)
+
+    def _fill_records(self, matrix, matrix_ints, start: int, end: int, order: list):
+        """
+        Writes the records of the items start to end - 1 into matrix, delta records are repeated until the next one
+        :param order: record indexes sorted by item then period (delta encoding)
+        """
+        period_cnt = self._period_cnt
+        items, periods, values, ints = \
+            self._record_items, self._record_periods, self._record_values, self._record_ints
+        if self._encoding == 'sparse':
+            for idx, item_idx in enumerate(items):
+                if start <= item_idx < end:
+                    offset = (item_idx - start) * period_cnt + periods[idx]
+                    matrix[offset] = values[idx]
+                    if ints is not None:
+                        matrix_ints[offset] = ints[idx]
+            return
+
+        for pos, idx in enumerate(order):
+            item_idx = items[idx]
+            value = values[idx]
+            if not start <= item_idx < end or value != value:
+                continue
+            next_idx = order[pos + 1] if pos + 1 < len(order) else None
+            end_period = periods[next_idx] if next_idx is not None and items[next_idx] == item_idx else period_cnt
+            offset = (item_idx - start) * period_cnt
+            matrix[offset + periods[idx]:offset + end_period] = array.array('d', (value,)) * (end_period - periods[idx])
+            if ints is not None and ints[idx]:
+                matrix_ints[offset + periods[idx]:offset + end_period] = b'\x01' * (end_period - periods[idx])
+
+    def iter_records(self, period_labels: list, block_size: int = 65536):
+        """
+        :param period_labels: label of each period (date...)
+        :param block_size: max number of records by block
+        :return: iterator over blocks of records of the sparse and delta encodings, meta row followed by the period
+            label and the value (NaN for items leaving), as (number of rows, list of columns)
+        """
+        for start in range(0, len(self._record_values), block_size):
+            end = min(start + block_size, len(self._record_values))
+            columns = list(zip(*[self._items[item_idx] for item_idx in self._record_items[start:end]]))
+            columns.append([period_labels[period_idx] for period_idx in self._record_periods[start:end]])
+            values = self._record_values[start:end]
+            if self._record_ints is not None and 1 in self._record_ints[start:end]:
+                values = [int(value) if flag else value for value, flag in zip(values, self._record_ints[start:end])]
+            columns.append(values)
+            yield end - start, columns
+
+    def _scatter(self, matrix, matrix_ints, start: int, end: int, period_idx: int, item_idxs, floats, ints):
+        """
+        Writes the values of a period into the rows of items start to end - 1 of matrix, other items are skipped
+        """
+        period_cnt = self._period_cnt
+        first = item_idxs[0] if item_idxs else 0
+        if item_idxs and start <= first and first + len(item_idxs) <= end \
+                and item_idxs == array.array('i', range(first, first + len(item_idxs))):
+            # items in row order (same universe as the previous periods): a single strided slice assignment
+            offset = (first - start) * period_cnt + period_idx
+            matrix[offset:offset + len(floats) * period_cnt:period_cnt] = floats
+            if matrix_ints is not None:
+                matrix_ints[offset:offset + len(floats) * period_cnt:period_cnt] = ints or bytes(len(floats))
+            return
+        for idx, item_idx in enumerate(item_idxs):
+            if start <= item_idx < end:
+                offset = (item_idx - start) * period_cnt + period_idx
+                matrix[offset] = floats[idx]
+                if matrix_ints is not None:
+                    matrix_ints[offset] = ints[idx] if ints is not None else 0
+
+    def _read_records(self):
+        self._spill.seek(0)
+        while True:
+            header = self._spill.read(_RECORD_HEADER.size)
+            if not header:
+                return
+            period_idx, cnt, has_ints = _RECORD_HEADER.unpack(header)
+            item_idxs = array.array('i')
+            item_idxs.frombytes(self._spill.read(cnt * item_idxs.itemsize))
+            floats = array.array('d')
+            floats.frombytes(self._spill.read(cnt * floats.itemsize))
+            ints = bytearray(self._spill.read(cnt)) if has_ints else None
+            yield period_idx, item_idxs, floats, ints
+
+    def _get_columns(self, matrix, matrix_ints, start: int, end: int, period_idxs):
+        """
+        :return: meta columns then value columns (of the periods period_idxs) of the items start to end - 1, matrix
+            being the pivot's matrix or a chunk holding these rows only
+        """
+        period_cnt = self._period_cnt
+        offset = start * period_cnt if matrix is self._matrix else 0
+        end_offset = offset + (end - start) * period_cnt
+        columns = list(zip(*self._items[start:end]))
+        for period_idx in period_idxs:
+            values = matrix[offset + period_idx:end_offset:period_cnt]
+            flags = matrix_ints[offset + period_idx:end_offset:period_cnt] if matrix_ints is not None else None
+            if flags is not None and 1 in flags:
+                values = [int(value) if flag else value for value, flag in zip(values, flags)]
+            columns.append(values)
+        return columns
+
+    def iter_blocks(self, period_idxs: list = None):
+        """
+        :param period_idxs: periods read back, all of them if None
+        :return: iterator over blocks of item rows, meta row followed by the value of each period (NaN if missing), as
+            (number of rows, list of columns)
+        """
+        if period_idxs is None:
+            period_idxs = range(self._period_cnt)
+        chunk_size = max(1, self._chunk_bytes // (8 * max(1, self._period_cnt)))
+        if self._encoding != 'dense':
+            missing = [period_idx for period_idx, added in enumerate(self._periods) if not added]
+            order = None
+            if self._encoding == 'delta':
+                # records of each item in period order (the sort is stable)
+                order = sorted(range(len(self._record_items)), key=self._record_items.__getitem__)
+            for start in range(0, len(self._items), chunk_size):
+                end = min(start + chunk_size, len(self._items))
+                matrix = self._nan_row * (end - start)
+                matrix_ints = bytearray(len(matrix)) if self._record_ints is not None else None
+                self._fill_records(matrix, matrix_ints, start, end, order)
+                for period_idx in missing:
+                    matrix[period_idx::self._period_cnt] = array.array('d', [_NAN]) * (end - start)
+                    if matrix_ints is not None:
+                        matrix_ints[period_idx::self._period_cnt] = bytes(end - start)
+                yield end - start, self._get_columns(matrix, matrix_ints, start, end, period_idxs)
+            return
+        if self._spill is None:
+            for start in range(0, len(self._items), chunk_size):
+                end = min(start + chunk_size, len(self._items))
+                yield end - start, self._get_columns(self._matrix, self._ints, start, end, period_idxs)
+            return
+
+        self._spill.flush()
+        # transposed chunk by chunk of items, reading the whole file once per chunk
+        for start in range(0, len(self._items), chunk_size):
+            end = min(start + chunk_size, len(self._items))
+            matrix = self._nan_row * (end - start)
+            matrix_ints = None
+            for period_idx, item_idxs, floats, ints in self._read_records():
+                if ints is not None and matrix_ints is None:
+                    matrix_ints = bytearray(len(matrix))
+                self._scatter(matrix, matrix_ints, start, end, period_idx, item_idxs, floats, ints)
+            yield end - start, self._get_columns(matrix, matrix_ints, start, end, period_idxs)
+
+    def close(self):
+        """
+        Releases the values
+        """
+        self._matrix = None
+        self._ints = None
+        self._record_items = self._record_periods = self._record_values = self._record_ints = None
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
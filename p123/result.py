@@ -0,0 +1,530 @@
+import array
+import bisect
+import datetime
+import itertools
+import mmap
+import pickle
+import tempfile
+
+KEY = 'key'
+NUM = 'num'
+OBJ = 'obj'
+
+FLOAT_TYPES = {'float64': 'd', 'float32': 'f'}
+
+_NAN = float('nan')
+# integers above this cannot be stored exactly in a float64
+_MAX_EXACT_INT = 2 ** 53
+
+
+class _Fallback(Exception):
+    """Raised when a value does not fit a typed column"""
+
+
+class Dictionary:
+    """Distinct values of a dictionary encoded column, shared by all the blocks of a store"""
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def encode(self, value):
+        if value is None:
+            return -1
+        # 1, 1.0 and True are equal keys
+        key = (value.__class__, value)
+        try:
+            code = self._codes.get(key)
+        except TypeError:
+            raise _Fallback
+        if code is None:
+            code = self._codes[key] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class KeyColumn:
+    """Dictionary encoded column for repeated values: dates, uids, tickers, names..."""
+    kind = KEY
+
+    def __init__(self, dictionary: Dictionary):
+        self.dictionary = dictionary
+        self.codes = array.array('i')
+
+    def extend(self, values):
+        self.codes.extend(array.array('i', map(self.dictionary.encode, values)))
+
+    def extend_repeat(self, value, length: int):
+        self.codes.extend(array.array('i', (self.dictionary.encode(value),)) * length)
+
+    def get(self, idx: int):
+        code = self.codes[idx]
+        return self.dictionary.values[code] if code >= 0 else None
+
+    def get_values(self):
+        values = self.dictionary.values
+        return [values[code] if code >= 0 else None for code in self.codes]
+
+    def nbytes(self):
+        return self.codes.itemsize * len(self.codes)
+
+
+class NumColumn:
+    """
+    Numeric column backed by a typed float array, None is stored as NaN. Integers are flagged so that they are read
+    back as integers.
+    """
+    kind = NUM
+
+    def __init__(self, typecode: str):
+        self.values = array.array(typecode)
+        self.ints = None
+        self._single = typecode == 'f'
+
+    def extend(self, values):
+        start = len(self.values)
+        try:
+            self.values.extend(values)
+        except TypeError:
+            del self.values[start:]
+            self.values.extend([self._convert(value) for value in values])
+        types = set(map(type, values))
+        if types == {float}:
+            if self.ints is not None:
+                self.ints += bytes(len(values))
+            return
+        int_flags = None
+        for idx, value in enumerate(values):
+            if type(value) is not float:
+                if value is None:
+                    continue
+                if type(value) is not int or abs(value) > _MAX_EXACT_INT:
+                    del self.values[start:]
+                    raise _Fallback
+                if int_flags is None:
+                    int_flags = bytearray(len(values))
+                int_flags[idx] = 1
+        if int_flags is not None and self.ints is None:
+            self.ints = bytearray(start)
+        if self.ints is not None:
+            self.ints += int_flags if int_flags is not None else bytes(len(values))
+
+    @staticmethod
+    def _convert(value):
+        if value is None:
+            return _NAN
+        if type(value) is bool or not isinstance(value, (int, float)):
+            raise _Fallback
+        return value
+
+    def get(self, idx: int):
+        value = self.values[idx]
+        if value != value:
+            return None
+        if self.ints is not None and self.ints[idx]:
+            return int(value)
+        # float32 holds ~7 significant digits, drop the binary noise
+        return float(f'{value:.7g}') if self._single else value
+
+    def get_values(self):
+        if self.ints is None and not self._single:
+            return [value if value == value else None for value in self.values]
+        return [self.get(idx) for idx in range(len(self.values))]
+
+    def nbytes(self):
+        return self.values.itemsize * len(self.values) + (len(self.ints) if self.ints is not None else 0)
+
+
+class ObjColumn:
+    """Plain list of values, for anything the typed columns cannot hold"""
+    kind = OBJ
+
+    def __init__(self):
+        self.values = []
+
+    def extend(self, values):
+        self.values.extend(values)
+
+    def get(self, idx: int):
+        return self.values[idx]
+
+    def get_values(self):
+        return self.values
+
+    def nbytes(self):
+        return 8 * len(self.values)
+
+
+class Block:
+    """Rows appended together (one request, iteration or date), stored column by column"""
+    def __init__(self, columns: list):
+        self.columns = columns
+        self.length = 0
+
+    def extend_columns(self, columns: list, length: int):
+        """
+        :param columns: list of sequences of length values, any other value is repeated over all rows
+        :param length:
+        """
+        for col_idx, values in enumerate(columns):
+            column = self.columns[col_idx]
+            if not isinstance(values, (list, tuple, array.array)):
+                if column.kind == KEY and values is not None:
+                    try:
+                        column.extend_repeat(values, length)
+                        continue
+                    except _Fallback:
+                        pass
+                values = [values] * length
+            try:
+                column.extend(values)
+            except _Fallback:
+                obj_column = ObjColumn()
+                obj_column.extend(column.get_values()[:self.length])
+                obj_column.extend(values)
+                self.columns[col_idx] = obj_column
+        self.length += length
+
+    def get_row(self, idx: int):
+        return [column.get(idx) for column in self.columns]
+
+    def iter_rows(self):
+        columns = [column.get_values() for column in self.columns]
+        return (list(row) for row in zip(*columns))
+
+    def nbytes(self):
+        return sum(column.nbytes() for column in self.columns)
+
+
+class SpillFile:
+    """Temporary file blocks are moved into once a store goes over its memory limit, read back memory mapped"""
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._size = 0
+        self._map = None
+
+    def write(self, data):
+        """
+        :return: offset of data in the file
+        """
+        offset = self._size
+        self._file.seek(offset)
+        self._file.write(data)
+        self._size += len(data)
+        return offset
+
+    def read(self, offset: int, size: int):
+        if self._map is None or offset + size > len(self._map):
+            # the file grew since it was mapped
+            if self._map is not None:
+                self._map.close()
+            self._file.flush()
+            self._map = mmap.mmap(self._file.fileno(), self._size, access=mmap.ACCESS_READ)
+        return self._map[offset:offset + size]
+
+    def nbytes(self):
+        return self._size
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+class SpilledBlock:
+    """Block whose columns were written into a SpillFile, only the location of each column stays in memory"""
+    def __init__(self, spill: SpillFile, block: Block):
+        self.length = block.length
+        self._spill = spill
+        # (kind, dictionary or typecode, offset, size, offset of the integer flags or None, size of the flags)
+        self._columns = []
+        for column in block.columns:
+            ints_offset, ints_size = None, 0
+            if column.kind == KEY:
+                spec, data = column.dictionary, column.codes.tobytes()
+            elif column.kind == NUM:
+                spec, data = column.values.typecode, column.values.tobytes()
+                if column.ints is not None:
+                    ints_offset, ints_size = spill.write(column.ints), len(column.ints)
+            else:
+                spec, data = None, pickle.dumps(column.values, protocol=pickle.HIGHEST_PROTOCOL)
+            self._columns.append((column.kind, spec, spill.write(data), len(data), ints_offset, ints_size))
+
+    def load(self):
+        """
+        :return: the Block read back from the spill file
+        """
+        columns = []
+        for kind, spec, offset, size, ints_offset, ints_size in self._columns:
+            if kind == KEY:
+                column = KeyColumn(spec)
+                column.codes.frombytes(self._spill.read(offset, size))
+            elif kind == NUM:
+                column = NumColumn(spec)
+                column.values.frombytes(self._spill.read(offset, size))
+                if ints_offset is not None:
+                    column.ints = bytearray(self._spill.read(ints_offset, ints_size))
+            else:
+                column = ObjColumn()
+                column.values = pickle.loads(self._spill.read(offset, size))
+            columns.append(column)
+        block = Block(columns)
+        block.length = self.length
+        return block
+
+    def nbytes(self):
+        return 0
+
+
+def infer_kind(value):
+    if value is None or (isinstance(value, (int, float)) and not isinstance(value, bool)):
+        return NUM
+    if isinstance(value, (str, bool, datetime.date)):
+        return KEY
+    return OBJ
+
+
+class ResultStore:
+    """
+    Columnar result of an operation: rows are kept in blocks of typed arrays (dictionary encoded keys and strings,
+    float64 or float32 numbers) instead of lists of boxed values. The store behaves like the list of rows it replaces,
+    the header row (once set) being row 0.
+    A store can also stream its rows into a sink (see set_sink), only keeping the rows not written yet and a preview.
+    Past its memory limit the oldest blocks are moved into a temporary file and read back from it when needed.
+    """
+    def __init__(self, *, kinds: list = None, float_type: str = None, block_size: int = 65536,
+                 memory_limit: int = None):
+        """
+        :param kinds: kind of each column (KEY, NUM or OBJ), inferred from the first row if missing
+        :param float_type: float64 (default) or float32
+        :param block_size: max number of rows of blocks built by appending rows
+        :param memory_limit: max size of the blocks kept in memory (bytes), no limit if None
+        """
+        self._kinds = list(kinds) if kinds is not None else None
+        self._typecode = FLOAT_TYPES[(float_type or 'float64').lower()]
+        self._block_size = block_size
+        self._dictionaries = None
+        self._header = None
+        self._blocks = []
+        self._starts = []
+        self._row_cnt = 0
+        # rows appended one by one, moved into a block once there are enough of them
+        self._pending_rows = []
+        self._sink = None
+        self._sink_closed = False
+        self._preview = []
+        self._preview_size = 0
+        self._streamed_cnt = 0
+        self._memory_limit = memory_limit
+        self._memory_nbytes = 0
+        self._spill = None
+        # index of the first block still in memory, blocks are spilled oldest first
+        self._spilled_cnt = 0
+        # last block read back from the spill file: (index, block)
+        self._loaded = None
+
+    def _init_columns(self, row):
+        if self._kinds is None:
+            self._kinds = [infer_kind(value) for value in row]
+        elif len(self._kinds) < len(row):
+            self._kinds += [infer_kind(value) for value in row[len(self._kinds):]]
+        if self._dictionaries is None:
+            self._dictionaries = [Dictionary() if kind == KEY else None for kind in self._kinds]
+        elif len(self._dictionaries) < len(self._kinds):
+            self._dictionaries += [
+                Dictionary() if kind == KEY else None for kind in self._kinds[len(self._dictionaries):]]
+
+    def _new_block(self, width: int):
+        columns = []
+        for col_idx in range(width):
+            kind = self._kinds[col_idx]
+            if kind == KEY:
+                columns.append(KeyColumn(self._dictionaries[col_idx]))
+            elif kind == NUM:
+                columns.append(NumColumn(self._typecode))
+            else:
+                columns.append(ObjColumn())
+        return Block(columns)
+
+    def _add_block(self, block: Block):
+        self._starts.append(self._row_cnt)
+        self._blocks.append(block)
+        self._row_cnt += block.length
+        self._memory_nbytes += block.nbytes()
+        if self._sink is not None and self._header is not None:
+            self._stream_blocks()
+        elif self._memory_limit is not None and self._memory_nbytes > self._memory_limit:
+            self._spill_blocks()
+
+    def _spill_blocks(self):
+        """
+        Moves the oldest blocks into the spill file until half the memory limit is used, so that spills are batched
+        """
+        if self._spill is None:
+            self._spill = SpillFile()
+        while self._spilled_cnt < len(self._blocks) and self._memory_nbytes > self._memory_limit // 2:
+            block = self._blocks[self._spilled_cnt]
+            self._blocks[self._spilled_cnt] = SpilledBlock(self._spill, block)
+            self._memory_nbytes -= block.nbytes()
+            self._spilled_cnt += 1
+
+    def _get_block(self, block_idx: int):
+        block = self._blocks[block_idx]
+        if not isinstance(block, SpilledBlock):
+            return block
+        if self._loaded is None or self._loaded[0] != block_idx:
+            self._loaded = (block_idx, block.load())
+        return self._loaded[1]
+
+    def _iter_loaded_blocks(self):
+        for block in self._blocks:
+            yield block.load() if isinstance(block, SpilledBlock) else block
+
+    def _stream_blocks(self):
+        for block in self._iter_loaded_blocks():
+            if len(self._preview) < self._preview_size:
+                self._preview += itertools.islice(block.iter_rows(), self._preview_size - len(self._preview))
+            self._sink.write_block(block)
+            self._streamed_cnt += block.length
+        self._blocks = []
+        self._starts = []
+        self._memory_nbytes = 0
+        self._spilled_cnt = 0
+        self._loaded = None
+
+    def set_sink(self, sink, preview_size: int = 1000):
+        """
+        Streams rows into sink (see p123.export) instead of keeping them: blocks are written as soon as the header is
+        set and then dropped, except for the first preview_size rows
+        """
+        self._sink = sink
+        self._preview_size = preview_size
+
+    def close(self):
+        """
+        Writes the remaining rows into the sink and closes it
+        """
+        if self._sink is None or self._sink_closed:
+            return
+        self._sink_closed = True
+        try:
+            self._flush_rows()
+            # no header was set, write the held rows anyway
+            self._stream_blocks()
+        finally:
+            self._sink.close()
+
+    def _flush_rows(self):
+        if not self._pending_rows:
+            return
+        rows = self._pending_rows
+        self._pending_rows = []
+        # a block holds rows of the same length
+        start = 0
+        for idx in range(1, len(rows) + 1):
+            if idx == len(rows) or len(rows[idx]) != len(rows[start]):
+                self._append_block(list(zip(*rows[start:idx])), idx - start)
+                start = idx
+
+    def set_header(self, header: list):
+        first = self._header is None
+        self._header = header
+        if self._sink is not None and first:
+            # rows held until now go right after the header
+            self._sink.write_header(header)
+            self._stream_blocks()
+
+    def get_header(self):
+        return self._header
+
+    def append(self, row: list):
+        self._pending_rows.append(row)
+        if len(self._pending_rows) >= self._block_size:
+            self._flush_rows()
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def append_columns(self, columns: list, length: int):
+        """
+        Appends a block of rows given column by column, as returned by the API
+        :param columns: list of sequences of length values, any other value is repeated over all rows
+        :param length: number of rows
+        """
+        if not length:
+            return
+        self._flush_rows()
+        self._append_block(columns, length)
+
+    def _append_block(self, columns: list, length: int):
+        self._init_columns(
+            [column[0] if isinstance(column, (list, tuple, array.array)) else column for column in columns])
+        block = self._new_block(len(columns))
+        block.extend_columns(columns, length)
+        self._add_block(block)
+
+    def get_row_cnt(self):
+        """
+        :return: number of rows, excluding the header
+        """
+        return self._row_cnt + len(self._pending_rows)
+
+    def get_kinds(self):
+        return self._kinds
+
+    def iter_blocks(self):
+        """
+        :return: iterator over blocks of rows, spilled blocks being read back one at a time
+        """
+        self._flush_rows()
+        return self._iter_loaded_blocks()
+
+    def nbytes(self):
+        """
+        :return: approximate size of the values kept in memory
+        """
+        return sum(block.nbytes() for block in self._blocks) + 8 * sum(
+            len(dictionary.values) for dictionary in self._dictionaries or [] if dictionary is not None)
+
+    def get_usage(self):
+        """
+        :return: (approximate size of the values kept in memory, size of the spill file) in bytes
+        """
+        return self.nbytes(), self._spill.nbytes() if self._spill is not None else 0
+
+    def _get_data_row(self, idx: int):
+        if idx >= self._row_cnt:
+            return list(self._pending_rows[idx - self._row_cnt])
+        if idx < self._streamed_cnt:
+            if idx < len(self._preview):
+                return list(self._preview[idx])
+            raise IndexError('result row already written to the output')
+        block_idx = bisect.bisect_right(self._starts, idx) - 1
+        return self._get_block(block_idx).get_row(idx - self._starts[block_idx])
+
+    def __len__(self):
+        return self.get_row_cnt() + (1 if self._header is not None else 0)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[row_idx] for row_idx in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError('result index out of range')
+        if self._header is not None:
+            if idx == 0:
+                return self._header
+            idx -= 1
+        return self._get_data_row(idx)
+
+    def __iter__(self):
+        if self._streamed_cnt:
+            # only works if the rows written into the sink are all in the preview
+            yield from self[:]
+            return
+        if self._header is not None:
+            yield self._header
+        for block in self.iter_blocks():
+            yield from block.iter_rows()
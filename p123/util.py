@@ -1,8 +1,14 @@
+import array
+import itertools
 import logging
+import math
+import operator
 from p123api import Client
-import statistics
+import json
 import utils.misc as misc
 import p123.mapping.init as mapping_init
+import p123.data.cons as data_cons
+import p123.data.transform as transform
 
 
 def generate_params(*, data: dict, settings, api_client: Client, logger: logging.Logger):
@@ -67,139 +73,226 @@ def update_iter_params(init_params: dict, iter_params: dict):
     return params
 
 
-def process_screen_rolling_backtest_result(json: dict, start_dt, end_dt, precision):
+def get_api_items(*sections: dict):
+    """
+    Maps the server side API items (ApiUniverse/ApiRankingSystem) the combined sections rely on to their definition;
+    properties of later sections override the ones of earlier sections
+    :param sections: data with meta info annotations
+    :return: dict
+    """
+    entries = {}
+    for section in sections:
+        for entry in section.values():
+            if misc.is_dict(entry) and 'meta_info' in entry:
+                entries[(entry['meta_info'].get('type'), entry['meta_info']['field'])] = entry
+    api_items = {}
+    for entry in entries.values():
+        name = transform.api_item(value=entry['value'], transform_fn=entry['meta_info'].get('transform'))
+        if name is not None:
+            api_items[name] = json.dumps(entry['value'], sort_keys=True, default=str)
+    return api_items
+
+
+def count_api_item_uploads(api_items_seq, loaded: dict):
+    """
+    Counts the API item definitions that need to be uploaded to run tasks in sequence
+    :param api_items_seq: API items (name => definition) of each task, in execution order
+    :param loaded: API items loaded before the first task
+    :return: int
+    """
+    loaded = dict(loaded)
+    uploads = 0
+    for api_items in api_items_seq:
+        for name, definition in api_items.items():
+            if loaded.get(name) != definition:
+                loaded[name] = definition
+                uploads += 1
+    return uploads
+
+
+def group_by_api_items(api_items_seq, loaded: dict):
+    """
+    Orders tasks so that tasks relying on the same API item definitions run next to each other. Groups are picked
+    greedily, the one needing the fewest uploads given the currently loaded definitions goes first; tasks keep their
+    relative order within a group.
+    :param api_items_seq: API items (name => definition) of each task
+    :param loaded: API items loaded before the first task
+    :return: list of task indexes
+    """
+    groups = {}
+    for idx, api_items in enumerate(api_items_seq):
+        groups.setdefault(tuple(sorted(api_items.items())), []).append(idx)
+
+    loaded = dict(loaded)
+    order = []
+    while groups:
+        key = min(groups, key=lambda group: sum(loaded.get(name) != definition for name, definition in group))
+        loaded.update(key)
+        order += groups.pop(key)
+    return order
+
+
+def get_rolling_screen_columns(windows: list = None):
+    """
+    :param windows: lookback windows, see data_cons.ROLLING_SCREEN_WINDOWS
+    :return: header of the rolling screen summary, the average number of positions being given for the longest
+        window only
+    """
+    windows = windows or data_cons.ROLLING_SCREEN_WINDOWS
+    return data_cons.ROLLING_SCREEN_COLUMNS + [f'Last{window}AvgRet%' for window in windows] \
+        + ['GeoMeanRet%', 'GeoMeanBench%'] + [f'Last{window}GeoMeanRet%' for window in windows] \
+        + [f'Last{max(windows)}Avg#Pos']
+
+
+def process_screen_rolling_backtest_result(json: dict, start_dt, end_dt, precision, windows: list = None):
+    """
+    Summary row of a rolling screen backtest: each column used is parsed once into a float array, means and geometric
+    means over all rows or the first rows (most recent) of each window then come from prefix sums of the values and
+    of their logs
+    :param windows: lookback windows, see data_cons.ROLLING_SCREEN_WINDOWS
+    """
     if precision is None:
         precision = 2
-    length = len(json['rows'])
+    windows = windows or data_cons.ROLLING_SCREEN_WINDOWS
+    rows = json['rows']
+    length = len(rows)
+    window_rows = rows[:max(windows)]
+
+    def parse(col_idx, col_rows=rows):
+        return array.array('d', map(float, map(operator.itemgetter(col_idx), col_rows)))
+
+    ret = parse(5)
+    ret_logs = array.array('d', map(math.log, [value / 100 + 1 for value in ret]))
+    ret_sums = list(itertools.accumulate(ret[:len(window_rows)], initial=0))
+    ret_log_sums = list(itertools.accumulate(ret_logs[:len(window_rows)], initial=0))
+    pos_sums = list(itertools.accumulate(parse(4, window_rows), initial=0))
+    bench_logs = map(math.log, [value / 100 + 1 for value in parse(6)])
+
+    def mean(sums, cnt):
+        return round(sums[cnt] / cnt, precision) if length >= cnt > 0 else None
+
+    def geo_mean(log_sum, cnt):
+        return round((math.exp(log_sum / cnt) - 1) * 100, precision) if length >= cnt > 0 else None
+
     data = [start_dt, end_dt, length]
     data.extend(val for val in json['average'][4:8])
-    data.append(min(float(item[8]) for item in json['rows']))
-    data.append(max(float(item[9]) for item in json['rows']))
+    data.append(min(parse(8)) if length else None)
+    data.append(max(parse(9)) if length else None)
     data.append(json['average'][10])
-    data.append(
-        round(statistics.fmean(float(item[5]) for item in json['rows'][0:13]), precision)
-        if length >= 13 else None
-    )
-    data.append(
-        round(statistics.fmean(float(item[5]) for item in json['rows'][0:65]), precision)
-        if length >= 65 else None
-    )
-    data.append(
-        round((statistics.geometric_mean(float(item[5]) / 100 + 1 for item in json['rows']) - 1) * 100, precision)
-    )
-    data.append(
-        round((statistics.geometric_mean(float(item[6]) / 100 + 1 for item in json['rows']) - 1) * 100, precision)
-    )
-    data.append(
-        round((statistics.geometric_mean(float(item[5]) / 100 + 1 for item in json['rows'][0:13]) - 1) * 100, precision)
-        if length >= 13 else None
-    )
-    data.append(
-        round((statistics.geometric_mean(float(item[5]) / 100 + 1 for item in json['rows'][0:65]) - 1) * 100, precision)
-        if length >= 65 else None
-    )
-    data.append(
-        round(statistics.fmean(float(item[4]) for item in json['rows'][0:65]), precision)
-        if length >= 65 else None
-    )
+    data.extend(mean(ret_sums, window) for window in windows)
+    data.append(geo_mean(math.fsum(ret_logs), length))
+    data.append(geo_mean(math.fsum(bench_logs), length))
+    data.extend(geo_mean(ret_log_sums[window] if window <= length else 0, window) for window in windows)
+    data.append(mean(pos_sums, max(windows)))
     return data
 
 
-def process_rank_perf_result(json: dict, rows: list, port_mode: bool, precision):
-    if precision is None:
-        precision = 2
-
+def _get_rank_perf_metrics(json: dict, port_mode: bool, precision):
+    """
+    :return: values of data_cons.RANK_PERF_METRICS for the portfolio or the benchmark of a run
+    """
     port_or_bench = 'port' if port_mode else 'bench'
+    stats = json['stats']
+    result_rows = json['results']['rows']
+
+    # each column used is parsed once
+    def parse(col_idx):
+        return array.array('d', map(float, map(operator.itemgetter(col_idx), result_rows)))
+
+    returns = parse(8 if port_mode else 9)
+    values = [
+        misc.round_or_none(stats[port_or_bench]['annualized_return'], precision),
+        misc.round_or_none(stats['port']['annualized_return'] - stats['bench']['annualized_return'], precision)
+        if port_mode else None,
+        misc.round_or_none(stats[port_or_bench]['total_return'], precision),
+        round(sum(map((0.0).__lt__, parse(10))) / len(result_rows) * 100, precision) if port_mode else None,
+        round(max(returns), precision),
+        round(min(returns), precision)
+    ]
+    if port_mode:
+        values += [round(max(parse(16)), precision), round(min(parse(15)), precision),
+                   misc.round_or_none(json['results']['upMarkets'][10], precision),
+                   misc.round_or_none(json['results']['downMarkets'][10], precision)]
+    else:
+        values += [None] * 4
+    values += [misc.round_or_none(stats[port_or_bench].get(key), precision)
+               for key in ('sharpe_ratio', 'sortino_ratio', 'standard_dev', 'max_drawdown')]
+    values += [misc.round_or_none(stats[key], precision) if port_mode and stats.get(key) else None
+               for key in ('beta', 'alpha')]
+    values.append(misc.round_or_none(json['results']['average'][4], precision) if port_mode else None)
+    return values
+
 
-    # one results iteration to rule them all
-    per_outperform_cnt = 0
-    ret_key = 8 if port_mode else 9
-    max_loss = float(json['results']['rows'][0][ret_key])
-    max_gain = float(json['results']['rows'][0][ret_key])
-    max_loss_single_stock = float(json['results']['rows'][0][15])
-    max_gain_single_stock = float(json['results']['rows'][0][16])
-    for result_row in json['results']['rows']:
-        per_outperform_cnt += 1 if float(result_row[10]) > 0 else 0
-        max_loss = min(max_loss, float(result_row[ret_key]))
-        max_gain = max(max_gain, float(result_row[ret_key]))
-        max_loss_single_stock = min(max_loss_single_stock, float(result_row[15]))
-        max_gain_single_stock = max(max_gain_single_stock, float(result_row[16]))
-
-    idx = -1
-
-    # Annualized return
-    idx += 1
-    rows[idx].append(misc.round_or_none(json['stats'][port_or_bench]['annualized_return'], precision))
-
-    # Average excess return
-    idx += 1
-    rows[idx].append(
-        misc.round_or_none(json['stats']['port']['annualized_return'] - json['stats']['bench']['annualized_return'],
-                           precision)
-        if port_mode else None
-    )
-
-    # Total return
-    idx += 1
-    rows[idx].append(misc.round_or_none(json['stats'][port_or_bench]['total_return'], precision))
-
-    # % of periods strategy outperforms
-    idx += 1
-    rows[idx].append(round(per_outperform_cnt / len(json['results']['rows']) * 100, precision) if port_mode else None)
-
-    # Max gain
-    idx += 1
-    rows[idx].append(round(max_gain, precision))
-
-    # Max loss
-    idx += 1
-    rows[idx].append(round(max_loss, precision))
-
-    # Max gain single stock
-    idx += 1
-    rows[idx].append(round(max_gain_single_stock, precision) if port_mode else None)
-
-    # Max loss single stock
-    idx += 1
-    rows[idx].append(round(max_loss_single_stock, precision) if port_mode else None)
-
-    # Avg excess return in Up markets
-    idx += 1
-    rows[idx].append(misc.round_or_none(json['results']['upMarkets'][10], precision) if port_mode else None)
-
-    # Avg Excess Return in Down Markets
-    idx += 1
-    rows[idx].append(misc.round_or_none(json['results']['downMarkets'][10], precision) if port_mode else None)
-
-    # Sharpe
-    idx += 1
-    rows[idx].append(misc.round_or_none(json['stats'][port_or_bench].get('sharpe_ratio'), precision))
-
-    # Sortino
-    idx += 1
-    rows[idx].append(misc.round_or_none(json['stats'][port_or_bench].get('sortino_ratio'), precision))
-
-    # StdDev
-    idx += 1
-    rows[idx].append(misc.round_or_none(json['stats'][port_or_bench].get('standard_dev'), precision))
-
-    # Max Drawdown
-    idx += 1
-    rows[idx].append(misc.round_or_none(json['stats'][port_or_bench].get('max_drawdown'), precision))
-
-    # Beta
-    idx += 1
-    rows[idx].append(misc.round_or_none(
-        json['stats']['beta'], precision) if port_mode and json['stats'].get('beta') else None)
-
-    # Alpha
-    idx += 1
-    rows[idx].append(misc.round_or_none(
-        json['stats']['alpha'], precision) if port_mode and json['stats'].get('alpha') else None)
-
-    # Avg Number of Positions
-    idx += 1
-    rows[idx].append(misc.round_or_none(json['results']['average'][4], precision) if port_mode else None)
+def _get_bucket_metrics(returns: list, precision):
+    """
+    :return: values of data_cons.RANK_PERF_BUCKET_METRICS from the annualized returns of the buckets (None for runs
+        that failed, they are left out)
+    """
+    points = [(idx + 1, ret) for idx, ret in enumerate(returns) if ret is not None]
+    if len(points) < 2:
+        return [None] * len(data_cons.RANK_PERF_BUCKET_METRICS)
+    buckets, returns = zip(*points)
+    bucket_mean = math.fsum(buckets) / len(buckets)
+    return_mean = math.fsum(returns) / len(returns)
+    bucket_var = math.fsum((bucket - bucket_mean) ** 2 for bucket in buckets)
+    slope = math.fsum((bucket - bucket_mean) * (ret - return_mean) for bucket, ret in points) / bucket_var
+
+    # spearman correlation of bucket and return ranks, ties get their average rank
+    order = sorted(range(len(returns)), key=returns.__getitem__)
+    return_ranks = [0.0] * len(returns)
+    start = 0
+    while start < len(order):
+        end = start
+        while end + 1 < len(order) and returns[order[end + 1]] == returns[order[start]]:
+            end += 1
+        for pos in range(start, end + 1):
+            return_ranks[order[pos]] = (start + end) / 2 + 1
+        start = end + 1
+    rank_mean = math.fsum(return_ranks) / len(return_ranks)
+    bucket_ranks = range(1, len(buckets) + 1)
+    covariance = math.fsum(
+        (bucket - rank_mean) * (rank - rank_mean) for bucket, rank in zip(bucket_ranks, return_ranks))
+    variance = math.sqrt(math.fsum((bucket - rank_mean) ** 2 for bucket in bucket_ranks)
+                         * math.fsum((rank - rank_mean) ** 2 for rank in return_ranks))
+    monotonicity = covariance / variance if variance else None
+
+    return [round(slope, precision), misc.round_or_none(monotonicity, precision),
+            round(returns[-1] - returns[0], precision)]
+
+
+def process_rank_perf_results(jsons: list, precision, bucket_metrics: bool = False):
+    """
+    Metrics of all the runs of a rank performance iteration at once
+    :param jsons: responses of the bucket runs, then of the universe run (None for failed runs)
+    :param precision:
+    :param bucket_metrics: add data_cons.RANK_PERF_BUCKET_METRICS, given in the universe column
+    :return: one row per metric: name, then value for each bucket, the universe and the benchmark
+    """
+    if precision is None:
+        precision = 2
+    columns = []
+    for json in jsons:
+        columns.append(_get_rank_perf_metrics(json, True, precision) if json is not None else None)
+    universe = jsons[-1]
+    columns.append(_get_rank_perf_metrics(universe, False, precision) if universe is not None else None)
+    rows = [[metric] + [column[idx] if column is not None else None for column in columns]
+            for idx, metric in enumerate(data_cons.RANK_PERF_METRICS)]
+    if bucket_metrics:
+        rows += get_rank_perf_bucket_rows([
+            json['stats']['port'].get('annualized_return') if json is not None else None for json in jsons[:-1]
+        ], precision)
+    return rows
+
+
+def get_rank_perf_bucket_rows(returns: list, precision):
+    """
+    :param returns: annualized returns of the buckets (None for runs that failed)
+    :param precision:
+    :return: one row per data_cons.RANK_PERF_BUCKET_METRICS metric, its value given in the universe column
+    """
+    padding = [None] * len(returns)
+    return [[metric] + padding + [value, None]
+            for metric, value in zip(data_cons.RANK_PERF_BUCKET_METRICS, _get_bucket_metrics(returns, precision))]
 
 
 def validate_main(*, settings, logger: logging.Logger):
@@ -226,6 +319,36 @@ def validate_iteration(*, operation, iteration_idx, iteration_data, logger: logg
     return True
 
 
+def _uses_local_bucket_engine(settings):
+    return misc.coalesce(settings.get('Bucket Engine'), data_cons.RANK_PERF_ENGINES[0]).lower() == 'local'
+
+
+def _is_formula_ranking(ranking):
+    return ranking is not None and misc.is_dict(ranking['value']) and 'Formula' in ranking['value']
+
+
+def validate_rank_perf_settings(settings, logger: logging.Logger):
+    if _uses_local_bucket_engine(settings) and _is_formula_ranking(settings.get('Ranking')):
+        logger.error('"Default Settings" section: "Ranking" formulas are not supported by the local "Bucket Engine", '
+                     'use a ranking system or the server engine')
+        return False
+    return True
+
+
+def validate_rank_perf_iteration(settings, iteration_idx, iteration_data, logger: logging.Logger):
+    if not _uses_local_bucket_engine(settings):
+        return True
+    ranking = iteration_data.get('Ranking', settings.get('Ranking'))
+    if ranking is None:
+        logger.error(f'Iteration #{iteration_idx + 1}: the local "Bucket Engine" requires a "Ranking"')
+        return False
+    if _is_formula_ranking(ranking):
+        logger.error(f'Iteration #{iteration_idx + 1}: "Ranking" formulas are not supported by the local '
+                     '"Bucket Engine", use a ranking system or the server engine')
+        return False
+    return True
+
+
 def validate_data_settings(settings, logger: logging.Logger):
     if 'Start Date' not in settings:
         logger.error('"Default Settings" section needs to contain the "Start Date" property')
@@ -245,24 +368,4 @@ def validate_data_settings(settings, logger: logging.Logger):
         logger.error('"Default Settings" section can only contain one of the following properties: '
                      '"P123 UIDs", "Tickers", "Cusips", "Gvkeys" or "Ciks"')
         return False
-
-    if 'P123 UIDs' in settings:
-        items = settings['P123 UIDs']
-    elif 'Tickers' in settings:
-        items = settings['Tickers']
-    elif 'Cusips' in settings:
-        items = settings['Cusips']
-    elif 'Gvkeys' in settings:
-        items = settings['Gvkeys']
-    else:
-        items = settings['Ciks']
-    if misc.is_int(items):
-        items = [items]
-    elif misc.is_str(items):
-        items = items.split(' ')
-    items_cnt = len(items)
-    if items_cnt > 100:
-        logger.error('"Default Settings" can only contain at most 100 '
-                     '"P123 UIDs", "Tickers", "Cusips", "Gvkeys" or "Ciks"')
-        return False
     return True
@@ -0,0 +1,106 @@
+"""
+Fake P123 API client answering from deterministic data, and a runner of operations against it
+"""
+import copy
+import datetime
+import logging
+import threading
+from p123api import ClientException
+import p123.operation as operation
+from p123.checkpoint import Checkpoint
+
+logger = logging.getLogger('tests')
+
+
+def get_rank(uid: int, date: str):
+    """
+    :return: rank of a stock at a date, moves from one date to the next
+    """
+    return round((uid * 37 + datetime.date.fromisoformat(date).toordinal() * 3) % 1000 / 10, 1)
+
+
+class FakeClient:
+    """
+    Answers rank_ranks and data_universe requests for a universe of stocks, dates possibly snapped to an earlier one
+    """
+    def __init__(self, *, uids=(1, 2, 3), snapped: dict = None, universes: dict = None, failed_dates=(),
+                 crash_date: str = None):
+        """
+        :param uids: P123 UIDs of the universe
+        :param snapped: as of date => date the server answers with (YYYY-MM-DD), same date if missing
+        :param universes: date answered => P123 UIDs of the universe at that date, uids if missing
+        :param failed_dates: as of dates failing with a ClientException
+        :param crash_date: as of date failing with a RuntimeError, the way a crash aborts a run
+        """
+        self.requests = []
+        self._uids = list(uids)
+        self._snapped = snapped or {}
+        self._universes = universes or {}
+        self._failed_dates = set(failed_dates)
+        self._crash_date = crash_date
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_api_id():
+        return 'test'
+
+    @staticmethod
+    def get_token():
+        return 'token'
+
+    def _get_universe(self, params):
+        with self._lock:
+            self.requests.append(params)
+        as_of = params['asOfDt']
+        if as_of == self._crash_date:
+            raise RuntimeError('Crash')
+        if as_of in self._failed_dates:
+            raise ClientException('Request failed')
+        date = self._snapped.get(as_of, as_of)
+        uids = self._universes.get(date, self._uids)
+        return date, uids
+
+    def rank_ranks(self, params):
+        date, uids = self._get_universe(params)
+        return {'dt': date, 'p123Uids': uids, 'tickers': [f'T{uid}' for uid in uids],
+                'names': [f'Name {uid}' for uid in uids], 'ranks': [get_rank(uid, date) for uid in uids],
+                'naCnt': [0] * len(uids), 'finalStmt': [True] * len(uids)}
+
+    def data_universe(self, params):
+        date, uids = self._get_universe(params)
+        return {'dt': date, 'p123Uids': uids, 'tickers': [f'T{uid}' for uid in uids],
+                'names': [f'Name {uid}' for uid in uids],
+                'data': [[get_rank(uid, date) for uid in uids] for _ in params['formulas']]}
+
+
+def run(data: dict, client: FakeClient, *, cache=None, checkpoint_folder: str = None, output_file: str = None,
+        output_options: dict = None):
+    """
+    Runs an operation the way the command line does
+    :param data: input, validated on a copy
+    :return: the operation and the outcome of its run
+    """
+    data = copy.deepcopy(data)
+    assert operation.process_input(data=data, logger=logger)
+    checkpoint = None
+    if checkpoint_folder is not None:
+        checkpoint = Checkpoint(folder=checkpoint_folder, data=data, logger=logger)
+        checkpoint.load()
+    op = operation.Operation.init(
+        api_client=client, data=data, output=None, logger=logger, cache=cache, checkpoint=checkpoint,
+        output_file=output_file, output_options=output_options)
+    assert op is not None
+    return op, op.run()
+
+
+def get_ranks_period_input(start_date='2020-01-01', end_date='2020-01-25', **settings):
+    """
+    :return: input of a weekly RanksPeriod operation
+    """
+    return {
+        'Main': {'Operation': 'RanksPeriod'},
+        'Default Settings': dict({
+            'Ranking System': 'Core', 'Start Date': datetime.date.fromisoformat(start_date),
+            'End Date': datetime.date.fromisoformat(end_date), 'Frequency': '1Week'
+        }, **settings)
+    }
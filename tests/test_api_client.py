@@ -0,0 +1,79 @@
+"""
+API client wrapper: authentication of requests running in parallel
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from p123api import ClientException
+from p123.api_client import ApiClient
+
+logger = logging.getLogger('tests')
+
+
+class _Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeSessionClient:
+    """
+    Authenticates the way p123api.Client does: requests authenticate if the session has no token yet, a request made
+    with an expired token fails
+    """
+    def __init__(self, failures=()):
+        """
+        :param failures: exceptions raised by the first requests made with the first token
+        """
+        self.auth_cnt = 0
+        self._token = None
+        self._failures = list(failures)
+
+    @staticmethod
+    def get_api_id():
+        return 'test'
+
+    def get_token(self):
+        return self._token
+
+    def auth(self):
+        time.sleep(0.01)
+        self.auth_cnt += 1
+        self._token = f'token{self.auth_cnt}'
+
+    def screen_run(self, params):
+        if self._token is None:
+            self.auth()
+        if self._token == 'token1' and self._failures:
+            raise self._failures.pop(0)
+        return {'token': self._token}
+
+
+def test_parallel_requests_authenticate_once():
+    client = FakeSessionClient()
+    api_client = ApiClient(client=client, logger=logger)
+    with ThreadPoolExecutor(8) as executor:
+        responses = list(executor.map(api_client.screen_run, [{}] * 8))
+
+    assert client.auth_cnt == 1
+    assert responses == [{'token': 'token1'}] * 8
+
+
+@pytest.mark.parametrize('failure', [
+    ClientException('Expired', resp=_Response(401)),
+    # a concurrent request failing on the expired token removed the authorization header of the shared session
+    KeyError('Authorization')])
+def test_expired_token_is_renewed_once(failure):
+    client = FakeSessionClient([failure])
+    api_client = ApiClient(client=client, logger=logger)
+
+    assert api_client.screen_run({}) == {'token': 'token2'}
+    assert api_client.screen_run({}) == {'token': 'token2'}
+    assert client.auth_cnt == 2
+
+
+def test_other_failures_are_raised():
+    client = FakeSessionClient([ClientException('Bad request', resp=_Response(400))])
+    with pytest.raises(ClientException, match='Bad request'):
+        ApiClient(client=client, logger=logger).screen_run({})
+    assert client.auth_cnt == 1
@@ -0,0 +1,72 @@
+"""
+Operations making one request per as of date: dates resolving to the same date, resumed runs
+"""
+import logging
+import pytest
+from p123.cache import ResponseCache
+from fake_api import FakeClient, get_rank, get_ranks_period_input, run
+
+logger = logging.getLogger('tests')
+
+
+def _get_wide_result(op):
+    """
+    :return: dates of the header and rows of a wide RanksPeriod result
+    """
+    header = op.get_result()[0]
+    return [str(item) for item in header[2:]], [list(row) for row in op.get_result()[1:]]
+
+
+def _get_expected_rows(dates, uids=(1, 2, 3)):
+    return [[uid, f'T{uid}'] + [get_rank(uid, date) for date in dates] for uid in uids]
+
+
+def test_ranks_period_leaves_out_snapped_duplicates():
+    # the 18th resolves to the 11th, already fetched
+    client = FakeClient(snapped={'2020-01-18': '2020-01-11'})
+    op, run_outcome = run(get_ranks_period_input(), client)
+
+    assert run_outcome
+    assert len(client.requests) == 4
+    dates, rows = _get_wide_result(op)
+    assert dates == ['2020-01-04', '2020-01-11', '2020-01-25']
+    assert rows == _get_expected_rows(dates)
+
+    op, run_outcome = run(get_ranks_period_input(**{'Output Layout': 'long'}), client)
+    assert sorted(set(row[2] for row in op.get_result()[1:])) == dates
+
+
+def test_resume_with_other_dates(tmp_path, caplog):
+    # the 4th and the 11th both resolve to the 3rd
+    snapped = {'2020-01-04': '2020-01-03', '2020-01-11': '2020-01-03'}
+    with pytest.raises(RuntimeError):
+        run(get_ranks_period_input(), FakeClient(snapped=snapped, crash_date='2020-01-18'),
+            checkpoint_folder=str(tmp_path / 'checkpoints'))
+
+    # another run learns that the 11th resolves to the 3rd and caches it: the resumed run leaves the 11th out
+    cache = ResponseCache(folder=str(tmp_path / 'cache'), max_size=10 ** 7, recent_days=0, recent_ttl=0,
+                          logger=logger)
+    run(get_ranks_period_input(end_date='2020-01-18'), FakeClient(snapped=snapped), cache=cache)
+    client = FakeClient(snapped=snapped)
+    op, run_outcome = run(get_ranks_period_input(), client, cache=cache,
+                          checkpoint_folder=str(tmp_path / 'checkpoints'))
+
+    assert run_outcome
+    # the journal was written for other dates, nothing is restored: the 4th and the 18th come from the cache
+    assert 'Checkpoint was written for other tasks, discarding it' in caplog.text
+    assert [params['asOfDt'] for params in client.requests] == ['2020-01-25']
+    dates, rows = _get_wide_result(op)
+    assert dates == ['2020-01-03', '2020-01-18', '2020-01-25']
+    assert rows == _get_expected_rows(dates)
+
+
+@pytest.mark.parametrize('panel', ['sparse', 'delta'])
+def test_ranks_period_panels(panel):
+    # 2 leaves the universe on the 11th and comes back on the 25th
+    universes = {'2020-01-11': [1, 3], '2020-01-18': [1, 3, 4]}
+    dense_op, _ = run(get_ranks_period_input(), FakeClient(universes=universes))
+    op, run_outcome = run(get_ranks_period_input(Panel=panel), FakeClient(universes=universes))
+
+    assert run_outcome
+    assert _get_wide_result(op) == _get_wide_result(dense_op)
+    assert _get_wide_result(op)[1][1] == [2, 'T2', get_rank(2, '2020-01-04'), None, None, get_rank(2, '2020-01-25')]
@@ -0,0 +1,109 @@
+"""
+Local backtest analytics against hand-computed fixtures
+"""
+import datetime
+import pytest
+import p123.backtest as backtest
+import p123.util as util
+
+# weekly rebalance: 4 stocks, ranks and forward returns (%) of two periods
+RANK_JSONS = [
+    {'dt': '2020-01-04', 'p123Uids': [1, 2, 3, 4], 'ranks': [10, 30, 70, 90],
+     'additionalData': [[2], [4], [10], [0]]},
+    {'dt': '2020-01-11', 'p123Uids': [1, 2, 3, 4], 'ranks': [30, 10, 90, 70],
+     'additionalData': [[-1], [5], [1], [-3]]}
+]
+PERIODS_PER_YEAR = 365.25 / 7
+
+
+def _get_annualized(total, periods):
+    return ((1 + total / 100) ** (PERIODS_PER_YEAR / periods) - 1) * 100
+
+
+def _get_server_run(returns, bench, stock_min, stock_max, positions):
+    """
+    :return: screen_backtest response of a bucket run holding period returns (%) of the portfolio and the benchmark
+    """
+    port_total = ((1 + returns[0] / 100) * (1 + returns[1] / 100) - 1) * 100
+    bench_total = ((1 + bench[0] / 100) * (1 + bench[1] / 100) - 1) * 100
+    rows = [[None] * 8 + [str(ret), str(bench_ret), str(ret - bench_ret)] + [None] * 4 + [str(low), str(high)]
+            for ret, bench_ret, low, high in zip(returns, bench, stock_min, stock_max)]
+    return {
+        'stats': {
+            'port': {'annualized_return': _get_annualized(port_total, 2), 'total_return': port_total},
+            'bench': {'annualized_return': _get_annualized(bench_total, 2), 'total_return': bench_total}
+        },
+        'results': {'rows': rows, 'upMarkets': [None] * 11, 'downMarkets': [None] * 11,
+                    'average': [None] * 4 + [positions]}
+    }
+
+
+def _get_rows_by_metric(rows):
+    return {row[0]: row[1:] for row in rows}
+
+
+def test_local_bucket_returns_match_server_response():
+    # bucket 1 holds stocks 1 and 2, bucket 2 stocks 3 and 4, the universe stands in for the benchmark
+    universe = [4.0, 0.5]
+    server = util.process_rank_perf_results([
+        _get_server_run([3.0, 2.0], universe, [2.0, -1.0], [4.0, 5.0], 2),
+        _get_server_run([5.0, -1.0], universe, [0.0, -3.0], [10.0, 1.0], 2),
+        _get_server_run(universe, universe, [0.0, -3.0], [10.0, 5.0], 4)
+    ], 4)
+    local = backtest.process_rank_perf(rank_jsons=RANK_JSONS, bench_json=None, buckets=2, days=7, precision=4)
+
+    server, local = _get_rows_by_metric(server), _get_rows_by_metric(local)
+    assert local['Total return'][:3] == pytest.approx([5.06, 3.95, 4.52])
+    for metric in ('Annualized return', 'Total return', '% of periods strategy outperforms', 'Max gain', 'Max loss',
+                   'Max gain single stock', 'Max loss single stock', 'Avg # of positions'):
+        assert local[metric][:3] == pytest.approx(server[metric][:3], abs=1e-3), metric
+
+
+def test_empty_bucket_is_flat():
+    # nothing ranks in the middle bucket the first week: it holds cash, the period still counts
+    rank_jsons = [
+        {'dt': '2020-01-04', 'p123Uids': [1, 2], 'ranks': [10, 90], 'additionalData': [[2], [4]]},
+        {'dt': '2020-01-11', 'p123Uids': [1, 2, 3], 'ranks': [10, 50, 90], 'additionalData': [[1], [6], [-2]]}
+    ]
+    rows = _get_rows_by_metric(
+        backtest.process_rank_perf(rank_jsons=rank_jsons, bench_json=None, buckets=3, days=7, precision=4))
+
+    assert rows['Total return'][:3] == pytest.approx([3.02, 6.0, 1.92])
+    assert rows['Annualized return'][1] == pytest.approx(_get_annualized(6.0, 2), abs=1e-3)
+    assert rows['Max loss'][1] == 0.0
+    assert rows['Avg # of positions'][:3] == pytest.approx([1.0, 0.5, 1.0])
+
+
+def _get_chart(returns, bench):
+    """
+    :return: screen backtest chart of weekly period returns (%), cumulative like the server's
+    """
+    screen_returns, bench_returns = [0.0], [0.0]
+    for ret, bench_ret in zip(returns, bench):
+        screen_returns.append(((1 + screen_returns[-1] / 100) * (1 + ret / 100) - 1) * 100)
+        bench_returns.append(((1 + bench_returns[-1] / 100) * (1 + bench_ret / 100) - 1) * 100)
+    dates = [str(datetime.date(2020, 1, 4) + datetime.timedelta(days=7 * idx)) for idx in range(len(screen_returns))]
+    return {'dates': dates, 'screenReturns': screen_returns, 'benchReturns': bench_returns}
+
+
+@pytest.mark.parametrize('window', [2, 3, 4])
+def test_rolling_stats_match_window_stats(window):
+    chart = backtest.Chart(_get_chart([2.0, -3.0, 1.5, 4.0, -6.0, 2.5], [1.0, -2.0, 0.5, 1.5, -3.0, 2.0]))
+    rolling = chart.get_rolling_stats(window)
+
+    assert rolling[:window] == [None] * window
+    for end in range(window, len(chart.dates)):
+        # naive recomputation: Ann Return, Max Dd, Sharpe, Sortino, Beta, Alpha of the window on its own
+        stats = chart.get_stats(end - window, end)
+        expected = [stats[idx] for idx in (2, 4, 5, 6, 8, 9)]
+        assert rolling[end] == pytest.approx(expected), end
+
+
+def test_rolling_drawdown():
+    chart = backtest.Chart(_get_chart([10.0, -20.0, 25.0], [1.0, -1.0, 2.0]))
+    assert [stats[1] if stats else None for stats in chart.get_rolling_stats(2)] == pytest.approx(
+        [None, None, -20.0, -20.0])
+
+    # wiped out: the equity stays at 0
+    chart = backtest.Chart(_get_chart([10.0, -100.0, 5.0], [1.0, -1.0, 2.0]))
+    assert [stats[1] if stats else None for stats in chart.get_rolling_stats(2)] == [None, None, -100.0, -100.0]
@@ -0,0 +1,109 @@
+"""
+Checkpoint journals: records restored by the next run of the same input, run keys and expiration
+"""
+import copy
+import logging
+import os
+import time
+import pytest
+import p123.operation as operation
+from p123.checkpoint import Checkpoint, get_input_hash, get_run_key, remove_expired
+from fake_api import FakeClient, get_ranks_period_input, run
+
+logger = logging.getLogger('tests')
+
+
+def _get_data(**settings):
+    data = get_ranks_period_input(**settings)
+    assert operation.process_input(data=data, logger=logger)
+    return data
+
+
+def _new_checkpoint(folder, data=None):
+    return Checkpoint(folder=str(folder), data=data or _get_data(), logger=logger)
+
+
+def test_journal_round_trip(tmp_path):
+    checkpoint = _new_checkpoint(tmp_path)
+    assert checkpoint.load() == 0
+    checkpoint.add_result(0, {'dt': '2020-01-03'})
+    checkpoint.add_run(1, 0, [1.5, 2.5])
+    checkpoint.add_result(2, ['a', 2])
+    # already journaled
+    checkpoint.add_result(0, {'dt': 'other'})
+    checkpoint.close()
+
+    checkpoint = _new_checkpoint(tmp_path)
+    assert checkpoint.load() == 2
+    assert checkpoint.pop_results() == {0: {'dt': '2020-01-03'}, 2: ['a', 2]}
+    assert checkpoint.pop_runs() == {1: {0: [1.5, 2.5]}}
+
+    # another input has its own journal
+    assert _new_checkpoint(tmp_path, _get_data(**{'Ranking System': 'Other'})).load() == 0
+    checkpoint.discard()
+    assert _new_checkpoint(tmp_path).load() == 0
+
+
+def test_truncated_record_is_dropped(tmp_path):
+    checkpoint = _new_checkpoint(tmp_path)
+    for idx in range(3):
+        checkpoint.add_result(idx, [idx] * 10)
+    checkpoint.close()
+    # a crash while writing the last record
+    file = next(tmp_path.glob('*.ckpt'))
+    os.truncate(file, os.path.getsize(file) - 5)
+
+    checkpoint = _new_checkpoint(tmp_path)
+    assert checkpoint.load() == 2
+    # the next record replaces the truncated one
+    checkpoint.add_result(2, [2] * 10)
+    checkpoint.close()
+    checkpoint = _new_checkpoint(tmp_path)
+    assert checkpoint.load() == 3
+    assert checkpoint.pop_results() == {idx: [idx] * 10 for idx in range(3)}
+
+    # not even a header
+    with open(file, 'wb') as f:
+        f.write(b'\x80')
+    assert _new_checkpoint(tmp_path).load() == 0
+    assert not file.exists()
+
+
+def test_run_key():
+    data = _get_data()
+    other_main = copy.deepcopy(data)
+    other_main['Main'].update({'Concurrency': 4, 'Memory Limit': '1GB', 'Bypass Cache': True, 'Incremental': True})
+    other_dates = _get_data(start_date='2019-06-01', end_date='2020-06-30')
+
+    # settings of the execution only
+    assert get_input_hash(other_main) == get_input_hash(data)
+    assert get_run_key(other_main) == get_run_key(data)
+    # the date range changes the result, not the store it accumulates into
+    assert get_input_hash(other_dates) != get_input_hash(data)
+    assert get_run_key(other_dates) == get_run_key(data)
+    assert get_run_key(_get_data(**{'Ranking System': 'Other'})) != get_run_key(data)
+
+
+def test_remove_expired(tmp_path):
+    for name in ('old.ckpt', 'recent.ckpt', 'old.txt'):
+        (tmp_path / name).write_bytes(b'')
+    old = time.time() - 15 * 86400
+    os.utime(tmp_path / 'old.ckpt', (old, old))
+    os.utime(tmp_path / 'old.txt', (old, old))
+
+    remove_expired(folder=str(tmp_path))
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['old.txt', 'recent.ckpt']
+
+
+def test_resume_after_crash(tmp_path):
+    folder = str(tmp_path / 'checkpoints')
+    with pytest.raises(RuntimeError):
+        run(get_ranks_period_input(), FakeClient(crash_date='2020-01-18'), checkpoint_folder=folder)
+
+    # the dates completed before the crash are restored, the journal is removed once done
+    client = FakeClient()
+    op, run_outcome = run(get_ranks_period_input(), client, checkpoint_folder=folder)
+    assert run_outcome
+    assert [params['asOfDt'] for params in client.requests] == ['2020-01-18', '2020-01-25']
+    assert list(op.get_result()) == list(run(get_ranks_period_input(), FakeClient())[0].get_result())
+    assert os.listdir(folder) == []
@@ -0,0 +1,197 @@
+"""
+Data operation: item lists split into shards and date ranges into chunks of requests, merged back in input and date
+order
+"""
+import csv
+import datetime
+import logging
+import threading
+import pytest
+from p123api import ClientException
+import p123.data.cons as data_cons
+import p123.export as export
+import p123.operation as operation
+
+logger = logging.getLogger('tests')
+
+
+def _get_fridays(start_date, end_date):
+    """
+    :return: Fridays from the one on or before the start date (the server answers with the closest earlier date it
+        has data for) to the end date
+    """
+    date = start_date - datetime.timedelta(days=(start_date.weekday() - 4) % 7)
+    dates = []
+    while date <= end_date:
+        dates.append(date)
+        date += datetime.timedelta(days=7)
+    return dates
+
+
+def _get_value(uid, date):
+    return float(int(uid) * 1000000 + date.toordinal())
+
+
+class FakeClient:
+    """
+    Answers data requests with one value per item and Friday
+    """
+    def __init__(self, failed_uid: str = None):
+        """
+        :param failed_uid: the requests for this item fail
+        """
+        self.requests = []
+        self._failed_uid = failed_uid
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_api_id():
+        return 'test'
+
+    @staticmethod
+    def get_token():
+        return 'token'
+
+    def data(self, params):
+        with self._lock:
+            self.requests.append(params)
+        if self._failed_uid in params['p123Uids']:
+            raise ClientException('Request failed')
+        dates = _get_fridays(
+            datetime.date.fromisoformat(params['startDt']), datetime.date.fromisoformat(params['endDt']))
+        return {
+            'dates': [str(date) for date in dates],
+            'items': {uid: {'ticker': f'T{uid}', 'series': [[_get_value(uid, date) for date in dates]]}
+                      for uid in params['p123Uids']}
+        }
+
+
+class Output:
+    """Preview written by an operation"""
+    def __init__(self):
+        self.text = ''
+
+    def write(self, text):
+        self.text += text
+
+
+def _init(item_cnt, start_date='2021-01-01', end_date='2021-03-31', client=None, on_error='Continue', output=None,
+          output_file=None, **main):
+    """
+    :param output_file: file the rows are streamed into
+    :param main: other settings of Main
+    :return: weekly Data operation over items 1 to item_cnt
+    """
+    data = {
+        'Main': dict({'Operation': 'Data', 'Concurrency': 3, 'On Error': on_error}, **main),
+        'Default Settings': {
+            'P123 UIDs': ' '.join(str(uid) for uid in range(1, item_cnt + 1)), 'Formulas': ['Close(0)'],
+            'Start Date': datetime.date.fromisoformat(start_date), 'End Date': datetime.date.fromisoformat(end_date),
+            'Frequency': '1Week'
+        }
+    }
+    assert operation.process_input(data=data, logger=logger)
+    return operation.Operation.init(
+        api_client=client or FakeClient(), data=data, output=output, logger=logger, output_file=output_file)
+
+
+def _run(item_cnt, start_date='2021-01-01', end_date='2021-03-31', client=None, on_error='Continue'):
+    """
+    :return: outcome, requests made and result rows of a weekly Data operation over items 1 to item_cnt
+    """
+    client = client or FakeClient()
+    op = _init(item_cnt, start_date, end_date, client, on_error)
+    run_outcome = op.run()
+    return run_outcome, client.requests, [list(row) for row in op.get_result()[1:]]
+
+
+def _get_expected_rows(item_cnt, start_date='2021-01-01', end_date='2021-03-31'):
+    dates = _get_fridays(datetime.date.fromisoformat(start_date), datetime.date.fromisoformat(end_date))
+    return [[str(date), str(uid), f'T{uid}', _get_value(str(uid), date)]
+            for date in dates for uid in range(1, item_cnt + 1)]
+
+
+@pytest.mark.parametrize('item_cnt, shard_sizes', [(100, [100]), (101, [100, 1]), (250, [100, 100, 50])])
+def test_shards_keep_item_order(item_cnt, shard_sizes):
+    run_outcome, requests, rows = _run(item_cnt)
+
+    assert run_outcome
+    assert sorted(len(params['p123Uids']) for params in requests) == sorted(shard_sizes)
+    assert rows == _get_expected_rows(item_cnt)
+
+
+def test_failed_request(caplog):
+    run_outcome, requests, rows = _run(10, client=FakeClient('3'))
+    assert run_outcome is False
+    assert len(requests) == 1
+
+    # the other shards are still written, the failed one is logged
+    run_outcome, requests, rows = _run(250, client=FakeClient('150'))
+    assert run_outcome is True
+    assert rows == [row for row in _get_expected_rows(250) if not 100 < int(row[1]) <= 200]
+    assert '1 of 3 requests failed, their items or dates are missing: Request 2/3 (items 101-200)' in caplog.text
+
+    run_outcome, requests, rows = _run(250, client=FakeClient('150'), on_error='Stop')
+    assert run_outcome is False
+
+
+@pytest.mark.parametrize('chunk_values, item_cnt, chunk_cnt', [(400, 100, 4), (300, 101, 5), (250, 250, 7)])
+def test_chunks_keep_dates(monkeypatch, chunk_values, item_cnt, chunk_cnt):
+    # 4, 3 and 2 weeks a request starting on Saturdays: the server answers each chunk with the Friday before, the
+    # last date of the previous chunk
+    monkeypatch.setattr(data_cons, 'DATA_CHUNK_VALUES', chunk_values)
+    run_outcome, requests, rows = _run(item_cnt, '2021-01-02', '2021-03-31')
+
+    assert run_outcome
+    assert len(requests) == chunk_cnt * ((item_cnt - 1) // data_cons.DATA_SHARD_SIZE + 1)
+    starts = sorted(set(params['startDt'] for params in requests))
+    assert starts[0] == '2021-01-02' and len(starts) == chunk_cnt
+    assert rows == _get_expected_rows(item_cnt, '2021-01-02', '2021-03-31')
+
+
+def test_memory_limit_spills_rows(tmp_path):
+    output = Output()
+    op = _init(250, output=output, **{'Memory Limit': '8KB'})
+    assert op.run()
+
+    # the blocks of the first weeks were moved into the spill file and are read back from it
+    result = op.get_result()
+    assert result.get_usage()[1] > 0
+    expected = _get_expected_rows(250)
+    assert [list(row) for row in result[1:]] == expected
+    assert result[-1] == expected[-1] and result[1] == expected[0]
+
+    # preview of the first 100 rows
+    lines = output.text.split('\n')
+    assert len(lines) == 1 + 100 + 1 and lines[-1] == 'Only showing first 100 rows in preview.'
+    assert lines[1].split() == [str(value) for value in expected[0][:3]] + [f'{expected[0][3]:.2f}']
+
+    file = str(tmp_path / 'data.csv')
+    assert export.write_result(result, file) == [file]
+    with open(file, newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ['Date', 'P123 UID', 'Ticker', 'Close(0)']
+    assert rows[1:] == [[str(value) for value in row] for row in expected]
+
+
+def test_streamed_output_matches_result(monkeypatch, tmp_path):
+    # 30 items a week in chunks of 2 weeks: the rows of the first chunk are held until the header is set with the
+    # second one, once there are 100 rows
+    monkeypatch.setattr(data_cons, 'DATA_CHUNK_VALUES', 60)
+    streamed_file = str(tmp_path / 'streamed.csv')
+    op = _init(30, '2021-01-01', '2021-12-31', output_file=streamed_file)
+    assert op.run()
+    result = op.get_result()
+    expected = _get_expected_rows(30, '2021-01-01', '2021-12-31')
+    assert len(result) == 1 + len(expected) > 1001
+    # rows written into the file are dropped, except for the first 1000 (preview)
+    assert result[1000] == expected[999]
+    with pytest.raises(IndexError):
+        result[1001]
+
+    op = _init(30, '2021-01-01', '2021-12-31')
+    assert op.run()
+    file = str(tmp_path / 'result.csv')
+    export.write_result(op.get_result(), file)
+    with open(file) as f, open(streamed_file) as streamed_f:
+        assert streamed_f.read() == f.read()
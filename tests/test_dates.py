@@ -0,0 +1,42 @@
+"""
+As of date grids and snapped dates
+"""
+import datetime
+from p123.dates import SnappedDates, iter_grid
+
+DATE = datetime.date.fromisoformat
+
+
+def test_grid_starts_on_saturday():
+    grid = list(iter_grid(DATE('2020-01-01'), DATE('2020-01-25'), '1Week'))
+    assert grid == [DATE('2020-01-04'), DATE('2020-01-11'), DATE('2020-01-18'), DATE('2020-01-25')]
+    # a Sunday start moves to the next Saturday
+    assert next(iter_grid(DATE('2020-01-05'), DATE('2020-01-25'))) == DATE('2020-01-11')
+
+
+def test_dedup_snapped_dates():
+    snapped_dates = SnappedDates()
+    # data stopped for two weeks: the 11th and the 18th both resolve to the 10th
+    snapped_dates.add(DATE('2020-01-04'), DATE('2020-01-03'))
+    snapped_dates.add(DATE('2020-01-11'), DATE('2020-01-10'))
+    snapped_dates.add(DATE('2020-01-18'), DATE('2020-01-10'))
+
+    assert snapped_dates.resolve(DATE('2020-01-15')) == DATE('2020-01-10')
+    assert snapped_dates.resolve(DATE('2020-01-19')) is None
+    assert snapped_dates.resolve(DATE('2020-01-02')) is None
+    grid = [DATE('2020-01-04'), DATE('2020-01-11'), DATE('2020-01-18'), DATE('2020-01-25')]
+    assert snapped_dates.dedup(grid) == [DATE('2020-01-04'), DATE('2020-01-11'), DATE('2020-01-25')]
+
+
+def test_ranges_round_trip():
+    snapped_dates = SnappedDates([['2020-01-03', '2020-01-04'], ['2020-01-10', '2020-01-11']])
+    assert snapped_dates.get_added_cnt() == 0
+    # extends the last range, a later as of date can still resolve to it
+    snapped_dates.add(DATE('2020-01-18'), DATE('2020-01-10'))
+    snapped_dates.add(DATE('2020-01-14'), DATE('2020-01-10'))
+
+    assert snapped_dates.get_added_cnt() == 1
+    assert snapped_dates.get_ranges() == [['2020-01-03', '2020-01-04']]
+    assert snapped_dates.get_ranges(final=False) == [['2020-01-03', '2020-01-04'], ['2020-01-10', '2020-01-18']]
+    assert SnappedDates(snapped_dates.get_ranges(final=False)).dedup(
+        [DATE('2020-01-11'), DATE('2020-01-18')]) == [DATE('2020-01-11')]
@@ -0,0 +1,114 @@
+"""
+Output sinks: column types of parquet files, runs accumulating into sqlite tables
+"""
+import sqlite3
+import pytest
+from p123.export import ParquetSink
+from p123.result import ResultStore, KEY, NUM
+from fake_api import FakeClient, get_rank, get_ranks_period_input, run
+
+
+
+def _write_parquet(file, header, rows, kinds=None, block_size=2):
+    """
+    :return: table read back from a parquet file streamed from a result, one row group per block_size rows
+    """
+    pa = pytest.importorskip('pyarrow')
+    pytest.importorskip('pyarrow.parquet')
+    result = ResultStore(kinds=kinds, block_size=block_size)
+    result.set_sink(ParquetSink(str(file)))
+    result.set_header(header)
+    result.extend(rows)
+    result.close()
+    return pa.parquet.read_table(str(file))
+
+
+def test_parquet_types(tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    rows = [['2020-01-03', 1001, 'AAPL', 10, 1.5], ['2020-01-03', 1002, 'MSFT', 20, None],
+            ['2020-01-10', 1001, 'AAPL', 30, 2.0], ['2020-01-10', 1003, None, None, 3.25]]
+    table = _write_parquet(tmp_path / 'result.parquet', ['Date', 'P123 UID', 'Ticker', 'Shares', 'Rank'], rows,
+                           kinds=[KEY, KEY, KEY, NUM, NUM])
+
+    assert table.schema.types == [pa.date32(), pa.int64(), pa.string(), pa.int64(), pa.float64()]
+    assert table.column('P123 UID').to_pylist() == [1001, 1002, 1001, 1003]
+    assert table.column('Shares').to_pylist() == [10, 20, 30, None]
+    assert table.column('Rank').to_pylist() == [1.5, None, 2.0, 3.25]
+
+
+@pytest.mark.parametrize('kind', [KEY, NUM])
+def test_parquet_widens_integer_columns(tmp_path, kind):
+    pa = pytest.importorskip('pyarrow')
+    # the second row group holds a fraction: the first one is rewritten with floats
+    rows = [[1, 2], [3, 4], [5, 6.5]]
+    table = _write_parquet(tmp_path / 'result.parquet', ['A', 'B'], rows, kinds=[kind, kind])
+
+    assert table.schema.types == [pa.int64(), pa.float64()]
+    assert table.column('A').to_pylist() == [1, 3, 5]
+    assert table.column('B').to_pylist() == [2.0, 4.0, 6.5]
+
+
+def _read_table(file, table='ranksperiod'):
+    """
+    :return: column names and rows of a sqlite table, by P123 UID then date
+    """
+    conn = sqlite3.connect(file)
+    try:
+        cursor = conn.execute(f'SELECT * FROM {table} ORDER BY "P123 UID"' + (
+            ', "Date"' if 'Date' in [row[1] for row in conn.execute(f'PRAGMA table_info({table})')] else ''))
+        return [item[0] for item in cursor.description], [list(row) for row in cursor]
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize('layout', ['wide', 'long'])
+def test_sqlite_rerun_replaces_rows(tmp_path, layout):
+    file = str(tmp_path / 'p123.sqlite')
+    tables = []
+    for _ in range(2):
+        _, run_outcome = run(get_ranks_period_input(**{'Output Layout': layout}), FakeClient(), output_file=file)
+        assert run_outcome
+        tables.append(_read_table(file))
+    # keyed by run key, P123 UID and date (long layout)
+    assert len(tables[0][1]) == (3 if layout == 'wide' else 3 * 4)
+    assert tables[1] == tables[0]
+
+
+UNIVERSES = {'2020-01-25': [1, 2, 3, 4], '2020-02-01': [1, 2, 3, 4]}
+DATES = ['2020-01-04', '2020-01-11', '2020-01-18', '2020-01-25', '2020-02-01']
+
+
+@pytest.mark.parametrize('incremental', [False, True])
+def test_sqlite_extended_wide_range(tmp_path, incremental):
+    file = str(tmp_path / 'p123.sqlite')
+    run(get_ranks_period_input(end_date='2020-01-18'), FakeClient(), output_file=file)
+    data = get_ranks_period_input(end_date='2020-02-01')
+    data['Main']['Incremental'] = incremental
+    # 4 enters the universe on the 25th
+    client = FakeClient(universes=UNIVERSES)
+    _, run_outcome = run(data, client, output_file=file)
+
+    assert run_outcome
+    assert [params['asOfDt'] for params in client.requests] == DATES[3 if incremental else 0:]
+    names, rows = _read_table(file)
+    assert names == ['Run Key', 'P123 UID', 'Ticker'] + DATES
+    assert [row[1:] for row in rows] == [
+        [uid, f'T{uid}'] + [get_rank(uid, date) if uid < 4 or date >= '2020-01-25' else None for date in DATES]
+        for uid in range(1, 5)]
+
+
+def test_sqlite_incremental_long_layout(tmp_path):
+    file = str(tmp_path / 'p123.sqlite')
+    run(get_ranks_period_input(end_date='2020-01-18', **{'Output Layout': 'long'}), FakeClient(), output_file=file)
+    data = get_ranks_period_input(end_date='2020-02-01', **{'Output Layout': 'long'})
+    data['Main']['Incremental'] = True
+    client = FakeClient(universes=UNIVERSES)
+    _, run_outcome = run(data, client, output_file=file)
+
+    assert run_outcome
+    assert [params['asOfDt'] for params in client.requests] == DATES[3:]
+    names, rows = _read_table(file)
+    assert names == ['Run Key', 'P123 UID', 'Ticker', 'Date', 'Rank']
+    assert [row[1:] for row in rows] == [
+        [uid, f'T{uid}', date, get_rank(uid, date)]
+        for uid in range(1, 5) for date in DATES if uid < 4 or date >= '2020-01-25']
@@ -0,0 +1,113 @@
+"""
+Pivot encodings read back against the dense panel
+"""
+import pytest
+from p123.pivot import Pivot
+
+# values by period and item, period 4 failed: 2 leaves at period 2 and comes back at period 5, 4 enters at period 3
+# and has no value at period 5
+PERIODS = [
+    {1: 10.0, 2: 20.0, 3: 30.0},
+    {1: 10.5, 2: 20.0, 3: 31},
+    {1: 10.5, 3: 31},
+    {1: 12.0, 3: 31, 4: 40.0},
+    None,
+    {1: 12.25, 2: 21.0, 3: 30.0, 4: None},
+]
+DENSE_ROWS = [
+    [1, 'T1', 10.0, 10.5, 10.5, 12.0, None, 12.25],
+    [2, 'T2', 20.0, 20.0, None, None, None, 21.0],
+    [3, 'T3', 30.0, 31, 31, 31, None, 30.0],
+    [4, 'T4', None, None, None, 40.0, None, None],
+]
+
+
+def _new_pivot(chunk_bytes=64 * 1024 * 1024, **kwargs):
+    pivot = Pivot(period_cnt=len(PERIODS), chunk_bytes=chunk_bytes, **kwargs)
+    for period_idx, values in enumerate(PERIODS):
+        if values is not None:
+            keys = list(values.keys())
+            pivot.add_period(period_idx, keys, list(values.values()), lambda idx: [keys[idx], f'T{keys[idx]}'])
+    return pivot
+
+
+def _none(value):
+    return None if value != value else value
+
+
+def _read_rows(pivot, period_idxs=None):
+    """
+    :return: rows read back block by block, NaN replaced with None
+    """
+    rows = []
+    for length, columns in pivot.iter_blocks(period_idxs):
+        assert all(len(column) == length for column in columns)
+        rows += [[_none(value) for value in row] for row in zip(*columns)]
+    return rows
+
+
+def _get_types(rows):
+    return [[type(value) for value in row] for row in rows]
+
+
+@pytest.mark.parametrize('encoding', ['dense', 'sparse', 'delta'])
+@pytest.mark.parametrize('chunk_bytes', [1, 64 * 1024 * 1024])
+def test_encodings_match_dense_panel(encoding, chunk_bytes):
+    # 1 byte chunks: one item per block
+    rows = _read_rows(_new_pivot(chunk_bytes, encoding=encoding))
+
+    assert rows == DENSE_ROWS
+    # integers read back as integers
+    assert _get_types(rows) == _get_types(DENSE_ROWS)
+    assert _read_rows(_new_pivot(chunk_bytes, encoding=encoding), [0, 5]) == [
+        row[:2] + [row[2], row[7]] for row in DENSE_ROWS]
+
+
+def test_delta_threshold():
+    pivot = _new_pivot(encoding='delta', threshold=0.6)
+    rows = _read_rows(pivot)
+
+    # moves within the threshold repeat the last recorded value, items keep their presence
+    assert rows[0] == [1, 'T1', 10.0, 10.0, 10.0, 12.0, None, 12.0]
+    assert rows[2] == [3, 'T3', 30.0, 31, 31, 31, None, 30.0]
+    for row, dense_row in zip(rows, DENSE_ROWS):
+        assert [value is None for value in row] == [value is None for value in dense_row]
+        assert all(abs(value - dense_value) <= 0.6 for value, dense_value in zip(row[2:], dense_row[2:])
+                   if value is not None)
+    assert pivot.get_stored_cnt() < _new_pivot(encoding='delta').get_stored_cnt()
+
+
+def _read_records(pivot):
+    labels = [f'P{period_idx}' for period_idx in range(len(PERIODS))]
+    records = []
+    for length, columns in pivot.iter_records(labels, block_size=3):
+        assert all(len(column) == length for column in columns)
+        records += [tuple(_none(value) for value in record) for record in zip(*columns)]
+    return records
+
+
+def test_long_layout_records():
+    assert _read_records(_new_pivot(encoding='sparse')) == [
+        (uid, f'T{uid}', f'P{period_idx}', value)
+        for period_idx, values in enumerate(PERIODS) for uid, value in (values or {}).items() if value is not None]
+
+    # values that moved, items entering again and items leaving (no value)
+    assert _read_records(_new_pivot(encoding='delta')) == [
+        (1, 'T1', 'P0', 10.0), (2, 'T2', 'P0', 20.0), (3, 'T3', 'P0', 30.0),
+        (1, 'T1', 'P1', 10.5), (3, 'T3', 'P1', 31),
+        (2, 'T2', 'P2', None),
+        (1, 'T1', 'P3', 12.0), (4, 'T4', 'P3', 40.0),
+        (1, 'T1', 'P5', 12.25), (2, 'T2', 'P5', 21.0), (3, 'T3', 'P5', 30.0), (4, 'T4', 'P5', None),
+    ]
+
+
+@pytest.mark.parametrize('item_cnt', [1, 2, 4])
+def test_spilled_panel_read_back_by_chunks(item_cnt):
+    # each chunk of item_cnt items reads the spill file once
+    pivot = _new_pivot(8 * len(PERIODS) * item_cnt, spill=True)
+    assert [length for length, _ in pivot.iter_blocks()] == [item_cnt] * (4 // item_cnt)
+
+    rows = _read_rows(pivot)
+    assert rows == DENSE_ROWS
+    assert _get_types(rows) == _get_types(DENSE_ROWS)
+    pivot.close()
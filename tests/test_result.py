@@ -0,0 +1,114 @@
+"""
+Columnar result store read back like the list of rows it replaces
+"""
+import datetime
+import pytest
+from p123.result import ResultStore, KEY, NUM, OBJ
+
+HEADER = ['Date', 'P123 UID', 'Ticker', 'Shares', 'Rank']
+ROWS = [
+    ['2020-01-03', 1001, 'AAPL', 10, 1.5],
+    ['2020-01-03', 1002, 'MSFT', 20.0, None],
+    ['2020-01-10', 1001, 'AAPL', None, 2.0],
+    ['2020-01-10', 1003, None, 2 ** 31, 0.1],
+    ['2020-01-17', 1002, 'MSFT', -7, 99.25],
+]
+
+
+def _new_store(rows, header=HEADER, kinds=(KEY, KEY, KEY, NUM, NUM), **kwargs):
+    store = ResultStore(kinds=kinds, **kwargs)
+    if header is not None:
+        store.set_header(header)
+    store.extend(rows)
+    return store
+
+
+def _get_types(rows):
+    return [[type(value) for value in row] for row in rows]
+
+
+@pytest.mark.parametrize('block_size', [2, 65536])
+def test_round_trip(block_size):
+    store = _new_store(ROWS, block_size=block_size)
+    expected = [HEADER] + ROWS
+
+    assert len(store) == len(expected)
+    assert store[:] == expected
+    # integers and floats read back with their own type
+    assert _get_types(store[1:]) == _get_types(ROWS)
+    assert store.get_row_cnt() == len(ROWS)
+    assert store.get_kinds() == [KEY, KEY, KEY, NUM, NUM]
+
+
+def test_list_compatibility():
+    for header in (HEADER, None):
+        store = _new_store(ROWS, header=header, block_size=2)
+        expected = ([header] if header is not None else []) + ROWS
+        assert len(store) == len(expected)
+        for idx in range(-len(expected), len(expected)):
+            assert store[idx] == expected[idx]
+        for idxs in (slice(1, 3), slice(None, None, 2), slice(-2, None), slice(3, 1), slice(1, 100)):
+            assert store[idxs] == expected[idxs]
+        with pytest.raises(IndexError):
+            store[len(expected)]
+        with pytest.raises(IndexError):
+            store[-len(expected) - 1]
+
+
+def test_key_columns_are_dictionary_encoded():
+    store = _new_store(ROWS, block_size=2)
+    blocks = list(store.iter_blocks())
+
+    assert [block.length for block in blocks] == [2, 2, 1]
+    dates, uids, tickers = (blocks[0].columns[idx].dictionary for idx in range(3))
+    # one dictionary for the whole store
+    assert dates is blocks[2].columns[0].dictionary
+    assert dates.values == ['2020-01-03', '2020-01-10', '2020-01-17']
+    assert uids.values == [1001, 1002, 1003]
+    assert tickers.values == ['AAPL', 'MSFT']
+    assert list(blocks[1].columns[2].codes) == [0, -1]
+
+
+def test_missing_values():
+    store = _new_store([[None, 1.0], ['a', float('nan')], ['b', 2]], header=None, kinds=[KEY, NUM], block_size=1)
+    # NaN is stored as a missing value
+    assert store[:] == [[None, 1.0], ['a', None], ['b', 2]]
+
+    # kinds inferred from the first row
+    store = _new_store([['a', None, 1, True]], header=None, kinds=None, block_size=1)
+    assert store.get_kinds() == [KEY, NUM, NUM, KEY]
+
+
+def test_fallback_to_plain_lists():
+    # values a typed column cannot hold: integers too large for a float, lists, booleans among numbers
+    rows = [[1, 'a', 1.5], [2 ** 60, ['b'], True], [3, 'c', 2.5]]
+    store = _new_store(rows, header=None, kinds=[NUM, KEY, NUM])
+
+    assert store[:] == rows
+    assert _get_types(store[:]) == _get_types(rows)
+    assert [column.kind for column in next(store.iter_blocks()).columns] == [OBJ, OBJ, OBJ]
+
+    # only the block holding the value falls back
+    store = _new_store(rows, header=None, kinds=[NUM, KEY, NUM], block_size=1)
+    assert [[column.kind for column in block.columns] for block in store.iter_blocks()] == [
+        [NUM, KEY, NUM], [OBJ, OBJ, OBJ], [NUM, KEY, NUM]]
+    assert store[:] == rows
+
+
+def test_float32():
+    store = _new_store(ROWS, float_type='float32')
+    assert store[:] == [HEADER] + ROWS
+    assert _get_types(store[1:]) == _get_types(ROWS)
+    assert next(store.iter_blocks()).columns[4].values.typecode == 'f'
+
+
+def test_append_columns():
+    store = ResultStore()
+    store.set_header(['Date', 'P123 UID', 'Rank'])
+    date = datetime.date(2020, 1, 3)
+    # the date is repeated over the rows
+    store.append_columns([date, [1, 2, 3], [1.5, None, 3]], 3)
+    store.append(['2020-01-10', 4, 0.5])
+
+    assert store[1:] == [[date, 1, 1.5], [date, 2, None], [date, 3, 3], ['2020-01-10', 4, 0.5]]
+    assert len(store) == 5
@@ -0,0 +1,77 @@
+"""
+Result processing of server responses against hand-computed fixtures
+"""
+import statistics
+import pytest
+import p123.util as util
+
+# rolling screen backtest rows, most recent first: positions (4), return (5), benchmark return (6), 8 and 9
+ROLLING_ROWS = [
+    [None] * 4 + [str(pos), str(ret), str(bench), None, str(low), str(high)]
+    for pos, ret, bench, low, high in [
+        (10, 2.0, 1.0, -5.0, 8.0), (12, -1.5, -0.5, -9.0, 4.0), (11, 3.0, 2.0, -2.0, 12.0),
+        (9, 0.5, 1.5, -4.0, 6.0), (10, -2.0, -1.0, -7.0, 3.0)
+    ]
+]
+
+
+def _get_geo_mean(returns):
+    return (statistics.geometric_mean(ret / 100 + 1 for ret in returns) - 1) * 100
+
+
+@pytest.mark.parametrize('windows', [[2, 3], [3, 6]])
+def test_rolling_screen_result_matches_naive_windows(windows):
+    average = [None] * 4 + [10.4, 0.4, 0.6, 1.1, None, None, 0.9]
+    row = util.process_screen_rolling_backtest_result(
+        {'rows': ROLLING_ROWS, 'average': average}, '2020-01-01', '2020-02-01', 4, windows)
+
+    returns = [float(item[5]) for item in ROLLING_ROWS]
+    positions = [float(item[4]) for item in ROLLING_ROWS]
+    # recomputed window by window, None for windows longer than the result
+    expected = ['2020-01-01', '2020-02-01', 5, 10.4, 0.4, 0.6, 1.1, -9.0, 12.0, 0.9]
+    expected += [statistics.fmean(returns[:window]) if window <= 5 else None for window in windows]
+    expected += [_get_geo_mean(returns), _get_geo_mean([float(item[6]) for item in ROLLING_ROWS])]
+    expected += [_get_geo_mean(returns[:window]) if window <= 5 else None for window in windows]
+    expected.append(statistics.fmean(positions[:max(windows)]) if max(windows) <= 5 else None)
+
+    # the columns start with the name of the iteration
+    assert len(row) == len(util.get_rolling_screen_columns(windows)) - 1
+    assert row[:3] == expected[:3]
+    assert row[3:] == pytest.approx(expected[3:], abs=1e-4)
+
+
+def test_bucket_metrics():
+    # buckets 1, 2, 3 returning 1%, 3%, 2%
+    rows = util.get_rank_perf_bucket_rows([1.0, 3.0, 2.0], 4)
+
+    # slope: covariance 1 over variance 2, monotonicity: spearman of [1, 2, 3] and [1, 3, 2], spread: 2 - 1
+    assert rows == [['Bucket return slope', None, None, None, 0.5, None],
+                    ['Bucket return monotonicity', None, None, None, 0.5, None],
+                    ['Top minus bottom spread', None, None, None, 1.0, None]]
+    # failed runs are left out, the buckets keep their number
+    assert util.get_rank_perf_bucket_rows([1.0, None, 2.0], 4)[0][4] == 0.5
+
+
+def test_rank_perf_results():
+    def get_run(returns, bench):
+        rows = [[None] * 8 + [str(ret), str(bench_ret), str(ret - bench_ret)] + [None] * 4 + ['-1.0', '7.0']
+                for ret, bench_ret in zip(returns, bench)]
+        return {'stats': {'port': {'annualized_return': 12.0, 'total_return': 5.06, 'max_drawdown': -1.0},
+                          'bench': {'annualized_return': 10.0, 'total_return': 4.52}, 'beta': 0.8},
+                'results': {'rows': rows, 'upMarkets': [None] * 10 + [-0.5], 'downMarkets': [None] * 11,
+                            'average': [None] * 4 + [2.0]}}
+
+    # one bucket then the universe run
+    rows = util.process_rank_perf_results([get_run([3.0, 2.0], [4.0, 0.5]), get_run([4.0, 0.5], [4.0, 0.5])], 2)
+    rows = {row[0]: row[1:] for row in rows}
+
+    assert rows['Annualized return'] == [12.0, 12.0, 10.0]
+    assert rows['Average excess return'] == [2.0, 2.0, None]
+    assert rows['% of periods strategy outperforms'] == [50.0, 0.0, None]
+    assert rows['Max gain'] == [3.0, 4.0, 4.0]
+    assert rows['Max loss'] == [2.0, 0.5, 0.5]
+    assert rows['Max gain single stock'] == [7.0, 7.0, None]
+    assert rows['Avg excess return in Up Markets'] == [-0.5, -0.5, None]
+    assert rows['Max Drawdown'] == [-1.0, -1.0, None]
+    assert rows['Beta'] == [0.8, 0.8, None]
+    assert rows['Avg # of positions'] == [2.0, 2.0, None]
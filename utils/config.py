@@ -1,5 +1,7 @@
 import logging
+import platform
 import configparser
+from pathlib import Path
 
 
 class Config(configparser.ConfigParser):
@@ -15,3 +17,17 @@ class Config(configparser.ConfigParser):
                 self.write(stream)
         except OSError as e:
             self._logger.error(e)
+
+
+def get_app_user_folder():
+    """
+    Returns the application user folder (created if missing), None on unsupported platforms
+    """
+    if platform.system() == 'Darwin':
+        folder = '{}/Library/Preferences/DataMiner'.format(Path.home())
+    elif platform.system() == 'Windows' or platform.system() == 'Linux':
+        folder = '{}/DataMiner'.format(Path.home())
+    else:
+        return
+    Path(folder).mkdir(parents=True, exist_ok=True)
+    return folder
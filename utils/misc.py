@@ -3,6 +3,7 @@ import re
 
 
 date_regex = re.compile('\\d{1,2}/\\d{1,2}/(\\d{2}|\\d{4})')
+size_regex = re.compile('(\\d+(?:\\.\\d*)?)\\s*([kmgt]?)b?', re.IGNORECASE)
 
 
 def is_list(i):
@@ -56,3 +57,15 @@ def parse_date(val):
             val[1] = '0' + val[1]
         val = datetime.datetime.strptime('/'.join(val), '%m/%d/%Y' if len(val[2]) == 4 else '%m/%d/%y')
     return val if is_date(val) else None
+
+
+def parse_size(val):
+    """
+    :return: number of bytes of a size such as 512MB or 2GB (plain numbers are bytes), None if not valid
+    """
+    if is_int(val) and not is_bool(val):
+        return val
+    match = size_regex.fullmatch(val.strip()) if is_str(val) else None
+    if match is None:
+        return None
+    return int(float(match.group(1)) * 1024 ** ' kmgt'.index(match.group(2).lower() or ' '))